@@ -1,11 +1,15 @@
-﻿from flask import Flask, request
+﻿from flask import Flask, Response, jsonify, request
+import numpy as np
 import pandas as pd
 import os
-import math
+import threading
+import time
 from datetime import datetime
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error
+
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from model_registry import ModelRegistry
+from online_regression import HoldoutRegression
+from sample_store import SAMPLE_COLUMNS, ColumnStore
 
 app = Flask(__name__)
 
@@ -13,77 +17,128 @@ app = Flask(__name__)
 DATA_DIR = "data"
 os.makedirs(DATA_DIR, exist_ok=True)
 
-DATA_PATH   = os.path.join(DATA_DIR, "training.csv")
+DATA_PATH   = os.path.join(DATA_DIR, "training.csv")        # legacy, imported once
 MODEL_PATH  = os.path.join(DATA_DIR, "model.csv")
-HISTORY_PATH = os.path.join(DATA_DIR, "model_history.csv")
+HISTORY_PATH = os.path.join(DATA_DIR, "model_history.csv")  # legacy, imported once
+STATE_PATH  = os.path.join(DATA_DIR, "model_state.npz")    # least-squares statistics
+SAMPLES_DIR = os.path.join(DATA_DIR, "samples")            # columnar training samples
+HISTORY_DIR = os.path.join(DATA_DIR, "history")            # columnar model history
 
 N_MIN_SAMPLES = 20   # must match ESP
+HOLDOUT_EVERY = 5    # every 5th sample is held out for validation (20 %)
+
+FEATURES = ["ratio", "ac", "dc", "PI_feature", "slope"]
+HISTORY_COLUMNS = ["timestamp", "n_samples", "rmse", "b0", "b1", "b2", "b3", "b4", "b5"]
+
+# ================== METRICS ==================
+SAMPLES_RECEIVED = REGISTRY.counter("ml_samples_total", "Training samples received", ("accepted",))
+UPDATE_SECONDS = REGISTRY.histogram("ml_update_seconds", "Sample append + statistics update + state save")
+FIT_SECONDS = REGISTRY.histogram("ml_fit_seconds", "Coefficient solve, validation and archive")
+MODEL_REQUESTS = REGISTRY.counter("ml_latest_model_total", "/latest-model responses", ("status",))
+PREDICT_ROWS = REGISTRY.counter("ml_predict_rows_total", "Rows scored by /predict")
+PREDICT_SECONDS = REGISTRY.histogram("ml_predict_seconds", "/predict batch evaluation")
+
+# ================== STORAGE ==================
+
+def open_stores():
+    """
+    Open the columnar stores; the first time, pull in the old CSV files
+    and rename them to *.imported so they are never imported twice.
+    """
+    samples = ColumnStore(SAMPLES_DIR, SAMPLE_COLUMNS)
+    if len(samples) == 0 and os.path.isfile(DATA_PATH):
+        n = samples.import_csv(DATA_PATH)
+        os.replace(DATA_PATH, DATA_PATH + ".imported")
+        print(f"Imported {n} samples from {DATA_PATH}")
+
+    history = ColumnStore(HISTORY_DIR, HISTORY_COLUMNS)
+    if len(history) == 0 and os.path.isfile(HISTORY_PATH):
+        df = pd.read_csv(HISTORY_PATH)
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).map(datetime.timestamp)
+        history.extend({c: df[c].to_numpy(float) for c in HISTORY_COLUMNS})
+        os.replace(HISTORY_PATH, HISTORY_PATH + ".imported")
+
+    return samples, history
+
+
+samples_store, history_store = open_stores()
 
 # ================== HELPERS ==================
 
 def load_data():
-    if not os.path.isfile(DATA_PATH):
+    if len(samples_store) == 0:
         return None
 
-    df = pd.read_csv(DATA_PATH)
+    df = samples_store.to_frame()
 
     required = {"ratio", "ac", "dc", "PI_feature", "slope", "glucose"}
-    if not required.issubset(df.columns):
-        missing = required - set(df.columns)
-        raise ValueError(f"Missing columns in training.csv: {missing}")
-
     df = df.dropna(subset=list(required))
     df = df[(df["glucose"] >= 40) & (df["glucose"] <= 400)]
 
     return df
 
 
-def train_and_validate(df):
-    if len(df) < N_MIN_SAMPLES:
-        return None, None, None
+def parse_sample(data):
+    """(features, glucose) for a usable sample, None if load_data would drop it."""
+    try:
+        x = [float(data[k]) for k in FEATURES]
+        y = float(data["glucose"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if any(v != v for v in x) or not 40 <= y <= 400:
+        return None
+    return x, y
 
-    X = df[["ratio", "ac", "dc", "PI_feature", "slope"]]
-    y = df["glucose"]
 
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
+def load_model():
+    """
+    Restore the least-squares statistics; on first start (or if the state
+    file is gone) rebuild them once from the sample store, in order.
+    """
+    if os.path.isfile(STATE_PATH):
+        return HoldoutRegression.load(STATE_PATH, len(FEATURES))
+
+    model = HoldoutRegression(len(FEATURES), HOLDOUT_EVERY)
+    df = load_data()
+    if df is not None:
+        for x, y in zip(df[FEATURES].to_numpy(float), df["glucose"].to_numpy(float)):
+            model.update(x, y)
+        model.save(STATE_PATH)
+    return model
 
-    model = LinearRegression()
-    model.fit(X_train, y_train)
 
-    y_pred = model.predict(X_val)
-    rmse = math.sqrt(mean_squared_error(y_val, y_pred))
+model = load_model()
+model_lock = threading.Lock()
+deployed = ModelRegistry(MODEL_PATH, len(FEATURES))
+
+
+def train_and_validate():
+    """
+    Solve for the current coefficients from the running statistics, which
+    gives the same model as refitting LinearRegression on the training
+    rows, and archive it. O(features^2) however much data there is.
+    """
+    n_samples = model.n
+    if n_samples < N_MIN_SAMPLES:
+        return None, None, None
+
+    intercept, coef, rmse = model.fit()
 
-    b0 = float(model.intercept_)
-    b1, b2, b3, b4, b5 = [float(c) for c in model.coef_]
+    b0 = intercept
+    b1, b2, b3, b4, b5 = [float(c) for c in coef]
 
     coeff_line = f"{b0:.6f},{b1:.6f},{b2:.6f},{b3:.6f},{b4:.6f},{b5:.6f}"
 
-    # ✅ 1. OVERWRITE latest deployment model
-    with open(MODEL_PATH, "w") as f:
-        f.write(coeff_line + "\n")
+    # ✅ 1. OVERWRITE latest deployment model (atomically, and cached)
+    deployed.publish(coeff_line)
 
     # ✅ 2. APPEND model history
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    hist_row = pd.DataFrame([{
-        "timestamp": timestamp,
-        "n_samples": len(df),
-        "rmse": rmse,
-        "b0": b0,
-        "b1": b1,
-        "b2": b2,
-        "b3": b3,
-        "b4": b4,
-        "b5": b5
-    }])
-
-    file_exists = os.path.isfile(HISTORY_PATH)
-    hist_row.to_csv(HISTORY_PATH, mode="a",
-                    header=not file_exists,
-                    index=False)
-
-    return coeff_line, rmse, len(df)
+    history_store.append({
+        "timestamp": time.time(), "n_samples": n_samples, "rmse": rmse,
+        "b0": b0, "b1": b1, "b2": b2, "b3": b3, "b4": b4, "b5": b5,
+    })
+
+    return coeff_line, rmse, n_samples
 
 
 # ================== API ENDPOINT ==================
@@ -93,24 +148,29 @@ def receive_data():
     data = request.get_json()
     if data is None:
         return "ERROR;NO_JSON", 400
-
-    # ✅ Append new training sample
-    df_new = pd.DataFrame([data])
-    file_exists = os.path.isfile(DATA_PATH)
-    df_new.to_csv(DATA_PATH, mode="a", header=not file_exists, index=False)
-
-    df = load_data()
-    if df is None:
-        return "COLLECTING;N=0", 200
-
-    n_samples = len(df)
-
-    # ✅ Not enough samples yet
-    if n_samples < N_MIN_SAMPLES:
-        return f"COLLECTING;N={n_samples}", 200
-
-    # ✅ Train + validate + archive model
-    coeff_line, rmse, n_samples = train_and_validate(df)
+    if not isinstance(data, dict):
+        return "ERROR;NOT_OBJECT", 400
+
+    # ✅ Append new training sample, and fold it into the running
+    #    statistics (no re-read, no refit)
+    sample = parse_sample(data)
+    SAMPLES_RECEIVED.labels(sample is not None).inc()
+    with model_lock:
+        with UPDATE_SECONDS.time():
+            samples_store.append(data)
+            if sample is not None:
+                model.update(*sample)
+                model.save(STATE_PATH)
+
+        n_samples = model.n
+
+        # ✅ Not enough samples yet
+        if n_samples < N_MIN_SAMPLES:
+            return f"COLLECTING;N={n_samples}", 200
+
+        # ✅ Train + validate + archive model
+        with FIT_SECONDS.time():
+            coeff_line, rmse, n_samples = train_and_validate()
 
     response = (
         f"READY;N={n_samples};"
@@ -125,24 +185,77 @@ def receive_data():
 
 @app.route("/latest-model", methods=["GET"])
 def latest_model():
-    if not os.path.isfile(MODEL_PATH):
+    # ✅ Served from memory; devices that send the ETag they already
+    #    have get a 304 with no body until the coefficients change
+    current = deployed.get()
+    if current is None:
+        MODEL_REQUESTS.labels(404).inc()
+        return "NO_MODEL", 404
+
+    response = Response(current.line)
+    response.set_etag(current.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response = response.make_conditional(request)
+    MODEL_REQUESTS.labels(response.status_code).inc()
+    return response
+
+
+# ================== BATCH PREDICTION ==================
+
+@app.route("/predict", methods=["POST"])
+def predict():
+    """
+    Score a batch of [ratio, ac, dc, PI_feature, slope] rows, given as a
+    JSON list or as {"rows": [...]}, with the deployed coefficients;
+    rows with a missing (null) feature score null.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        return "ERROR;NO_JSON", 400
+    rows = data.get("rows") if isinstance(data, dict) else data
+
+    current = deployed.get()
+    if current is None:
         return "NO_MODEL", 404
 
-    with open(MODEL_PATH, "r") as f:
-        return f.readline().strip(), 200
+    with PREDICT_SECONDS.time():
+        try:
+            glucose = deployed.predict(rows, current)
+        except (TypeError, ValueError):
+            return "ERROR;BAD_ROWS", 400
+    PREDICT_ROWS.inc(len(glucose))
+
+    response = jsonify({
+        "coeffs": current.line,
+        "n": len(glucose),
+        "glucose": [float(g) if np.isfinite(g) else None for g in glucose],
+    })
+    response.set_etag(current.etag)
+    return response
 
 
 # ================== OPTIONAL: GET MODEL HISTORY ==================
 
 @app.route("/model-history", methods=["GET"])
 def model_history():
-    if not os.path.isfile(HISTORY_PATH):
+    if len(history_store) == 0:
         return "NO_HISTORY", 404
 
-    df = pd.read_csv(HISTORY_PATH)
+    df = history_store.to_frame()
+    df["timestamp"] = [
+        datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S") for t in df["timestamp"]
+    ]
+    df["n_samples"] = df["n_samples"].astype(int)
     return df.to_json(orient="records"), 200
 
 
+# ================== METRICS ENDPOINT ==================
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 # ================== RUN SERVER ==================
 
 if __name__ == "__main__":
@@ -2,26 +2,51 @@ import pandas as pd
 import numpy as np
 import argparse
 import os
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression
+import time
+import warnings
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.model_selection import GroupKFold, KFold, train_test_split
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
 import joblib
 
+from metrics import REGISTRY
+from sample_store import ColumnStore
+
 # ==============================
 # CONFIG
 # ==============================
 DEFAULT_OUTPUT_DIR = "offline_model"
+FEATURES = ["ratio", "ac", "dc", "PI_feature", "slope"]
+
+# feature expansions tried by --search: (degree, interaction_only)
+EXPANSIONS = {
+    "linear": None,
+    "interactions": (2, True),
+    "poly2": (2, False),
+}
+DEFAULT_ALPHAS = "0.001,0.01,0.1,1,10,100"
+
+LOAD_SECONDS = REGISTRY.gauge("trainer_load_seconds", "Dataset load time of the last run")
+FIT_SECONDS = REGISTRY.gauge("trainer_fit_seconds", "Model fit + evaluation time of the last run")
+TRAIN_SAMPLES = REGISTRY.gauge("trainer_samples", "Samples used in the last run")
 os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
 
 # ==============================
 # LOAD DATA
 # ==============================
 def load_data(path):
-    if not os.path.isfile(path):
+    # a directory is a columnar sample store (Flask's data/samples),
+    # memory-mapped instead of parsed; anything else is read as CSV
+    if os.path.isdir(path):
+        df = ColumnStore(path).to_frame()
+    elif os.path.isfile(path):
+        df = pd.read_csv(path)
+    else:
         raise FileNotFoundError(f"Dataset not found: {path}")
 
-    df = pd.read_csv(path)
-
     required_cols = {"ratio", "ac", "dc", "PI_feature", "slope", "glucose"}
     if not required_cols.issubset(df.columns):
         missing = required_cols - set(df.columns)
@@ -38,7 +63,7 @@ def load_data(path):
 # TRAIN MODEL
 # ==============================
 def train_model(df, test_size=0.2):
-    X = df[["ratio", "ac", "dc", "PI_feature", "slope"]]
+    X = df[FEATURES]
     y = df["glucose"]
 
     X_train, X_test, y_train, y_test = train_test_split(
@@ -57,6 +82,144 @@ def train_model(df, test_size=0.2):
     return model, mae, rmse, r2
 
 
+# ==============================
+# MODEL SEARCH
+# ==============================
+def make_estimator(expansion, family, alpha):
+    steps = []
+    if EXPANSIONS[expansion] is not None:
+        degree, interaction_only = EXPANSIONS[expansion]
+        steps.append(("expand", PolynomialFeatures(
+            degree, interaction_only=interaction_only, include_bias=False
+        )))
+    steps.append(("scale", StandardScaler()))
+    if family == "ridge":
+        steps.append(("model", Ridge(alpha=alpha)))
+    elif family == "lasso":
+        steps.append(("model", Lasso(alpha=alpha, max_iter=5000)))
+    else:
+        steps.append(("model", LinearRegression()))
+    return Pipeline(steps)
+
+
+def candidates(expansions, alphas):
+    out = []
+    for expansion in expansions:
+        out.append((expansion, "ols", None))
+        for family in ("ridge", "lasso"):
+            out.extend((expansion, family, a) for a in alphas)
+    return out
+
+
+def make_folds(n, folds, groups=None, seed=42):
+    if groups is not None:
+        splitter = GroupKFold(n_splits=folds)
+        return list(splitter.split(np.zeros(n), groups=groups))
+    splitter = KFold(n_splits=folds, shuffle=True, random_state=seed)
+    return list(splitter.split(np.zeros(n)))
+
+
+def _fold_score(data_key, cv_key, fold, expansion, family, alpha, X, y, train, test):
+    """
+    MAE / RMSE / R² of one candidate on one fold. Cached on disk by
+    (data_key, cv_key, fold, candidate); the arrays are not hashed.
+    """
+    model = make_estimator(expansion, family, alpha)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        model.fit(X[train], y[train])
+    y_pred = model.predict(X[test])
+    return (
+        mean_absolute_error(y[test], y_pred),
+        np.sqrt(mean_squared_error(y[test], y_pred)),
+        r2_score(y[test], y_pred),
+    )
+
+
+def search_models(df, folds=5, alphas=(1.0,), expansions=tuple(EXPANSIONS),
+                  group_col=None, n_jobs=-1, cache_dir=None, seed=42):
+    """
+    k-fold CV of every (expansion, family, alpha) candidate, one joblib
+    task per candidate and fold. Fold scores are memoized in `cache_dir`,
+    so widening a grid only fits the new points. Returns one row per
+    candidate, best (lowest mean MAE) first.
+    """
+    X = df[FEATURES].to_numpy(dtype=np.float64)
+    y = df["glucose"].to_numpy(dtype=np.float64)
+
+    groups = None
+    if group_col is not None:
+        if group_col not in df.columns:
+            raise ValueError(
+                f"Group column not in data: {group_col} (columns: {', '.join(df.columns)})"
+            )
+        groups = df[group_col].to_numpy()
+
+    splits = make_folds(len(df), folds, groups, seed)
+    data_key = joblib.hash((X, y))
+    cv_key = (folds, group_col, joblib.hash(groups), seed)
+
+    score = joblib.Memory(cache_dir, verbose=0).cache(
+        _fold_score, ignore=["X", "y", "train", "test"]
+    )
+    grid = candidates(expansions, alphas)
+    tasks = [(c, k) for c in grid for k in range(folds)]
+
+    scores = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(score)(data_key, cv_key, k, *c, X, y, *splits[k])
+        for c, k in tasks
+    )
+
+    per_candidate = {}
+    for (c, _), s in zip(tasks, scores):
+        per_candidate.setdefault(c, []).append(s)
+
+    rows = []
+    for (expansion, family, alpha), s in per_candidate.items():
+        s = np.array(s)
+        rows.append({
+            "expansion": expansion,
+            "family": family,
+            "alpha": alpha,
+            "mae": s[:, 0].mean(),
+            "mae_std": s[:, 0].std(),
+            "rmse": s[:, 1].mean(),
+            "r2": s[:, 2].mean(),
+        })
+    return pd.DataFrame(rows).sort_values("mae", ignore_index=True)
+
+
+def to_linear(pipeline):
+    """
+    Fold the scaler of a linear-expansion pipeline into its coefficients:
+    the same predictions from a LinearRegression on the raw features,
+    which is what save_model() / the ESP evaluate.
+    """
+    scaler = pipeline.named_steps["scale"]
+    est = pipeline.named_steps["model"]
+    coef = est.coef_ / scaler.scale_
+
+    model = LinearRegression()
+    model.coef_ = coef
+    model.intercept_ = float(est.intercept_ - coef @ scaler.mean_)
+    model.n_features_in_ = coef.size
+    return model
+
+
+def fit_candidate(df, row):
+    alpha = None if pd.isna(row["alpha"]) else float(row["alpha"])
+    model = make_estimator(row["expansion"], row["family"], alpha)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        model.fit(df[FEATURES].to_numpy(dtype=np.float64), df["glucose"].to_numpy())
+    return model
+
+
+def describe(row):
+    alpha = "" if pd.isna(row["alpha"]) else f" alpha={row['alpha']:g}"
+    return f"{row['expansion']}/{row['family']}{alpha}"
+
+
 # ==============================
 # SAVE MODEL
 # ==============================
@@ -80,11 +243,50 @@ def save_model(model, output_dir):
 # ==============================
 # MAIN
 # ==============================
+def run_search(df, args):
+    expansions = [e.strip() for e in args.expansions.split(",") if e.strip()]
+    unknown = set(expansions) - set(EXPANSIONS)
+    if unknown:
+        raise ValueError(f"Unknown expansions: {unknown}")
+    alphas = [float(a) for a in args.alphas.split(",") if a.strip()]
+
+    results = search_models(
+        df, folds=args.folds, alphas=alphas, expansions=expansions,
+        group_col=args.group_col, n_jobs=args.n_jobs,
+        cache_dir=args.cache_dir or os.path.join(args.output, "search_cache"),
+    )
+    os.makedirs(args.output, exist_ok=True)
+    results_path = os.path.join(args.output, "search_results.csv")
+    results.to_csv(results_path, index=False)
+
+    print(f"\n===== SEARCH ({len(results)} candidates x {args.folds} folds) =====")
+    print(results.head(10).to_string(index=False))
+    print(f"All results : {results_path}")
+
+    # the ESP evaluates b0 + b1*ratio + ... + b5*slope, so only the linear
+    # expansion can ship; a better expanded model is kept for reference
+    best = results.iloc[0]
+    linear = results[results["expansion"] == "linear"]
+    if linear.empty:
+        raise ValueError("--expansions must include 'linear' to export the ESP model")
+    chosen = linear.iloc[0]
+
+    if best["expansion"] != "linear":
+        best_path = os.path.join(args.output, "search_best.joblib")
+        joblib.dump(fit_candidate(df, best), best_path)
+        print(f"Best overall: {describe(best)} MAE {best['mae']:.2f} "
+              f"(linear gives up {chosen['mae'] - best['mae']:.2f} mg/dL) -> {best_path}")
+    print(f"Exported    : {describe(chosen)} (CV MAE {chosen['mae']:.2f})")
+
+    model = to_linear(fit_candidate(df, chosen))
+    return model, chosen["mae"], chosen["rmse"], chosen["r2"]
+
+
 def main():
     parser = argparse.ArgumentParser(description="Offline Glucose Model Trainer")
     parser.add_argument(
         "--data", type=str, required=True,
-        help="Path to training.csv from Flask"
+        help="Sample store directory (Flask's data/samples) or a training CSV"
     )
     parser.add_argument(
         "--test_size", type=float, default=0.2,
@@ -94,22 +296,72 @@ def main():
         "--output", type=str, default=DEFAULT_OUTPUT_DIR,
         help="Output directory for final model"
     )
+    parser.add_argument(
+        "--metrics_file", type=str, default=None,
+        help="Write timings in Prometheus text format (node-exporter textfile)"
+    )
+    parser.add_argument(
+        "--search", action="store_true",
+        help="Cross-validated search over feature expansions and ridge/lasso alphas"
+    )
+    parser.add_argument(
+        "--folds", type=int, default=5,
+        help="CV folds for --search (default 5)"
+    )
+    parser.add_argument(
+        "--alphas", type=str, default=DEFAULT_ALPHAS,
+        help=f"Comma-separated ridge/lasso alphas (default {DEFAULT_ALPHAS})"
+    )
+    parser.add_argument(
+        "--expansions", type=str, default=",".join(EXPANSIONS),
+        help="Comma-separated feature expansions: " + ", ".join(EXPANSIONS)
+    )
+    parser.add_argument(
+        "--group_col", type=str, default=None,
+        help="Column with a subject / device id: folds never split a group "
+             "(CSV input only; the sample store has no such column)"
+    )
+    parser.add_argument(
+        "--n_jobs", type=int, default=-1,
+        help="Parallel fits for --search (default: all cores)"
+    )
+    parser.add_argument(
+        "--cache_dir", type=str, default=None,
+        help="Fold score cache for --search (default <output>/search_cache)"
+    )
 
     args = parser.parse_args()
+    if args.group_col is not None and os.path.isdir(args.data):
+        # the Flask sample store keeps only the features and glucose
+        parser.error("--group_col needs a CSV with that column; "
+                     f"the sample store {args.data} has no subject / device id")
 
     print("\n==============================")
     print("OFFLINE GLUCOSE MODEL TRAINER")
     print("==============================")
 
+    t0 = time.perf_counter()
     df = load_data(args.data)
+    load_s = time.perf_counter() - t0
     print(f"Loaded {len(df)} samples")
 
-    model, mae, rmse, r2 = train_model(df, test_size=args.test_size)
+    t0 = time.perf_counter()
+    if args.search:
+        model, mae, rmse, r2 = run_search(df, args)
+    else:
+        model, mae, rmse, r2 = train_model(df, test_size=args.test_size)
+    fit_s = time.perf_counter() - t0
+
+    LOAD_SECONDS.set(load_s)
+    FIT_SECONDS.set(fit_s)
+    TRAIN_SAMPLES.set(len(df))
+
+    print(f"Load / fit time: {load_s:.3f} s / {fit_s:.3f} s")
 
     print("\n===== FINAL MODEL METRICS =====")
     print(f"MAE  : {mae:.2f} mg/dL")
     print(f"RMSE : {rmse:.2f} mg/dL")
-    print(f"R   : {r2:.4f}")
+    print(f"R²   : {r2:.4f}")
 
     os.makedirs(args.output, exist_ok=True)
     coeff_path, joblib_path = save_model(model, args.output)
@@ -126,6 +378,10 @@ def main():
         print("\nFinal Model:")
         print(f.read())
 
+    if args.metrics_file:
+        with open(args.metrics_file, "w") as f:
+            f.write(REGISTRY.render())
+
     print("==============================")
     print("TRAINING COMPLETE")
     print("==============================\n")
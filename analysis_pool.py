@@ -0,0 +1,183 @@
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from metrics import REGISTRY
+
+POOL_WINDOW_SECONDS = REGISTRY.histogram(
+    "resp_pool_window_seconds", "Analysis time of one window in a pool worker"
+)
+
+# ======================================================
+# WORKER-PROCESS SIDE
+# ======================================================
+_attached = {}      # shm name -> SharedMemory, one attach per process
+
+
+def _warm_worker():
+    # pay the neurokit2 / pandas import once, before the first window
+    import respiration
+    respiration.preload()
+
+
+def _analyze_slot(shm_name, slot, n, fs, intensity_threshold, fallback):
+    from respiration import window_rr
+
+    shm = _attached.get(shm_name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _attached[shm_name] = shm
+
+    segment = np.ndarray((n,), dtype=np.float64, buffer=shm.buf, offset=slot * n * 8)
+    t0 = time.perf_counter()
+    rr_val, status = window_rr(segment, fs, intensity_threshold, fallback=fallback)
+    return rr_val, status, time.perf_counter() - t0
+
+# ======================================================
+# SCHEDULER (HTTP PROCESS SIDE)
+# ======================================================
+class RespirationScheduler:
+    """
+    Fans 30 s ECG windows out to a process pool.
+
+    Windows are copied straight from each device's ring buffer into a
+    fixed set of shared-memory slots, so only the slot index crosses the
+    process boundary. At most one window per device is in flight and at
+    most `2 * workers` overall: when a device's previous window has not
+    finished, or every slot is busy, the new window is dropped rather
+    than queued, since the next hop will carry fresher data anyway.
+
+    `on_result(session, rr_val, status, end)` is called from the executor's
+    callback thread. With `workers=0` windows are analysed inline on the
+    calling thread (handy for local debugging).
+    """
+
+    def __init__(self, window_samples, fs, intensity_threshold,
+                 on_result, workers=2, fallback=True, log=print):
+        self.window_samples = window_samples
+        self.fs = fs
+        self.intensity_threshold = intensity_threshold
+        self.on_result = on_result
+        self.workers = workers
+        self.fallback = fallback
+        self.log = log
+
+        self.n_slots = max(1, workers) * 2
+        self._shm = None
+        self._slots = None
+        self._executor = None
+        self._free = list(range(self.n_slots))
+        self._inflight = set()      # device_ids with a window in the pool
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "dropped_busy": 0,      # device still had a window in flight
+            "dropped_full": 0,      # no free shared-memory slot
+        }
+
+    def start(self):
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self.n_slots * self.window_samples * 8
+        )
+        self._slots = np.ndarray(
+            (self.n_slots, self.window_samples), dtype=np.float64,
+            buffer=self._shm.buf,
+        )
+        if self.workers > 0:
+            # spawn: never fork a process that already runs Flask threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        self.log(f"[NK] Scheduler started: workers={self.workers} slots={self.n_slots}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._shm is not None:
+            self._slots = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def busy(self, device_id):
+        """True while a window of `device_id` is in the pool."""
+        with self._lock:
+            return device_id in self._inflight
+
+    def submit(self, session, end=None):
+        """
+        Queue the window of `session` ending at sequence number `end`
+        (default: the newest samples). Returns False if skipped.
+        """
+        dev = session.device_id
+
+        with self._lock:
+            if dev in self._inflight:
+                self.stats["dropped_busy"] += 1
+                return False
+            if not self._free:
+                self.stats["dropped_full"] += 1
+                return False
+            slot = self._free.pop()
+            self._inflight.add(dev)
+
+        with session.lock:
+            ring = session.ecg
+            if end is None:
+                end = ring.total
+            ready = end - self.window_samples >= ring.first_seq and end <= ring.total
+            if ready:
+                ring.window(end, self.window_samples, out=self._slots[slot])
+
+        if not ready:
+            self._release(dev, slot)
+            return False
+
+        with self._lock:
+            self.stats["submitted"] += 1
+
+        if self._executor is None:
+            result = _analyze_slot(
+                self._shm.name, slot, self.window_samples, self.fs,
+                self.intensity_threshold, self.fallback,
+            )
+            self._finish(session, slot, end, result)
+            return True
+
+        future = self._executor.submit(
+            _analyze_slot, self._shm.name, slot, self.window_samples,
+            self.fs, self.intensity_threshold, self.fallback,
+        )
+        future.add_done_callback(
+            lambda f, s=session, sl=slot, e=end: self._on_done(s, sl, e, f)
+        )
+        return True
+
+    def _on_done(self, session, slot, end, future):
+        try:
+            result = future.result()
+        except Exception as e:      # worker crash, pool shutdown, ...
+            result = (None, f"error: {e}", 0.0)
+        self._finish(session, slot, end, result)
+
+    def _finish(self, session, slot, end, result):
+        self._release(session.device_id, slot)
+        with self._lock:
+            self.stats["completed"] += 1
+        rr_val, status, elapsed = result
+        POOL_WINDOW_SECONDS.observe(elapsed)
+        self.on_result(session, rr_val, status, end)
+
+    def _release(self, dev, slot):
+        with self._lock:
+            self._free.append(slot)
+            self._inflight.discard(dev)
@@ -0,0 +1,67 @@
+"""
+batch_rr() vs a window_rr() loop over the same windows.
+
+Builds `--streams` simulated 30 s windows (what one hop looks like with
+that many devices) and times both paths.
+
+    python benchmarks/bench_batch_rr.py --streams 10 100 500
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_incremental_rr import simulate
+from respiration import batch_rr, window_rr
+
+WINDOW_SEC = 30
+HOP_SEC = 10
+
+
+def make_windows(fs, n_streams):
+    window = fs * WINDOW_SEC
+    hop = fs * HOP_SEC
+    rates = [8, 12, 15, 20, 25, 30]
+    pool = []
+    for rate in rates:
+        sig = simulate(fs, 120, rate, seed=int(rate))
+        pool.extend(sig[e - window:e] for e in range(window, sig.size + 1, hop))
+    return np.array([pool[i % len(pool)] for i in range(n_streams)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch respiration-rate benchmark")
+    parser.add_argument("--fs", type=int, default=50)
+    parser.add_argument("--streams", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--threshold", type=float, default=0.01)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+
+    print(f"{'streams':>8} {'loop ms':>10} {'batch ms':>10} {'speedup':>8} {'max |dRR|':>10}")
+    for n in args.streams:
+        windows = make_windows(args.fs, n)
+
+        t0 = time.perf_counter()
+        ref = [window_rr(w, args.fs, args.threshold)[0] for w in windows]
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        rr, _ = batch_rr(windows, args.fs, args.threshold)
+        t_batch = time.perf_counter() - t0
+
+        ref = np.array([np.nan if v is None else v for v in ref])
+        diff = np.nanmax(np.abs(ref - rr)) if np.isfinite(ref).any() else 0.0
+
+        print(f"{n:>8} {t_loop * 1e3:>10.1f} {t_batch * 1e3:>10.1f} "
+              f"{t_loop / t_batch:>7.1f}x {diff:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+IncrementalRespiration vs window_rr(): agreement and CPU per hop.
+
+Streams simulated ECG (with respiration-driven baseline modulation and
+random dropouts) through both paths hop by hop.
+
+    python benchmarks/bench_incremental_rr.py
+    python benchmarks/bench_incremental_rr.py --fs 50 --duration 600 --edge 10
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import neurokit2 as nk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from respiration import IncrementalRespiration, window_rr
+
+WINDOW_SEC = 30
+HOP_SEC = 10
+
+
+def simulate(fs, duration, resp_rate, seed, dropout=0.01):
+    ecg = nk.ecg_simulate(
+        duration=duration, sampling_rate=fs, heart_rate=70,
+        noise=0.05, random_state=seed,
+    )
+    rsp = nk.rsp_simulate(
+        duration=duration, sampling_rate=fs,
+        respiratory_rate=resp_rate, random_state=seed,
+    )
+    sig = ecg + 0.3 * rsp
+    sig = sig - sig.min() + 0.1
+    rng = np.random.default_rng(seed)
+    sig[rng.random(sig.size) < dropout] = -1.0      # ESP dropouts
+    return sig
+
+
+def run(fs, duration, rates, threshold, edge):
+    window = fs * WINDOW_SEC
+    hop = fs * HOP_SEC
+
+    diffs, mismatched = [], 0
+    t_full = t_inc = 0.0
+    hops = 0
+
+    for rate in rates:
+        sig = simulate(fs, duration, rate, seed=int(rate))
+        engine = IncrementalRespiration(fs, window, threshold, edge_sec=edge)
+
+        for end in range(hop, sig.size + 1, hop):
+            t0 = time.perf_counter()
+            engine.update(sig[end - hop:end])
+            b = engine.rr()[0] if end >= window else None
+            t_inc += time.perf_counter() - t0
+
+            if end < window:
+                continue
+
+            t0 = time.perf_counter()
+            a = window_rr(sig[end - window:end], fs, threshold)[0]
+            t_full += time.perf_counter() - t0
+            hops += 1
+
+            if a is None or b is None:
+                mismatched += int((a is None) != (b is None))
+            else:
+                diffs.append(abs(a - b))
+
+    d = np.array(diffs)
+    return {
+        "fs": fs,
+        "hops": hops,
+        "full_ms_per_hop": t_full / hops * 1e3,
+        "incremental_ms_per_hop": t_inc / hops * 1e3,
+        "speedup": t_full / t_inc,
+        "abs_diff_p50": float(np.percentile(d, 50)),
+        "abs_diff_p99": float(np.percentile(d, 99)),
+        "abs_diff_max": float(d.max()),
+        "within_0.5": float((d < 0.5).mean()),
+        "valid_invalid_mismatch": mismatched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental RR engine benchmark")
+    parser.add_argument("--fs", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--duration", type=int, default=300)
+    parser.add_argument("--rates", type=float, nargs="+", default=[8, 12, 15, 20, 25, 30])
+    parser.add_argument("--threshold", type=float, default=0.01)
+    parser.add_argument("--edge", type=float, default=15)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+
+    for fs in args.fs:
+        r = run(fs, args.duration, args.rates, args.threshold, args.edge)
+        print(f"\n===== fs={r['fs']} Hz, {r['hops']} hops =====")
+        print(f"window_rr      : {r['full_ms_per_hop']:.3f} ms/hop")
+        print(f"incremental    : {r['incremental_ms_per_hop']:.3f} ms/hop ({r['speedup']:.1f}x)")
+        print(f"|dRR| p50/p99  : {r['abs_diff_p50']:.4f} / {r['abs_diff_p99']:.4f} breaths/min")
+        print(f"|dRR| max      : {r['abs_diff_max']:.4f} breaths/min")
+        print(f"within 0.5     : {r['within_0.5'] * 100:.1f} %")
+        print(f"valid/invalid  : {r['valid_invalid_mismatch']} hop(s) disagree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+/data ingest: JSON float list vs binary ECG frame.
+
+Posts the same batches through Flask's test client in both formats and
+reports per-request time, plus the raw decode cost of each format.
+Server log lines are silenced while timing.
+
+    python benchmarks/bench_ingest.py
+    python benchmarks/bench_ingest.py --batch 25 250 2500 --requests 2000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ecg_wire
+
+
+def timed(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs binary /data ingest benchmark")
+    parser.add_argument("--batch", type=int, nargs="+", default=[25, 250, 2500],
+                        help="samples per POST (25 = 50 Hz, 250 = 500 Hz at 500 ms flushes)")
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("RESP_ENGINE", "incremental")
+    os.environ.setdefault("HISTORY_SNAPSHOT", os.path.join(tempfile.mkdtemp(), "history.npz"))
+    import server
+    client = server.app.test_client()
+
+    rng = np.random.default_rng(0)
+
+    print(f"{'batch':>6} {'json bytes':>11} {'bin bytes':>10} "
+          f"{'json decode us':>15} {'bin decode us':>14} "
+          f"{'json POST us':>13} {'bin POST us':>12} {'speedup':>8}")
+
+    for n in args.batch:
+        samples = rng.integers(0, 4096, n).astype(float).tolist()
+        body_json = json.dumps({"device_id": "bench", "ecg": samples})
+        body_i16 = ecg_wire.encode_frame("bench", samples, server.FS, time.time(), 0, dtype="<i2")
+
+        t_json_dec = timed(lambda: np.asarray(json.loads(body_json)["ecg"], dtype=np.float32), args.requests)
+        t_bin_dec = timed(lambda: ecg_wire.decode_frame(body_i16)["samples"].astype(np.float32), args.requests)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.post("/data", data=body_json, content_type="application/json")
+            client.post("/data", data=body_i16, content_type=ecg_wire.CONTENT_TYPE)
+            t_json = timed(lambda: client.post(
+                "/data", data=body_json, content_type="application/json"), args.requests)
+            t_bin = timed(lambda: client.post(
+                "/data", data=body_i16, content_type=ecg_wire.CONTENT_TYPE), args.requests)
+
+        print(f"{n:>6} {len(body_json):>11} {len(body_i16):>10} "
+              f"{t_json_dec:>15.1f} {t_bin_dec:>14.1f} "
+              f"{t_json:>13.1f} {t_bin:>12.1f} {t_json / t_bin:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
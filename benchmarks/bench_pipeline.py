@@ -0,0 +1,321 @@
+"""
+End-to-end benchmark: simulated ESP devices -> (proxy_app) -> server.py.
+
+Each device streams synthetic ECG with a known respiration rate
+(NeuroKit ecg_simulate + rsp_simulate, see bench_incremental_rr.simulate)
+or replays a capture. server.py (and proxy_app with --proxy) run as
+local subprocesses; RR results are collected from the server's /events
+stream and compared with the ground truth.
+
+Reports ingest throughput, request latency, RR time per hop (from the
+server's /metrics), RR accuracy and peak RSS per process, as JSON on
+stdout (and --out), so runs can be diffed.
+
+    python benchmarks/bench_pipeline.py --devices 20 --duration 90
+    python benchmarks/bench_pipeline.py --devices 20 --proxy --record capture.jsonl
+    python benchmarks/bench_pipeline.py --replay capture.jsonl --speed 2
+
+A capture is JSON lines of {"t": seconds from start, "device_id", "ecg":
+[...], "resp_rate": optional ground truth}.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+import ecg_wire
+from bench_incremental_rr import simulate
+
+SERVE = (
+    "import sys; sys.path.insert(0, {root!r});"
+    "from werkzeug.serving import run_simple; import server;"
+    "run_simple('127.0.0.1', {port}, server.app, threaded=True)"
+)
+
+
+# ======================================================
+# WORKLOAD
+# ======================================================
+def synthetic_schedule(n_devices, fs, duration, post_ms, seed):
+    rng = np.random.default_rng(seed)
+    chunk = fs * post_ms // 1000
+    schedule, truth = [], {}
+    for i in range(n_devices):
+        dev = f"bench{i}"
+        rate = float(rng.uniform(10, 24))
+        sig = simulate(fs, duration, rate, seed=seed + i)
+        truth[dev] = rate
+        for k in range(0, sig.size - chunk + 1, chunk):
+            schedule.append((k / fs, dev, sig[k:k + chunk].round(4).tolist()))
+    schedule.sort(key=lambda e: e[0])
+    return schedule, truth
+
+
+def load_capture(path, fs):
+    schedule, truth = [], {}
+    sent = defaultdict(int)
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            dev = str(rec.get("device_id") or "default")
+            ecg = rec.get("ecg") or []
+            # no timestamp: pace by samples already sent for this device
+            t = rec["t"] if "t" in rec else sent[dev] / fs
+            sent[dev] += len(ecg)
+            schedule.append((float(t), dev, ecg))
+            if rec.get("resp_rate") is not None:
+                truth[dev] = float(rec["resp_rate"])
+    schedule.sort(key=lambda e: e[0])
+    return schedule, truth
+
+
+def save_capture(path, schedule, truth):
+    with open(path, "w") as f:
+        for t, dev, ecg in schedule:
+            f.write(json.dumps({"t": t, "device_id": dev, "ecg": ecg,
+                                "resp_rate": truth.get(dev)}) + "\n")
+
+
+# ======================================================
+# PROCESSES
+# ======================================================
+def start(cmd, env):
+    return subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def parse_metrics(text):
+    """{(name, labels string): value} from Prometheus text."""
+    out = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        key, _, value = line.rpartition(" ")
+        name, _, labels = key.partition("{")
+        out[(name, labels.rstrip("}"))] = float(value)
+    return out
+
+
+# ======================================================
+# DRIVER
+# ======================================================
+async def send_all(client, url, schedule, fmt, fs, speed, result):
+    t0 = time.monotonic()
+    seq = defaultdict(int)
+    sem = asyncio.Semaphore(256)
+
+    async def post(dev, ecg):
+        async with sem:
+            if fmt == "binary":
+                frame = ecg_wire.encode_frame(dev, ecg, fs, time.time(), seq[dev])
+                seq[dev] += 1
+                kw = {"content": frame, "headers": {"Content-Type": ecg_wire.CONTENT_TYPE}}
+            else:
+                kw = {"json": {"device_id": dev, "ecg": ecg}}
+            start_t = time.perf_counter()
+            try:
+                r = await client.post(url, **kw)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            result["latency"].append(time.perf_counter() - start_t)
+            if ok:
+                result["samples"] += len(ecg)
+            else:
+                result["errors"] += 1
+
+    tasks = []
+    for t, dev, ecg in schedule:
+        delay = t0 + t / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(post(dev, ecg)))
+    await asyncio.gather(*tasks)
+    result["elapsed"] = time.monotonic() - t0
+
+
+async def listen_rr(client, base, hops):
+    async with client.stream("GET", f"{base}/events?topics=rr_hop", timeout=None) as r:
+        async for line in r.aiter_lines():
+            if line.startswith("data: "):
+                ev = json.loads(line[6:])
+                hops.append((ev["device_id"], ev["rr"], ev["status"]))
+
+
+async def drive(args, schedule, server_base, ingest_url):
+    result = {"samples": 0, "errors": 0, "latency": []}
+    hops = []
+    limits = httpx.Limits(max_connections=300, max_keepalive_connections=300)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        listener = asyncio.create_task(listen_rr(client, server_base, hops))
+        await send_all(client, ingest_url, schedule, args.format, args.fs, args.speed, result)
+        # let the worker finish the hop that covers the last data
+        await asyncio.sleep(args.tail)
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        metrics = parse_metrics((await client.get(f"{server_base}/metrics")).text)
+    return result, hops, metrics
+
+
+def summarize(args, result, hops, truth, metrics, rss):
+    lat = np.array(result["latency"]) * 1e3
+    hop_count = metrics.get(("resp_hop_seconds_count", ""), 0.0)
+    hop_sum = metrics.get(("resp_hop_seconds_sum", ""), 0.0)
+    lag_count = metrics.get(("resp_window_lag_seconds_count", ""), 0.0)
+    lag_sum = metrics.get(("resp_window_lag_seconds_sum", ""), 0.0)
+    stages = {}
+    for stage in ("ecg_rsp", "rsp_rate", "rolling_std"):
+        n = metrics.get(("resp_stage_seconds_count", f'stage="{stage}"'), 0.0)
+        s = metrics.get(("resp_stage_seconds_sum", f'stage="{stage}"'), 0.0)
+        stages[stage] = s / n * 1e3 if n else None
+
+    errors = [abs(rr - truth[dev]) for dev, rr, _ in hops if rr is not None and dev in truth]
+    err = np.array(errors)
+    scored = [h for h in hops if h[0] in truth]
+
+    return {
+        "config": {
+            "devices": len({dev for _, dev, _ in args.schedule}),
+            "path": "proxy" if args.proxy else "server",
+            "format": args.format,
+            "engine": args.engine,
+            "fs": args.fs,
+            "speed": args.speed,
+            "source": args.replay or "synthetic",
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "ingest": {
+            "requests": len(result["latency"]),
+            "errors": result["errors"],
+            "samples": result["samples"],
+            "samples_per_s": result["samples"] / result["elapsed"],
+            "latency_ms_p50": float(np.percentile(lat, 50)) if lat.size else None,
+            "latency_ms_p99": float(np.percentile(lat, 99)) if lat.size else None,
+        },
+        "rr": {
+            "hops": len(hops),
+            "worker_ms_per_hop": hop_sum / hop_count * 1e3 if hop_count else None,
+            "worker_hop_overruns": metrics.get(("resp_hop_overruns_total", ""), 0.0),
+            "window_lag_ms_mean": lag_sum / lag_count * 1e3 if lag_count else None,
+            "windows": {
+                outcome: metrics.get(("resp_windows_total", f'outcome="{outcome}"'), 0.0)
+                for outcome in ("on_time", "caught_up", "skipped")
+            },
+            "stage_ms_per_call": stages,
+            "valid_fraction": len(errors) / len(scored) if scored else None,
+            "abs_error_mean": float(err.mean()) if err.size else None,
+            "abs_error_p90": float(np.percentile(err, 90)) if err.size else None,
+            "within_1_bpm": float((err <= 1).mean()) if err.size else None,
+        },
+        "peak_rss_mb": rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest -> respiration pipeline benchmark")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--duration", type=int, default=90, help="seconds of signal per device")
+    parser.add_argument("--fs", type=int, default=50)
+    parser.add_argument("--post-ms", type=int, default=500, help="samples per request, as ms of signal")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed vs real time")
+    parser.add_argument("--format", choices=["json", "binary"], default="json")
+    parser.add_argument("--engine", default="incremental", help="server RESP_ENGINE")
+    parser.add_argument("--proxy", action="store_true", help="send through proxy_app")
+    parser.add_argument("--replay", help="capture file (JSON lines) instead of synthetic ECG")
+    parser.add_argument("--record", help="write the synthetic workload as a capture")
+    parser.add_argument("--tail", type=float, default=12, help="seconds to wait for the last hop")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=18600)
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    if args.replay:
+        schedule, truth = load_capture(args.replay, args.fs)
+    else:
+        schedule, truth = synthetic_schedule(args.devices, args.fs, args.duration,
+                                             args.post_ms, args.seed)
+        if args.record:
+            save_capture(args.record, schedule, truth)
+    args.schedule = schedule
+    if args.proxy and args.format == "binary":
+        parser.error("the proxy accepts JSON from devices; use --format json with --proxy")
+
+    tmp = tempfile.mkdtemp()
+    server_port, proxy_port = args.port, args.port + 1
+    server_base = f"http://127.0.0.1:{server_port}"
+    procs = {"server": start(
+        [sys.executable, "-c", SERVE.format(root=ROOT, port=server_port)],
+        {"RESP_ENGINE": args.engine, "HISTORY_SNAPSHOT": os.path.join(tmp, "history.npz")},
+    )}
+    ingest_url = f"{server_base}/data"
+    try:
+        wait_ready(server_base + "/")
+        if args.proxy:
+            procs["proxy"] = start(
+                [sys.executable, "-m", "uvicorn", "proxy_app:app",
+                 "--port", str(proxy_port), "--log-level", "warning"],
+                {"UPSTREAM_URL": ingest_url},
+            )
+            ingest_url = f"http://127.0.0.1:{proxy_port}/data"
+            wait_ready(ingest_url.replace("/data", "/stats"))
+
+        result, hops, metrics = asyncio.run(drive(args, schedule, server_base, ingest_url))
+        rss = {name: peak_rss_mb(p.pid) for name, p in procs.items()}
+        rss["client"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        for p in procs.values():
+            p.terminate()
+            p.wait()
+
+    report = summarize(args, result, hops, truth, metrics, rss)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Cost of the ECG strip plot: the old per-hop pyplot figure vs the reused
+Agg canvas (new data each time), a cache hit, and the JSON series.
+
+    python benchmarks/bench_plot.py --repeat 50
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ecg_plot import EcgPlotRenderer, minmax_decimate
+
+
+def per_hop_figure(strip):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(6, 2))
+    ax.plot(strip)
+    ax.set_title("ECG (last 10 s)")
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def bench(fn, repeat):
+    fn(0)   # warm-up (imports, first figure)
+    t0 = time.perf_counter()
+    for i in range(1, repeat + 1):
+        fn(i)
+    return (time.perf_counter() - t0) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ECG plot render cost")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    strips = [rng.normal(size=args.samples).cumsum() for _ in range(8)]
+    renderer = EcgPlotRenderer()
+
+    rows = [
+        ("pyplot figure per hop", bench(lambda i: per_hop_figure(strips[i % 8]), args.repeat)),
+        ("reused canvas, new data", bench(lambda i: renderer.png_base64("d", i, strips[i % 8]), args.repeat)),
+        ("cache hit", bench(lambda i: renderer.png_base64("d", -1, strips[0]), args.repeat)),
+        ("json series (200 pts)", bench(lambda i: minmax_decimate(strips[i % 8], 200).tolist(), args.repeat)),
+    ]
+    print(f"{'render':<28}{'ms / call':>10}")
+    for name, ms in rows:
+        print(f"{name:<28}{ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Push fan-out benchmark: hundreds of SSE subscribers on a local server.py.
+
+The server runs in a subprocess (werkzeug, threaded: one thread per
+stream, like gunicorn gthread). Simulated devices post ECG and glucose;
+subscribers listen on /events, half to a single device and half to
+every device, and measure publish -> receive latency from the event's
+server timestamp.
+
+    python benchmarks/bench_push.py --subscribers 300 --devices 10 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVE = (
+    "import sys; sys.path.insert(0, {root!r});"
+    "from werkzeug.serving import run_simple; import server;"
+    "run_simple('127.0.0.1', {port}, server.app, threaded=True)"
+)
+
+
+async def subscriber(client, url, stop_at, result):
+    events, latencies, gaps, last_seq = 0, [], 0, {}
+    try:
+        async with client.stream("GET", url, timeout=None) as r:
+            result["connected"] += 1
+            async for line in r.aiter_lines():
+                if line.startswith("data: "):
+                    ev = json.loads(line[6:])
+                    events += 1
+                    latencies.append(time.time() - ev["t"])
+                    if "next_seq" in ev:
+                        dev = ev["device_id"]
+                        if dev in last_seq and ev["first_seq"] != last_seq[dev]:
+                            gaps += 1
+                        last_seq[dev] = ev["next_seq"]
+                if time.monotonic() >= stop_at:
+                    break
+    except httpx.HTTPError:
+        result["errors"] += 1
+    finally:
+        # also when run() cancels the stream at the end
+        result["events"] += events
+        result["gaps"] += gaps
+        result["latencies"].extend(latencies)
+
+
+async def device(client, base, dev, fs, post_ms, stop_at):
+    n = fs * post_ms // 1000
+    t = 0
+    while time.monotonic() < stop_at:
+        ecg = np.sin(np.arange(t, t + n) / 5).round(4).tolist()
+        body = {"device_id": dev, "ecg": ecg}
+        if t % (fs * 5) < n:
+            body["glucose"] = 100.0
+        await client.post(base + "/data", json=body)
+        t += n
+        await asyncio.sleep(post_ms / 1000)
+
+
+async def run(args):
+    base = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.subscribers + args.devices + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=10) as client:
+        stop_at = time.monotonic() + args.duration
+        result = {"connected": 0, "events": 0, "gaps": 0, "errors": 0, "latencies": []}
+        topics = "&topics=" + args.topics if args.topics else ""
+        subs = []
+        for i in range(args.subscribers):
+            dev = f"&device_id=dev{i % args.devices}" if i % 2 == 0 else ""
+            url = f"{base}/events?x={i}{dev}{topics}"
+            subs.append(asyncio.create_task(subscriber(client, url, stop_at, result)))
+
+        while result["connected"] < args.subscribers and time.monotonic() < stop_at:
+            await asyncio.sleep(0.1)
+        connect_s = args.duration - (stop_at - time.monotonic())
+
+        devices = [device(client, base, f"dev{i}", args.fs, args.post_ms, stop_at)
+                   for i in range(args.devices)]
+        await asyncio.gather(*devices)
+        await asyncio.sleep(0.5)
+        for t in subs:
+            t.cancel()
+        await asyncio.gather(*subs, return_exceptions=True)
+        stats = (await client.get(base + "/push_stats")).json()
+
+    lat = np.array(result["latencies"]) * 1e3
+    print(json.dumps({
+        "subscribers": args.subscribers,
+        "connected": result["connected"],
+        "connect_s": round(connect_s, 2),
+        "devices": args.devices,
+        "topics": args.topics or "all",
+        "events_received": result["events"],
+        "events_per_s": round(result["events"] / args.duration, 1),
+        "latency_ms_p50": round(float(np.percentile(lat, 50)), 2) if lat.size else None,
+        "latency_ms_p99": round(float(np.percentile(lat, 99)), 2) if lat.size else None,
+        "ecg_gaps_seen": result["gaps"],
+        "client_errors": result["errors"],
+        "hub": stats,
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE push fan-out benchmark")
+    parser.add_argument("--subscribers", type=int, default=300)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--fs", type=int, default=50)
+    parser.add_argument("--post-ms", type=int, default=500)
+    parser.add_argument("--topics", default="rr_hop,resp_rate,glucose,ecg")
+    parser.add_argument("--port", type=int, default=18500)
+    args = parser.parse_args()
+
+    # the history snapshot goes to a temp dir, not data/ in the checkout
+    env = {**os.environ, "HISTORY_SNAPSHOT": os.path.join(tempfile.mkdtemp(), "history.npz")}
+    proc = subprocess.Popen(
+        [sys.executable, "-c", SERVE.format(root=ROOT, port=args.port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT, env=env,
+    )
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"http://127.0.0.1:{args.port}/", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        asyncio.run(run(args))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Microbenchmark: deque ECG path vs EcgRingBuffer.
+
+Simulates one 10 s hop of ingest followed by the 30 s window extraction
+the respiration worker does, at 50 Hz and 500 Hz.
+
+    python benchmarks/bench_ring_buffer.py
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ring_buffer import EcgRingBuffer
+
+WINDOW_SEC = 30
+HOP_SEC = 10
+BUFFER_SEC = 80         # MAX_ECG_BUFFER = 4000 at 50 Hz
+FLUSH_SEC = 0.5         # proxy flush interval -> samples per POST
+
+
+def deque_hop(ecg_buffer, latest_ecg_numbers, batches, window_samples):
+    # ---- receive_data: per-sample appends into two deques ----
+    for batch in batches:
+        for v in batch:
+            ecg_buffer.append(v)
+            latest_ecg_numbers.append(v)
+    # ---- neurokit_worker: deque -> list -> array ----
+    return np.array(list(ecg_buffer)[-window_samples:], dtype=float)
+
+
+def ring_hop(ring, batches, window_samples, out):
+    for batch in batches:
+        ring.extend(batch)
+    return ring.latest(window_samples, out=out)
+
+
+def bench(fs, hops):
+    window_samples = fs * WINDOW_SEC
+    capacity = fs * BUFFER_SEC
+    batch_len = int(fs * FLUSH_SEC)
+    n_batches = int(HOP_SEC / FLUSH_SEC)
+
+    rng = np.random.default_rng(0)
+    batches = [
+        rng.normal(512, 50, batch_len).tolist() for _ in range(n_batches)
+    ]
+
+    # ---- warm both buffers to capacity ----
+    d1, d2 = deque(maxlen=capacity), deque(maxlen=capacity)
+    ring = EcgRingBuffer(capacity)
+    warm = rng.normal(512, 50, capacity).tolist()
+    d1.extend(warm)
+    d2.extend(warm)
+    ring.extend(warm)
+    out = np.empty(window_samples, dtype=float)
+
+    t0 = time.perf_counter()
+    for _ in range(hops):
+        a = deque_hop(d1, d2, batches, window_samples)
+    t_deque = (time.perf_counter() - t0) / hops
+
+    t0 = time.perf_counter()
+    for _ in range(hops):
+        b = ring_hop(ring, batches, window_samples, out)
+    t_ring = (time.perf_counter() - t0) / hops
+
+    # float32 storage vs float64 deque: compare at float32 precision
+    assert np.allclose(a.astype(np.float32), b)
+
+    return {
+        "fs": fs,
+        "batch_len": batch_len,
+        "deque_us_per_hop": t_deque * 1e6,
+        "ring_us_per_hop": t_ring * 1e6,
+        "speedup": t_deque / t_ring,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ECG ring buffer microbenchmark")
+    parser.add_argument("--hops", type=int, default=200)
+    parser.add_argument("--fs", type=int, nargs="+", default=[50, 500])
+    args = parser.parse_args()
+
+    print(f"{'fs':>5} {'batch':>6} {'deque us/hop':>14} {'ring us/hop':>13} {'speedup':>8}")
+    for fs in args.fs:
+        r = bench(fs, args.hops)
+        print(
+            f"{r['fs']:>5} {r['batch_len']:>6} {r['deque_us_per_hop']:>14.1f} "
+            f"{r['ring_us_per_hop']:>13.1f} {r['speedup']:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Load time of the training samples: CSV (pd.read_csv) vs the columnar
+store (memory-mapped), against a raw read of the same bytes.
+
+    python benchmarks/bench_sample_store.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sample_store import SAMPLE_COLUMNS, ColumnStore
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV vs columnar sample store")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = {name: rng.normal(100, 30, args.rows) for name in SAMPLE_COLUMNS}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "training.csv")
+        store_dir = os.path.join(tmp, "samples")
+
+        pd.DataFrame(data).to_csv(csv_path, index=False)
+        store = ColumnStore(store_dir)
+        t_import, _ = timed(lambda: store.import_csv(csv_path), 1)
+        store.close()
+
+        def raw_io():
+            return [np.fromfile(os.path.join(store_dir, n + ".f64")) for n in SAMPLE_COLUMNS]
+
+        def store_sum():
+            cols = ColumnStore(store_dir).read()
+            return sum(float(c.sum()) for c in cols.values())
+
+        t_csv, df = timed(lambda: pd.read_csv(csv_path), args.repeat)
+        t_raw, _ = timed(raw_io, args.repeat)
+        t_frame, _ = timed(lambda: ColumnStore(store_dir).to_frame(), args.repeat)
+        t_map, _ = timed(store_sum, args.repeat)
+
+        print(f"rows: {args.rows}  csv: {os.path.getsize(csv_path) / 2**20:.1f} MB  "
+              f"store: {args.rows * 8 * len(SAMPLE_COLUMNS) / 2**20:.1f} MB  "
+              f"(one-time import {t_import:.2f} s)")
+        print(f"{'load':<32}{'seconds':>10}")
+        print(f"{'pd.read_csv':<32}{t_csv:>10.4f}")
+        print(f"{'np.fromfile (raw I/O)':<32}{t_raw:>10.4f}")
+        print(f"{'ColumnStore.to_frame':<32}{t_frame:>10.4f}")
+        print(f"{'ColumnStore.read + sum':<32}{t_map:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
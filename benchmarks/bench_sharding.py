@@ -0,0 +1,233 @@
+"""
+Sharding benchmark: proxy_app in front of several local server.py
+instances (UPSTREAM_URLS), with one backend killed part-way and started
+again later.
+
+Reports, as JSON:
+  * ring: device spread over the backends and the fraction of devices
+    that move when a backend is added (ideal 1 / (N + 1)), from
+    proxy_router.HashRing alone;
+  * routing: devices per backend before the kill, during the outage and
+    after recovery, how many devices moved, and whether any device that
+    was not on the killed backend moved;
+  * delivery: devices whose last sample reached a backend (next_seq from
+    /ingest_stats; the restarted backend lost its state, so samples are
+    not summed across backends) and the proxy's drop / retry counters.
+
+    python benchmarks/bench_sharding.py --backends 3 --devices 30
+    python benchmarks/bench_sharding.py --backends 4 --kill-at 10 --restart-at 25
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import httpx
+import numpy as np
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, ROOT)
+
+from proxy_router import HashRing
+
+SERVE = (
+    "import sys; sys.path.insert(0, {root!r});"
+    "from werkzeug.serving import run_simple; import server;"
+    "run_simple('127.0.0.1', {port}, server.app, threaded=True)"
+)
+
+
+def start(cmd, env):
+    return subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def ring_report(n_backends, n_keys=20000):
+    nodes = [f"http://127.0.0.1:{9000 + i}/data" for i in range(n_backends + 1)]
+    keys = [f"device{i}" for i in range(n_keys)]
+    ring = HashRing(nodes[:-1])
+    before = [ring.lookup(k) for k in keys]
+    loads = [before.count(n) for n in nodes[:-1]]
+    ring.add(nodes[-1])
+    moved = sum(a != ring.lookup(k) for a, k in zip(before, keys))
+    return {
+        "keys": n_keys,
+        "load_max_over_mean": max(loads) / statistics.mean(loads),
+        "load_min_over_mean": min(loads) / statistics.mean(loads),
+        "moved_on_add": moved / n_keys,
+        "ideal_moved_on_add": 1 / (n_backends + 1),
+    }
+
+
+def routes(stats):
+    return {dev: d["backend"] for dev, d in stats["devices"].items()}
+
+
+def spread(assigned):
+    counts = {}
+    for url in assigned.values():
+        counts[url] = counts.get(url, 0) + 1
+    return counts
+
+
+async def drive(args, proxy, server_urls, procs, start_server):
+    chunk = args.fs * args.post_ms // 1000
+    devices = [f"shard{i}" for i in range(args.devices)]
+    sent = dict.fromkeys(devices, 0)
+    snapshots = {}
+    rng = np.random.default_rng(args.seed)
+
+    async with httpx.AsyncClient(timeout=10) as client:
+        async def post(dev):
+            ecg = (rng.random(chunk) + 0.1).tolist()
+            r = await client.post(proxy + "/data", json={"device_id": dev, "ecg": ecg})
+            r.raise_for_status()
+            sent[dev] += chunk
+
+        t0 = time.monotonic()
+        killed = restarted = False
+        step = args.post_ms / 1000
+        n_steps = int(args.duration / step)
+        for i in range(n_steps):
+            elapsed = time.monotonic() - t0
+            if not killed and elapsed >= args.kill_at:
+                snapshots["before"] = routes((await client.get(proxy + "/stats")).json())
+                procs["server0"].kill()
+                procs["server0"].wait()
+                killed = True
+            if killed and "during" not in snapshots and elapsed >= args.kill_at + args.settle:
+                snapshots["during"] = routes((await client.get(proxy + "/stats")).json())
+            if not restarted and elapsed >= args.restart_at:
+                procs["server0"] = start_server(0)
+                restarted = True
+            await asyncio.gather(*(post(dev) for dev in devices))
+            await asyncio.sleep(max(0.0, t0 + (i + 1) * step - time.monotonic()))
+
+        # let the proxy drain its queues
+        deadline = time.monotonic() + args.drain
+        while time.monotonic() < deadline:
+            stats = (await client.get(proxy + "/stats")).json()
+            if stats["queued_samples"] == 0 and not any(d["inflight"] for d in stats["devices"].values()):
+                break
+            await asyncio.sleep(0.5)
+        stats = (await client.get(proxy + "/stats")).json()
+        snapshots["after"] = routes(stats)
+
+        held = dict.fromkeys(devices, 0)
+        for url in server_urls:
+            base = url.rsplit("/", 1)[0]
+            for dev in devices:
+                try:
+                    r = await client.get(base + "/ingest_stats", params={"device_id": dev})
+                    ingest = r.json()["ingest"]
+                except httpx.HTTPError:
+                    continue
+                if ingest:
+                    held[dev] = max(held[dev], ingest["next_seq"])
+
+    return sent, held, snapshots, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="proxy_app consistent-hash sharding benchmark")
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=30)
+    parser.add_argument("--duration", type=float, default=40, help="seconds of traffic")
+    parser.add_argument("--kill-at", type=float, default=10, help="kill backend 0 after this many seconds")
+    parser.add_argument("--restart-at", type=float, default=25, help="start it again after this many seconds")
+    parser.add_argument("--settle", type=float, default=8, help="seconds after the kill to snapshot routes")
+    parser.add_argument("--drain", type=float, default=60, help="max seconds to wait for queues to drain")
+    parser.add_argument("--fs", type=int, default=50)
+    parser.add_argument("--post-ms", type=int, default=500)
+    parser.add_argument("--format", choices=["json", "binary"], default="json", help="proxy upstream format")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=18700)
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    tmp = tempfile.mkdtemp()
+    ports = [args.port + 1 + i for i in range(args.backends)]
+    server_urls = [f"http://127.0.0.1:{p}/data" for p in ports]
+
+    def start_server(i):
+        return start(
+            [sys.executable, "-c", SERVE.format(root=ROOT, port=ports[i])],
+            {"HISTORY_SNAPSHOT": os.path.join(tmp, f"history{i}.npz")},
+        )
+
+    procs = {f"server{i}": start_server(i) for i in range(args.backends)}
+    proxy = f"http://127.0.0.1:{args.port}"
+    try:
+        for url in server_urls:
+            wait_ready(url.replace("/data", "/"))
+        procs["proxy"] = start(
+            [sys.executable, "-m", "uvicorn", "proxy_app:app",
+             "--port", str(args.port), "--log-level", "warning"],
+            {"UPSTREAM_URLS": ",".join(server_urls), "UPSTREAM_FORMAT": args.format},
+        )
+        wait_ready(proxy + "/stats")
+        sent, held, snap, stats = asyncio.run(drive(args, proxy, server_urls, procs, start_server))
+    finally:
+        for p in procs.values():
+            p.terminate()
+            p.wait()
+
+    killed = server_urls[0]
+    before, during, after = snap.get("before", {}), snap.get("during", {}), snap.get("after", {})
+    moved = [d for d in before if during.get(d) != before[d]]
+    report = {
+        "config": {
+            "backends": args.backends,
+            "devices": args.devices,
+            "duration": args.duration,
+            "kill_at": args.kill_at,
+            "restart_at": args.restart_at,
+            "format": args.format,
+            "python": platform.python_version(),
+        },
+        "ring": ring_report(args.backends),
+        "routing": {
+            "before": spread(before),
+            "during_outage": spread(during),
+            "after_recovery": spread(after),
+            "devices_on_killed": sum(u == killed for u in before.values()),
+            "moved_during_outage": len(moved),
+            "moved_not_on_killed": sum(before[d] != killed for d in moved),
+            "returned_after_recovery": sum(after.get(d) == before[d] for d in moved),
+        },
+        "delivery": {
+            "samples_sent": sum(sent.values()),
+            "devices_complete": sum(held[d] >= sent[d] for d in sent),
+            "proxy": {k: stats[k] for k in stats if k.startswith("samples_") or k in ("retries", "upstream_errors")},
+        },
+        "backends": stats["backends"],
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
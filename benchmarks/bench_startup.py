@@ -0,0 +1,136 @@
+"""
+Startup benchmark for server.py: import time and time to first 200.
+
+Import time comes from `python -X importtime -c "import server"` in a
+fresh interpreter (cumulative time of server and of the heavy packages,
+if they were loaded at all). Time to first 200 is measured from spawning
+the server until GET / answers, then until the first POST /data does,
+for the werkzeug dev server or gunicorn (optionally --preload).
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runner gunicorn --preload --workers 4 --repeat 5
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+
+HEAVY = ["numpy", "flask", "pandas", "scipy.signal", "neurokit2", "matplotlib"]
+
+SERVE = (
+    "import sys; sys.path.insert(0, {root!r});"
+    "from werkzeug.serving import run_simple; import server;"
+    "run_simple('127.0.0.1', {port}, server.app, threaded=True)"
+)
+
+
+def import_times():
+    """Cumulative import seconds of server and HEAVY modules (None = not imported)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if cum.strip().isdigit():
+            cumulative[name.strip()] = int(cum) / 1e6
+    return {name: cumulative.get(name) for name in ["server"] + HEAVY}
+
+
+def first_200(args, port, env):
+    if args.runner == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+               "-b", f"127.0.0.1:{port}", "-w", str(args.workers),
+               "-k", "gthread", "--threads", "4", "server:app"]
+        if args.preload:
+            cmd.append("--preload")
+    else:
+        cmd = [sys.executable, "-c", SERVE.format(root=ROOT, port=port)]
+
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        result = {}
+        with httpx.Client(timeout=5) as client:
+            deadline = t0 + args.timeout
+            while time.perf_counter() < deadline:
+                try:
+                    if client.get(base + "/").status_code == 200:
+                        result["health"] = time.perf_counter() - t0
+                        break
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.01)
+            else:
+                raise RuntimeError("server did not answer /")
+            r = client.post(base + "/data", json={"device_id": "boot", "ecg": [0.5] * 50})
+            r.raise_for_status()
+            result["first_data"] = time.perf_counter() - t0
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="server.py startup benchmark")
+    parser.add_argument("--runner", choices=["werkzeug", "gunicorn"], default="werkzeug")
+    parser.add_argument("--preload", action="store_true", help="gunicorn --preload")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--backend", default="local", help="ECG_BACKEND")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=18650)
+    parser.add_argument("--out", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = {
+        "ECG_BACKEND": args.backend,
+        "SHM_NAME": f"bench_startup_{os.getpid()}",
+        "HISTORY_SNAPSHOT": os.path.join(tmp, "history.npz"),
+    }
+
+    imports = [import_times() for _ in range(args.repeat)]
+    boots = [first_200(args, args.port, env) for _ in range(args.repeat)]
+
+    def median(values):
+        values = [v for v in values if v is not None]
+        return statistics.median(values) if values else None
+
+    report = {
+        "config": {
+            "runner": args.runner,
+            "preload": args.preload,
+            "workers": args.workers,
+            "backend": args.backend,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+        },
+        "import_seconds": {name: median(run[name] for run in imports) for name in imports[0]},
+        "first_200_seconds": {key: median(b[key] for b in boots) for key in boots[0]},
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Load test: simulated ESPs -> proxy_app -> stub upstream, all on localhost.
+
+The stub upstream is a bare ASGI app that counts delivered samples and
+can add latency, fail a fraction of requests, or go down for an outage
+window, so backoff, retry budget and queue bounds can be observed.
+
+    python benchmarks/load_proxy.py --devices 50 --duration 20
+    python benchmarks/load_proxy.py --devices 20 --outage 5 10 --fail-rate 0.1
+    python benchmarks/load_proxy.py --devices 50 --duration 240 --outage 30 210 \
+        --spool /tmp/proxy_spool.db --timeline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ecg_wire
+import proxy_app
+
+
+class StubUpstream:
+    def __init__(self, latency, fail_rate, outage):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.outage = outage            # (start, end) seconds after t0, or None
+        self.t0 = time.monotonic()
+        self.samples = 0
+        self.requests = 0
+        self.rejected = 0
+        self.last = {}                  # device -> last sample value seen
+        self.out_of_order = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            msg = await receive()
+            body += msg.get("body", b"")
+            if not msg.get("more_body"):
+                break
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        t = time.monotonic() - self.t0
+        down = self.outage and self.outage[0] <= t < self.outage[1]
+        if down or random.random() < self.fail_rate:
+            self.rejected += 1
+            status, out = 503, b'{"status":"down"}'
+        else:
+            headers = dict(scope["headers"])
+            if headers.get(b"content-type", b"").startswith(ecg_wire.CONTENT_TYPE.encode()):
+                frame = ecg_wire.decode_frame(body)
+                dev, ecg = frame["device_id"], np.asarray(frame["samples"], dtype=float)
+            else:
+                data = json.loads(body)
+                dev, ecg = data.get("device_id"), np.asarray(data.get("ecg") or [], dtype=float)
+            # devices send a running counter, so any reordering shows up here
+            if ecg.size:
+                prev = self.last.get(dev, -1.0)
+                self.out_of_order += int(ecg[0] <= prev) + int(np.sum(np.diff(ecg) <= 0))
+                self.last[dev] = ecg[-1]
+            self.samples += ecg.size
+            self.requests += 1
+            status, out = 200, b'{"status":"ok"}'
+
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": out})
+
+
+async def device(client, url, dev, fs, post_ms, stop_at, latencies):
+    n = max(1, int(fs * post_ms / 1000))
+    sent = 0
+    while time.monotonic() < stop_at:
+        ecg = list(range(sent, sent + n))      # running counter, checked upstream
+        t0 = time.perf_counter()
+        r = await client.post(url, json={"device_id": dev, "ecg": ecg})
+        latencies.append(time.perf_counter() - t0)
+        if r.status_code == 200:
+            sent += n
+        await asyncio.sleep(post_ms / 1000)
+    return sent
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+async def monitor(t0, stub, samples, timeline):
+    """Once a second: RSS, memory queue, spool depth and delivery rate."""
+    last = stub.samples
+    while True:
+        await asyncio.sleep(1.0)
+        spool = proxy_app.spool
+        row = {
+            "t": round(time.monotonic() - t0, 1),
+            "rss_mb": round(current_rss_mb(), 1),
+            "queued": sum(q.size for q in proxy_app.queues.values()),
+            "spooled": spool.size if spool is not None else 0,
+            "delivered_per_s": stub.samples - last,
+            "replay_per_s": proxy_app.replay_rate(time.monotonic()),
+        }
+        last = stub.samples
+        samples.append(row)
+        if timeline:
+            print(json.dumps(row), flush=True)
+
+
+def backlog():
+    spool = proxy_app.spool
+    return sum(q.size for q in proxy_app.queues.values()) + (spool.size if spool else 0)
+
+
+async def serve(app, port):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def main_async(args):
+    stub = StubUpstream(args.latency, args.fail_rate, args.outage)
+    # the router is built at import: point it at the stub
+    proxy_app.UPSTREAM_URLS = [f"http://127.0.0.1:{args.upstream_port}/data"]
+    proxy_app.router = proxy_app.Router(
+        proxy_app.UPSTREAM_URLS, proxy_app.MAX_CONCURRENCY, proxy_app.UPSTREAM_TIMEOUT,
+        proxy_app.FAIL_AFTER, proxy_app.RECOVER_AFTER,
+    )
+    proxy_app.UPSTREAM_FORMAT = args.format
+    if args.spool:
+        proxy_app.SPOOL_PATH = args.spool
+
+    up_server, up_task = await serve(stub, args.upstream_port)
+    px_server, px_task = await serve(proxy_app.app, args.proxy_port)
+
+    latencies = []
+    timeline = []
+    mon = asyncio.create_task(monitor(stub.t0, stub, timeline, args.timeline))
+    limits = httpx.Limits(max_connections=args.devices, max_keepalive_connections=args.devices)
+    async with httpx.AsyncClient(limits=limits, timeout=10) as client:
+        stop_at = time.monotonic() + args.duration
+        url = f"http://127.0.0.1:{args.proxy_port}/data"
+        sent = await asyncio.gather(*[
+            device(client, url, f"dev{i}", args.fs, args.post_ms, stop_at, latencies)
+            for i in range(args.devices)
+        ])
+
+        # let the proxy drain (bounded by backoff)
+        drain_until = time.monotonic() + args.drain
+        while time.monotonic() < drain_until:
+            if backlog() == 0:
+                break
+            await asyncio.sleep(0.1)
+
+    mon.cancel()
+    px_server.should_exit = True
+    up_server.should_exit = True
+    await asyncio.gather(px_task, up_task)
+
+    lat = np.array(latencies) * 1e3
+    s = proxy_app.stats
+    result = {
+        "devices": args.devices,
+        "duration_s": args.duration,
+        "format": args.format,
+        "samples_posted": int(sum(sent)),
+        "samples_delivered": stub.samples,
+        "delivery_ratio": stub.samples / max(1, sum(sent)),
+        "ingest_samples_per_s": sum(sent) / args.duration,
+        "ack_ms_p50": float(np.percentile(lat, 50)),
+        "ack_ms_p99": float(np.percentile(lat, 99)),
+        "upstream_requests": stub.requests,
+        "upstream_rejected": stub.rejected,
+        "out_of_order": stub.out_of_order,
+        "backlog_at_end": backlog(),
+        "rss_mb_max_during_run": max((r["rss_mb"] for r in timeline), default=None),
+        "spooled_max": max((r["spooled"] for r in timeline), default=0),
+        "replay_per_s_max": max((r["replay_per_s"] for r in timeline), default=0),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **{f"proxy_{k}": v for k, v in s.items()},
+    }
+    print(json.dumps(result, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="proxy_app load test")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--fs", type=int, default=50)
+    parser.add_argument("--post-ms", type=int, default=500, help="ESP post interval")
+    parser.add_argument("--format", choices=["json", "binary"], default="json")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub upstream latency, s")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--outage", type=float, nargs=2, default=None, metavar=("START", "END"))
+    parser.add_argument("--drain", type=float, default=15)
+    parser.add_argument("--spool", nargs="?", const="", default=None,
+                        help="enable the disk spool (at this path, or a temp file)")
+    parser.add_argument("--timeline", action="store_true", help="print per-second samples")
+    parser.add_argument("--proxy-port", type=int, default=18080)
+    parser.add_argument("--upstream-port", type=int, default=18000)
+    args = parser.parse_args()
+    if args.spool == "":
+        args.spool = os.path.join(tempfile.mkdtemp(), "spool.db")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
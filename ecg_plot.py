@@ -0,0 +1,104 @@
+import base64
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def minmax_decimate(x, max_points):
+    """
+    Reduce `x` to at most `max_points` values by keeping the min and max
+    of each bucket, in time order, so peaks survive the downsampling.
+    With max_points == 1 there is no room for a pair: the mean is returned.
+    """
+    x = np.asarray(x)
+    if max_points <= 0 or x.size <= max_points:
+        return x
+    if max_points == 1:
+        return x.mean(keepdims=True).astype(x.dtype)
+    n_buckets = max(1, max_points // 2)
+    usable = (x.size // n_buckets) * n_buckets
+    buckets = x[x.size - usable:].reshape(n_buckets, -1)   # newest samples kept
+
+    lo = buckets.argmin(axis=1)
+    hi = buckets.argmax(axis=1)
+    first = np.minimum(lo, hi)
+    second = np.maximum(lo, hi)
+    rows = np.arange(n_buckets)
+    out = np.empty((n_buckets, 2), dtype=x.dtype)
+    out[:, 0] = buckets[rows, first]
+    out[:, 1] = buckets[rows, second]
+    return out.ravel()
+
+
+class EcgPlotRenderer:
+    """
+    On-demand ECG strip renderer.
+
+    One matplotlib Figure / Agg canvas is built on first use and reused:
+    a render only swaps the line data and rescales the axes. Encoded PNGs
+    are cached per key (device, worker, ...) together with a version (for
+    example the ring's sample count), so repeated requests for the same
+    window cost nothing until new data arrives.
+    """
+
+    def __init__(self, title="ECG (last 10 s)", figsize=(6, 2), dpi=100, max_cached=256):
+        self.title = title
+        self.figsize = figsize
+        self.dpi = dpi
+        self.max_cached = max_cached
+        self._lock = threading.Lock()       # Agg canvases are not thread-safe
+        self._cache = OrderedDict()         # key -> (version, png bytes)
+        self._canvas = None
+        self.renders = 0
+        self.hits = 0
+
+    def _build(self):
+        # matplotlib only once someone actually asks for a plot
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=self.figsize, dpi=self.dpi)
+        self._canvas = FigureCanvasAgg(fig)
+        self._ax = fig.add_subplot()
+        (self._line,) = self._ax.plot([], [])
+        self._ax.set_title(self.title)
+        fig.tight_layout()
+
+    def png(self, key, version, samples):
+        """PNG bytes of `samples`; re-rendered only if `version` changed for `key`."""
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None and hit[0] == version:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+
+            if self._canvas is None:
+                self._build()
+            y = np.asarray(samples, dtype=float)
+            self._line.set_data(np.arange(y.size), y)
+            self._ax.set_xlim(0, max(y.size - 1, 1))
+            finite = y[np.isfinite(y)]
+            lo, hi = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+            pad = (hi - lo) * 0.05 or 1.0
+            self._ax.set_ylim(lo - pad, hi + pad)
+
+            buf = io.BytesIO()
+            self._canvas.print_png(buf)
+            png = buf.getvalue()
+            self.renders += 1
+
+            self._cache[key] = (version, png)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+            return png
+
+    def png_base64(self, key, version, samples):
+        return base64.b64encode(self.png(key, version, samples)).decode()
+
+    def forget(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
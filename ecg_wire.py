@@ -0,0 +1,123 @@
+import struct
+
+import numpy as np
+
+# ======================================================
+# BINARY ECG FRAME (POST /data, Content-Type below)
+# ======================================================
+# Little-endian, 20-byte fixed header + device_id + samples:
+#
+#   off  size  field
+#   0    2     magic b"EC"
+#   2    1     version (1)
+#   3    1     sample type: 1 = int16, 2 = float32
+#   4    2     sample rate, Hz (uint16)
+#   6    2     device_id length N, bytes (uint16)
+#   8    4     sequence number (uint32, per device, wraps)
+#   12   8     timestamp of the first sample, unix seconds (float64)
+#   20   N     device_id, utf-8
+#   20+N ...   samples
+#
+# Version 2 (28-byte header) carries the proxy's sample numbering
+# (stream_seq.py) instead of a frame counter:
+#
+#   8    4     stream id (uint32, 0 = not numbered)
+#   12   8     sequence number of the first sample (uint64)
+#   20   8     timestamp of the first sample, unix seconds (float64)
+#   28   N     device_id, utf-8
+#
+# The sample block is handed to np.frombuffer as-is, so the server does
+# no per-sample parsing at all.
+
+CONTENT_TYPE = "application/x-ecg-frame"
+
+MAGIC = b"EC"
+VERSION = 1
+HEADER = struct.Struct("<2sBBHHId")
+VERSION_SEQ = 2
+HEADER_SEQ = struct.Struct("<2sBBHHIQd")
+
+SAMPLE_TYPES = {
+    1: np.dtype("<i2"),
+    2: np.dtype("<f4"),
+}
+SAMPLE_CODES = {dt: code for code, dt in SAMPLE_TYPES.items()}
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(device_id, samples, sample_rate, timestamp, seq, dtype="<f4", stream=None):
+    """Version 1 frame, or version 2 when `stream` is given (`seq` numbers samples)."""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if dtype not in SAMPLE_CODES:
+        raise FrameError(f"unsupported sample type: {dtype}")
+
+    dev = device_id.encode("utf-8")
+    if stream is None:
+        header = HEADER.pack(
+            MAGIC, VERSION, SAMPLE_CODES[dtype], int(sample_rate),
+            len(dev), seq & 0xFFFFFFFF, float(timestamp),
+        )
+    else:
+        header = HEADER_SEQ.pack(
+            MAGIC, VERSION_SEQ, SAMPLE_CODES[dtype], int(sample_rate),
+            len(dev), stream & 0xFFFFFFFF, seq, float(timestamp),
+        )
+    body = np.asarray(samples, dtype=dtype).tobytes()
+    return header + dev + body
+
+
+def decode_frame(buf):
+    """
+    Parse a frame without copying the samples.
+
+    Returns a dict with device_id, sample_rate, seq, stream (None unless
+    the samples are numbered), timestamp and `samples`, a read-only
+    ndarray view into `buf`.
+    """
+    buf = memoryview(buf)
+    if len(buf) < HEADER.size:
+        raise FrameError("frame shorter than header")
+
+    if bytes(buf[:2]) != MAGIC:
+        raise FrameError("bad magic")
+    version = buf[2]
+    if version == VERSION:
+        header = HEADER
+        _, _, code, rate, dev_len, seq, ts = HEADER.unpack_from(buf)
+        stream = None
+    elif version == VERSION_SEQ:
+        header = HEADER_SEQ
+        if len(buf) < HEADER_SEQ.size:
+            raise FrameError("frame shorter than header")
+        _, _, code, rate, dev_len, stream, seq, ts = HEADER_SEQ.unpack_from(buf)
+        stream = stream or None
+    else:
+        raise FrameError(f"unsupported version {version}")
+    if code not in SAMPLE_TYPES:
+        raise FrameError(f"unknown sample type {code}")
+
+    start = header.size + dev_len
+    if len(buf) < start:
+        raise FrameError("truncated device_id")
+
+    dtype = SAMPLE_TYPES[code]
+    body = buf[start:]
+    if len(body) % dtype.itemsize:
+        raise FrameError("sample block is not a whole number of samples")
+
+    try:
+        device_id = bytes(buf[header.size:start]).decode("utf-8")
+    except UnicodeDecodeError:
+        raise FrameError("device_id is not utf-8")
+
+    return {
+        "device_id": device_id,
+        "sample_rate": rate,
+        "seq": seq,
+        "stream": stream,
+        "timestamp": ts,
+        "samples": np.frombuffer(body, dtype=dtype),
+    }
@@ -0,0 +1,44 @@
+"""
+gunicorn hooks for server.py (picked up automatically from the working
+directory):
+
+    gunicorn -b 0.0.0.0:8000 server:app
+    gunicorn --preload -w 4 -k gthread --threads 8 server:app     # with ECG_BACKEND=shm
+
+server.py starts no threads at import. With --preload the master
+imports the app and the analysis libraries once and forks the workers
+(copy-on-write); post_fork then starts each worker's background threads.
+"""
+import importlib
+import os
+import sys
+
+ECG_BACKEND = os.environ.get("ECG_BACKEND", "local")
+SHM_NAME = os.environ.get("SHM_NAME", "ecg_rings")
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        # already imported by the master: share the heavy imports too
+        import respiration
+        respiration.preload()
+
+    # shm: every deployment starts from empty rings, not a previous run's
+    if ECG_BACKEND == "shm":
+        app = sys.modules.get("server")
+        if app is not None and app.rings is not None:
+            app.rings.reset()
+        else:
+            from shm_ring import SharedRings
+            SharedRings.unlink(SHM_NAME)
+
+
+def post_fork(server, worker):
+    # threads never survive fork: every worker starts its own
+    importlib.import_module("server").start_background()
+
+
+def on_exit(server):
+    if ECG_BACKEND == "shm":
+        from shm_ring import SharedRings
+        SharedRings.unlink(SHM_NAME)
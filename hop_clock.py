@@ -0,0 +1,47 @@
+class HopClock:
+    """
+    Decides when a stream's next analysis window is due, from sample
+    counts (EcgRingBuffer sequence numbers) instead of wall-clock time.
+
+    Window ends sit on multiples of `hop_samples`, so every device is
+    analysed at the same positions of its own data whatever the arrival
+    jitter or worker load, and a minute of data is always the same number
+    of hops. After a stall the missed ends are replayed, up to
+    `max_catchup` of them and only while the ring still holds their
+    window; anything older is coalesced into the newest window and
+    reported as skipped.
+    """
+
+    def __init__(self, first_seq, window_samples, hop_samples, max_catchup=3):
+        self.window_samples = window_samples
+        self.hop_samples = hop_samples
+        self.max_catchup = max(1, max_catchup)
+        self.next_end = self._align(first_seq + window_samples)
+
+    def _align(self, seq):
+        """First hop boundary at or after `seq`."""
+        return -(-seq // self.hop_samples) * self.hop_samples
+
+    def pending(self, total):
+        return total >= self.next_end
+
+    def due(self, total, first_seq):
+        """
+        Window ends to analyse now, oldest first, for a ring that has
+        received `total` samples and still holds `first_seq` onwards.
+        Returns (ends, skipped).
+        """
+        if total < self.next_end:
+            return [], 0
+
+        hop = self.hop_samples
+        last = self.next_end + (total - self.next_end) // hop * hop
+        oldest = max(
+            self.next_end,
+            self._align(first_seq + self.window_samples),
+            last - (self.max_catchup - 1) * hop,
+        )
+        ends = list(range(oldest, last + 1, hop))
+        skipped = (last - self.next_end) // hop + 1 - len(ends)
+        self.next_end = last + hop
+        return ends, skipped
@@ -0,0 +1,246 @@
+"""
+Minimal in-process metrics: counters, gauges and fixed-bucket
+histograms, rendered in the Prometheus text exposition format.
+
+    REQUESTS = REGISTRY.counter("data_requests_total", "POST /data", ("format",))
+    REQUESTS.labels("json").inc()
+
+    with PARSE_SECONDS.time():
+        ...
+
+Values live in the process that records them (each gunicorn worker,
+each proxy instance). Callback metrics (fn=...) are read at scrape time,
+for values another object already tracks.
+"""
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames and fn is None:
+            self.labels()       # exported as 0 before the first observation
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        # unlabelled metrics use the () child directly
+        return self.labels()
+
+    def samples(self):
+        """[(suffix, label values, extra labels, value)] for rendering."""
+        if self.fn is not None:
+            value = self.fn()
+            if isinstance(value, dict):
+                return [("", k if isinstance(k, tuple) else (k,), (), v)
+                        for k, v in value.items()]
+            return [("", (), (), value)]
+        with self._lock:
+            children = list(self._children.items())
+        out = []
+        for key, child in children:
+            out.extend((suffix, key, extra, v) for suffix, extra, v in child.samples())
+        return out
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} "
+                f"{_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = float(value)
+
+    def samples(self):
+        return [("", (), self.value)]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount=1.0):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        out, running = [], 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            running += c
+            out.append(("_bucket", (("le", _format_value(bound)),), running))
+        out.append(("_sum", (), total))
+        out.append(("_count", (), running))
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, labelnames=(), fn=None):
+        return self._register(Counter, name, help, labelnames, fn=fn)
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self._register(Gauge, name, help, labelnames, fn=fn)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Throttle:
+    """
+    Rate limit for per-sample log lines: allow(key) is true at most once
+    per `interval` seconds per key, and reports how many were skipped.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = {}
+        self._skipped = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """None if suppressed, else the number of lines skipped since the last one."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, -self.interval) < self.interval:
+                self._skipped[key] = self._skipped.get(key, 0) + 1
+                return None
+            self._last[key] = now
+            return self._skipped.pop(key, 0)
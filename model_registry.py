@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# line: the CSV as deployed ("b0,...,b5"), coeffs: float64 [b0, b1..bn],
+# etag: content hash, so rewriting the same coefficients keeps the tag
+Model = namedtuple("Model", "line coeffs etag")
+
+
+class ModelRegistry:
+    """
+    The deployed linear model (one CSV line: intercept, then one
+    coefficient per feature) cached in memory. get() only stats the file
+    and re-reads it when its inode, mtime or size changed, so a model
+    written by another process is still picked up on the next request.
+    """
+
+    def __init__(self, path, n_features):
+        self.path = path
+        self.n_features = n_features
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._model = None
+
+    def _parse(self, line):
+        coeffs = np.array([float(v) for v in line.split(",")], dtype=float)
+        if coeffs.shape != (self.n_features + 1,):
+            raise ValueError(f"expected {self.n_features + 1} coefficients, got {coeffs.size}")
+        etag = hashlib.blake2b(line.encode(), digest_size=8).hexdigest()
+        return Model(line, coeffs, etag)
+
+    def publish(self, line):
+        """Write a new model atomically and make it current."""
+        model = self._parse(line.strip())
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(model.line + "\n")
+        os.replace(tmp, self.path)
+        with self._lock:
+            self._stamp = _stamp(self.path)
+            self._model = model
+        return model
+
+    def get(self):
+        """The current Model, None if there is no (valid) model file."""
+        stamp = _stamp(self.path)
+        with self._lock:
+            if stamp != self._stamp:
+                model = None
+                if stamp is not None:
+                    try:
+                        with open(self.path, "r") as f:
+                            model = self._parse(f.readline().strip())
+                    except (OSError, ValueError):
+                        model = None
+                self._stamp, self._model = stamp, model
+            return self._model
+
+    def predict(self, rows, model=None):
+        """
+        Predictions for an (n, n_features) batch as one matrix product;
+        None if there is no model. Raises ValueError on a malformed batch.
+        """
+        model = model or self.get()
+        if model is None:
+            return None
+        x = np.asarray(rows, dtype=float)
+        if x.ndim == 1 and x.size == 0:
+            x = x.reshape(0, self.n_features)
+        if x.ndim != 2 or x.shape[1] != self.n_features:
+            raise ValueError(f"rows must be [n, {self.n_features}]")
+        return model.coeffs[0] + x @ model.coeffs[1:]
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
@@ -1,11 +1,10 @@
 import time
 import numpy as np
-import pandas as pd
-import neurokit2 as nk
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import io, base64
+
+from ecg_plot import EcgPlotRenderer, minmax_decimate
+from hop_clock import HopClock
+from respiration import IncrementalRespiration, clean_segment, quality_gate, window_rr
+from ring_buffer import EcgRingBuffer
 
 # ===== These will be injected from Flask =====
 ecg_buffer = None
@@ -18,7 +17,44 @@ fs = 50
 window_sec = 30
 window_samples = fs * window_sec
 hop_sec = 10
+hop_samples = fs * hop_sec
+minute_samples = fs * 60
+poll_sec = 0.5                # ring buffers: how often to check the sample count
 intensity_threshold = 0.05
+plot_samples = fs * 10        # last 10 s
+
+# ===== On-demand plot =====
+# The worker only keeps the newest strip; it is drawn when someone asks.
+renderer = EcgPlotRenderer()
+plot_strip = None
+plot_version = 0
+
+def render_plot(fmt="png", max_points=200):
+    """
+    Plot of the newest window: base64 PNG (cached until the next hop) or,
+    with fmt="json", a min/max-downsampled list of at most `max_points`.
+    """
+    strip = plot_strip
+    if strip is None:
+        return None
+    if fmt == "json":
+        return minmax_decimate(strip, max_points).tolist()
+    return renderer.png_base64("nk_worker", plot_version, strip)
+
+class LatestPlot(dict):
+    """
+    latest_plot for start_worker() that renders "img" (base64 PNG of the
+    newest window) only when it is read. A plain dict still gets "img"
+    filled every hop, as before, from the cached renderer.
+    """
+
+    def __missing__(self, key):
+        if key == "img":
+            return render_plot()
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self or key == "img" else default
 
 def start_worker(
     _ecg_buffer,
@@ -27,72 +63,93 @@ def start_worker(
     _latest_plot
 ):
     global ecg_buffer, latest_rr, resp_rate_history, latest_plot
+    global plot_strip, plot_version
 
     ecg_buffer = _ecg_buffer
     latest_rr = _latest_rr
     resp_rate_history = _resp_rate_history
     latest_plot = _latest_plot
+    # latest_plot["render"](fmt, max_points) renders on demand;
+    # latest_plot["img"] keeps working (see LatestPlot)
+    latest_plot["render"] = render_plot
+    eager_img = not isinstance(latest_plot, LatestPlot)
 
     resp_rate_all = []
-    minute_start = time.time()
+    minute = None
+
+    # a ring buffer tells us how many samples are new, so the window can
+    # be updated incrementally instead of re-filtered every hop, and hops
+    # can follow the sample count instead of the wall clock
+    engine = clock = None
+    if isinstance(ecg_buffer, EcgRingBuffer):
+        engine = IncrementalRespiration(
+            fs, window_samples, intensity_threshold, fallback=False
+        )
 
     print("[NK] Worker started on Azure")
 
+    deadline = time.monotonic()
     while True:
-        time.sleep(hop_sec)
-
-        if len(ecg_buffer) < window_samples:
-            continue
-
-        segment = np.array(ecg_buffer[-window_samples:])
-        segment = np.where(segment >= 0, segment, np.nan)
-        segment = pd.Series(segment).interpolate().bfill().to_numpy()
-
-        try:
-            edr = nk.ecg_rsp(segment, sampling_rate=fs)
-
-            rsp_intensity = (
-                pd.Series(edr)
-                .rolling(int(3 * fs), center=True)
-                .std()
-                .fillna(0)
-            )
-
-            rr = np.array(nk.rsp_rate(edr, sampling_rate=fs))
-            valid_rr = rr[rsp_intensity >= intensity_threshold]
-            valid_rr = valid_rr[valid_rr > 0]
-
-            if len(valid_rr) > 0:
-                rr_val = float(np.mean(valid_rr))
+        if engine is not None:
+            time.sleep(poll_sec)
+            if clock is None:
+                if len(ecg_buffer) < window_samples:
+                    continue
+                clock = HopClock(ecg_buffer.first_seq, window_samples, hop_samples)
+            ends, _ = clock.due(ecg_buffer.total, ecg_buffer.first_seq)
+        else:
+            # fixed deadlines: the work no longer pushes every hop later;
+            # after a stall, restart the grid instead of firing a burst
+            deadline += hop_sec
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                deadline = time.monotonic()
+            else:
+                time.sleep(delay)
+            if len(ecg_buffer) < window_samples:
+                continue
+            ends = [None]
+
+        for end in ends:
+            if engine is not None:
+                engine.consume(ecg_buffer, upto=end)
+                raw = ecg_buffer.window(end, window_samples, dtype=float)
+                segment = engine.cleaned
+                hop_minute = (end - 1) // minute_samples
+            else:
+                raw = np.array(ecg_buffer[-window_samples:], dtype=float)
+                segment = clean_segment(raw)
+                hop_minute = int(time.time() // 60)
+
+            # ---- quality gate: unusable windows skip NeuroKit ----
+            reason = quality_gate(raw, fs)[0][0]
+            if reason is not None:
+                rr_val, status = None, reason
+                print("[NK] Window rejected:", reason)
+            elif engine is not None:
+                rr_val, status = engine.rr()
+            else:
+                rr_val, status = window_rr(segment, fs, intensity_threshold, fallback=False)
+
+            if status.startswith("error"):
+                print("[NK] Error:", status)
+                continue
+
+            # ---- 1-minute average, closed by the first hop of the next minute ----
+            if minute is not None and hop_minute != minute:
+                if resp_rate_all:
+                    avg = float(np.mean(resp_rate_all))
+                    resp_rate_history.append(avg)
+                    print("[NK] 1-min RR:", avg)
+                resp_rate_all.clear()
+            minute = hop_minute
+
+            if rr_val is not None:
                 resp_rate_all.append(rr_val)
                 latest_rr["value"] = rr_val
 
-        except Exception as e:
-            print("[NK] Error:", e)
-            continue
-
-        # ---- 1-minute average ----
-        if time.time() - minute_start >= 60:
-            if resp_rate_all:
-                avg = float(np.mean(resp_rate_all))
-                resp_rate_history.append(avg)
-                print("[NK] 1-min RR:", avg)
-
-            resp_rate_all.clear()
-            minute_start = time.time()
-
-        # ---- ECG plot ----
-        try:
-            fig, ax = plt.subplots(figsize=(6, 2))
-            ax.plot(segment[-500:])
-            ax.set_title("ECG (last 10 s)")
-            fig.tight_layout()
-
-            buf = io.BytesIO()
-            fig.savefig(buf, format="png")
-            buf.seek(0)
-            latest_plot["img"] = base64.b64encode(buf.read()).decode()
-            plt.close(fig)
-
-        except Exception:
-            pass
+            # ---- ECG plot: keep the strip, render on demand ----
+            plot_strip = np.array(segment[-plot_samples:])
+            plot_version += 1
+            if eager_img:
+                latest_plot["img"] = render_plot()
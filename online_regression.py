@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+
+
+class IncrementalLeastSquares:
+    """
+    Ordinary least squares with intercept, updated one sample at a time.
+
+    Keeps the sufficient statistics of [x, y]: the running mean and the
+    centered co-moment matrix sum((z - mean)(z - mean)^T), updated
+    Welford-style in O(features^2). Solving the centered normal equations
+    is what LinearRegression does internally, so the coefficients match a
+    full refit on the same rows; centering keeps the system well
+    conditioned even with raw ADC-scale features.
+    """
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+        self.n = 0
+        self.mean = np.zeros(n_features + 1)
+        self.comoment = np.zeros((n_features + 1, n_features + 1))
+
+    def update(self, x, y):
+        z = np.append(np.asarray(x, dtype=float), float(y))
+        self.n += 1
+        delta = z - self.mean
+        self.mean += delta / self.n
+        self.comoment += np.outer(delta, z - self.mean)
+
+    def coefficients(self):
+        """Returns (intercept, coef). Min-norm solution if rank deficient."""
+        cxx = self.comoment[:-1, :-1]
+        cxy = self.comoment[:-1, -1]
+
+        # Jacobi scaling: features range from ~1 (ratio) to ~4000 (dc)
+        scale = np.sqrt(np.diag(cxx))
+        scale[scale == 0] = 1.0
+        coef = np.linalg.lstsq(cxx / np.outer(scale, scale), cxy / scale, rcond=None)[0]
+        coef /= scale
+
+        intercept = self.mean[-1] - coef @ self.mean[:-1]
+        return float(intercept), coef
+
+    def sse(self, intercept, coef):
+        """Sum of squared residuals of a linear model over the rows seen."""
+        w = np.append(-np.asarray(coef, dtype=float), 1.0)
+        bias = self.mean @ w - intercept
+        return float(self.n * bias * bias + w @ self.comoment @ w)
+
+    def state(self, prefix):
+        return {
+            prefix + "n": self.n,
+            prefix + "mean": self.mean,
+            prefix + "comoment": self.comoment,
+        }
+
+    def load_state(self, state, prefix):
+        self.n = int(state[prefix + "n"])
+        self.mean = np.array(state[prefix + "mean"], dtype=float)
+        self.comoment = np.array(state[prefix + "comoment"], dtype=float)
+
+
+class HoldoutRegression:
+    """
+    Incremental train / validation pair with a fixed hold-out.
+
+    Every `holdout_every`-th accepted sample goes to validation, the rest
+    to training, so a sample never changes side as the data set grows and
+    the validation RMSE can be kept from sufficient statistics too.
+    """
+
+    def __init__(self, n_features, holdout_every=5):
+        self.holdout_every = holdout_every
+        self.train = IncrementalLeastSquares(n_features)
+        self.val = IncrementalLeastSquares(n_features)
+
+    @property
+    def n(self):
+        return self.train.n + self.val.n
+
+    def update(self, x, y):
+        if (self.n + 1) % self.holdout_every == 0:
+            self.val.update(x, y)
+        else:
+            self.train.update(x, y)
+
+    def fit(self):
+        """Returns (intercept, coef, validation rmse)."""
+        intercept, coef = self.train.coefficients()
+        rmse = None
+        if self.val.n:
+            rmse = float(np.sqrt(max(self.val.sse(intercept, coef), 0.0) / self.val.n))
+        return intercept, coef, rmse
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, holdout_every=self.holdout_every,
+                 **self.train.state("train_"), **self.val.state("val_"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, n_features):
+        with np.load(path) as state:
+            model = cls(n_features, int(state["holdout_every"]))
+            model.train.load_state(state, "train_")
+            model.val.load_state(state, "val_")
+        return model
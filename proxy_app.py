@@ -1,23 +1,124 @@
 # proxy_app.py
 import asyncio
+import os
+import random
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
-from fastapi import FastAPI, Request
-import httpx
+from fastapi import FastAPI, Request, Response
 import uvicorn
 from pydantic import BaseModel
 
+import ecg_wire
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, Throttle
+from proxy_queue import DeviceQueue
+from proxy_router import Router
+from proxy_spool import SampleSpool
+
 app = FastAPI()
 
 # Configuration
-UPSTREAM_URL = "http://127.0.0.1:8000/data"  # change to your Flask /data if remote
-FLUSH_MS = int(500)           # flush every 500 ms
-MAX_BATCH = 500               # flush if buffer reaches this many samples
+UPSTREAM_URL = os.environ.get("UPSTREAM_URL", "http://127.0.0.1:8000/data")  # Flask /data
+# Several analysis servers: comma-separated /data URLs. Devices are spread
+# over them by consistent hashing (proxy_router.py); a backend that fails
+# its health checks hands only its own devices to the next one on the ring.
+UPSTREAM_URLS = [u.strip() for u in os.environ.get("UPSTREAM_URLS", UPSTREAM_URL).split(",")
+                 if u.strip()]
+FLUSH_MS = int(500)           # deadline: flush a device's oldest sample after 500 ms
+MAX_BATCH = 500               # ... or as soon as it has this many samples queued
 ACK_IMMEDIATE = True          # immediately ack ESP (true)
+UPSTREAM_FORMAT = os.environ.get("UPSTREAM_FORMAT", "json")   # "json" or "binary"
+SAMPLE_RATE = 50              # Hz, written into binary frame headers
+
+FLUSH_TICK_MS = 50            # how often the flush loop checks deadlines
+MAX_QUEUE_SAMPLES = 30000     # per device (10 min at 50 Hz); oldest dropped beyond
+MAX_CONCURRENCY = 16          # simultaneous POSTs per backend (one per device at most)
+UPSTREAM_TIMEOUT = 10.0       # seconds
+HEALTH_INTERVAL = 2.0         # seconds between GET / health checks of every backend
+HEALTH_TIMEOUT = 1.0
+FAIL_AFTER = 3                # consecutive failed uploads / checks: backend down
+RECOVER_AFTER = 2             # consecutive good checks: back up
+BACKOFF_BASE = 0.5            # seconds, doubled per consecutive failure ...
+BACKOFF_MAX = 30.0            # ... up to this, with +/-20 % jitter
+MAX_ATTEMPTS = 8              # retry budget per batch before it is dropped
+
+# Optional disk spool (SQLite WAL). When set, batches that fail upstream or
+# overflow MAX_QUEUE_SAMPLES go to disk instead of being dropped, and are
+# replayed in order once the upstream is back. Survives proxy restarts.
+SPOOL_PATH = os.environ.get("SPOOL_PATH")                     # e.g. /var/lib/proxy/spool.db
+SPOOL_MAX_SAMPLES = int(os.environ.get("SPOOL_MAX_SAMPLES", 250_000_000))   # ~1 GB float32
+REPLAY_RATE_WINDOW = 10.0     # seconds, for the replay rate in /stats
+
+# Every sample is numbered per device as it arrives; batches go upstream
+# with the number of their first sample and this run's stream id, so the
+# server drops anything it already has (a retry whose ack was lost) and
+# counts what never arrived (see stream_seq.py). Spooled batches keep the
+# numbering of the run that received them. 0 is reserved: "not numbered".
+STREAM_ID = int.from_bytes(os.urandom(4), "little") or 1
+
+# In-memory queues per device_id
+queues = {}          # device_id -> DeviceQueue
+next_seq = {}        # device_id -> number of the next sample received
+spool = None         # SampleSpool when SPOOL_PATH is set
+router = Router(UPSTREAM_URLS, MAX_CONCURRENCY, UPSTREAM_TIMEOUT, FAIL_AFTER, RECOVER_AFTER)
+replayed = deque()   # (monotonic time, samples) of recent replay uploads
+
+# SQLite blocks: every spool call runs on this one thread, in the order it
+# was submitted (a device's rows stay in upload order), so a slow disk
+# never stalls ingest or the flush loop
+spool_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool")
 
-# In-memory buffers per device_id
-buffers = {}         # device_id -> list of samples
-buffers_lock = asyncio.Lock()
+def spool_io(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(spool_thread, fn, *args)
+
+stats = {
+    "samples_received": 0,
+    "samples_sent": 0,
+    "samples_dropped_overflow": 0,   # queue bound hit, oldest samples dropped
+    "samples_dropped_retry": 0,      # batch ran out of retry budget
+    "samples_dropped_spool": 0,      # spool size cap hit
+    "samples_dropped_rejected": 0,   # upstream refused the batch (4xx)
+    "samples_spooled": 0,
+    "samples_replayed": 0,
+    "batches_sent": 0,
+    "upstream_errors": 0,
+    "retries": 0,
+}
+
+# ---- metrics (/metrics) ----
+for _key in stats:
+    REGISTRY.counter(f"proxy_{_key}_total", f"Proxy {_key.replace('_', ' ')}",
+                     fn=lambda k=_key: stats[k])
+REGISTRY.gauge(
+    "proxy_queue_samples", "Samples queued in memory per device", ("device_id",),
+    fn=lambda: {dev: q.size for dev, q in queues.items()},
+)
+REGISTRY.gauge("proxy_spool_samples", "Samples in the disk spool",
+               fn=lambda: spool.size if spool is not None else 0)
+FLUSH_SECONDS = REGISTRY.histogram("proxy_flush_seconds", "Upstream POST latency per batch")
+BATCH_AGE_SECONDS = REGISTRY.histogram("proxy_batch_age_seconds",
+                                       "Time the oldest sample waited in memory before upload")
+UPSTREAM_ERRORS = REGISTRY.counter("proxy_upstream_errors_by_reason_total",
+                                   "Failed upstream POSTs", ("reason",))
+REGISTRY.gauge("proxy_backend_up", "Backend healthy (1) or down (0)", ("backend",),
+               fn=lambda: {u: int(b.healthy) for u, b in router.backends.items()})
+REGISTRY.gauge("proxy_backend_inflight", "Uploads in flight per backend", ("backend",),
+               fn=lambda: {u: b.inflight for u, b in router.backends.items()})
+REGISTRY.gauge("proxy_backend_waiting", "Uploads waiting for a backend slot", ("backend",),
+               fn=lambda: {u: b.waiting for u, b in router.backends.items()})
+for _key in ("samples_sent", "errors", "marked_down"):
+    REGISTRY.counter(f"proxy_backend_{_key}_total", f"Per-backend {_key.replace('_', ' ')}",
+                     ("backend",),
+                     fn=lambda k=_key: {u: b.stats[k] for u, b in router.backends.items()})
+
+# one error line per device every 10 s; the rest only count
+error_log = Throttle(10.0)
+
+def log_error(device, msg):
+    skipped = error_log.allow(device)
+    if skipped is not None:
+        print(f"[proxy] {msg}" + (f" (+{skipped} similar)" if skipped else ""))
 
 class DataPayload(BaseModel):
     device_id: Optional[str] = "default"
@@ -27,8 +128,64 @@ class DataPayload(BaseModel):
 
 @app.on_event("startup")
 async def startup_flush_task():
+    global spool
+    if SPOOL_PATH:
+        spool = await spool_io(SampleSpool, SPOOL_PATH, SPOOL_MAX_SAMPLES)
+        # devices with a backlog from before the restart get replayed
+        for device in spool.depth:
+            get_queue(device)
+        if spool.size:
+            print(f"[proxy] spool: {spool.size} samples pending for {len(spool.depth)} devices")
+    router.open()
+    asyncio.create_task(router.health_loop(HEALTH_INTERVAL, HEALTH_TIMEOUT))
     asyncio.create_task(flush_loop())
 
+@app.on_event("shutdown")
+async def shutdown_spill():
+    # a redeploy of the proxy keeps whatever is still queued in memory
+    if spool is not None:
+        for device, q in queues.items():
+            spill(device, q)
+        await spool_io(spool.close)     # runs after the spills above
+    spool_thread.shutdown()
+    await router.close()
+
+def get_queue(device):
+    q = queues.get(device)
+    if q is None:
+        q = queues[device] = DeviceQueue(MAX_QUEUE_SAMPLES)
+    return q
+
+def spill(device, q):
+    """
+    Move everything queued in memory for `device` to the spool tail. The
+    write is only submitted to the spool thread; the flush loop leaves
+    the device alone until it is on disk.
+    """
+    batches = []
+    while q.size:
+        batches.append(q.take(MAX_BATCH))
+    if not batches:
+        return
+    stats["samples_spooled"] += sum(samples.size for samples, _, _ in batches)
+    q.spilling += 1
+    spool_io(spool_batches, device, batches).add_done_callback(
+        lambda f: spilled(device, q, f)
+    )
+
+def spool_batches(device, batches):
+    # spool thread
+    return sum(spool.append(device, samples, ts, seq, STREAM_ID) for samples, ts, seq in batches)
+
+def spilled(device, q, future):
+    q.spilling -= 1
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        log_error(device, f"spool write failed: {device} {future.exception()}")
+        return
+    stats["samples_dropped_spool"] += future.result()
+
 @app.post("/data")
 async def receive_data(payload: DataPayload, request: Request):
     """
@@ -48,65 +205,223 @@ async def receive_data(payload: DataPayload, request: Request):
     else:
         samples = [payload.ecg]
 
-    async with buffers_lock:
-        if device not in buffers:
-            buffers[device] = []
-        # append (value, timestamp) pairs (server time)
-        ts = payload.timestamp or time.time()
-        buffers[device].extend([{"ecg": v, "timestamp": ts} for v in samples])
+    q = get_queue(device)
+    if spool is not None and q.size + len(samples) > MAX_QUEUE_SAMPLES:
+        spill(device, q)     # memory bound hit: spill to disk instead of dropping
+
+    # one float32 array per request (timestamp: ESP's, else server time)
+    ts = payload.timestamp or time.time()
+    seq = next_seq.get(device, 0)
+    next_seq[device] = seq + len(samples)
+    stats["samples_received"] += len(samples)
+    stats["samples_dropped_overflow"] += q.push(samples, ts, time.monotonic(), seq)
+
+    # immediate lightweight ack so ESP doesn't block; flush_loop sends it
+    return {"status": "received", "queued": q.size}
+
+
+def replay_rate(now):
+    while replayed and now - replayed[0][0] > REPLAY_RATE_WINDOW:
+        replayed.popleft()
+    return sum(n for _, n in replayed) / REPLAY_RATE_WINDOW
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 
-        # if buffer too large, schedule immediate flush by returning a header (flush will run)
-        if len(buffers[device]) >= MAX_BATCH:
-            # let flush_loop pick it up; we respond immediately
-            pass
+@app.get("/stats")
+async def get_stats():
+    out = {
+        **stats,
+        "stream": STREAM_ID,
+        "queued_samples": sum(q.size for q in queues.values()),
+        "devices": {
+            dev: {"queued": q.size, "failures": q.failures, "inflight": q.inflight,
+                  "spooled": spool.depth.get(dev, 0) if spool is not None else 0,
+                  "backend": router.route(dev).url}
+            for dev, q in queues.items()
+        },
+        "backends": router_stats(),
+    }
+    if spool is not None:
+        out["spool"] = {
+            "samples": spool.size,
+            "devices": len(spool.depth),
+            "disk_bytes": spool.disk_bytes(),
+            "replay_samples_per_s": replay_rate(time.monotonic()),
+        }
+    return out
 
-    # immediate lightweight ack so ESP doesn't block
-    return {"status": "received", "queued": len(buffers.get(device, []))}
+
+def router_stats():
+    devices = {url: 0 for url in router.backends}
+    for dev in queues:
+        devices[router.route(dev).url] += 1
+    return {url: {**b.describe(), "devices": devices[url]} for url, b in router.backends.items()}
+
+
+def backoff_delay(failures):
+    delay = min(BACKOFF_BASE * (2 ** (failures - 1)), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def post_upstream(backend, device, samples, first_ts, seq, stream):
+    # prepare upstream payload format expected by Flask
+    # (stream None: an old spool row without numbering)
+    if UPSTREAM_FORMAT == "binary":
+        frame = ecg_wire.encode_frame(device, samples, SAMPLE_RATE, first_ts,
+                                      seq or 0, stream=stream)
+        return await backend.client.post(
+            backend.url, content=frame,
+            headers={"Content-Type": ecg_wire.CONTENT_TYPE},
+        )
+
+    # We'll send {"device_id": device, "ecg": [v1, v2, ...], "timestamp": now,
+    #             "seq": first sample number, "stream": STREAM_ID}
+    payload = {"device_id": device, "ecg": samples.tolist(), "timestamp": time.time()}
+    if stream is not None:
+        payload.update(seq=seq, stream=stream)
+    # If your Flask expects a different format, adapt here
+    return await backend.client.post(backend.url, json=payload)
+
+
+def rejected(status):
+    # the upstream will never take this batch; retrying only blocks the device
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+async def send_batch(device, q, samples, first_ts, seq, stream, attempt, replay_pos=None):
+    """
+    Upload one batch to the device's backend; on failure requeue it at
+    the front and back off (or fail over at once if that backend just
+    went down). `replay_pos` is set for batches read from the spool: they
+    are deleted from disk only once acked, and simply stay there on
+    failure. Resending is always safe: the server drops samples it
+    already has.
+    """
+    backend = router.route(device)
+    status = None
+    try:
+        backend.waiting += 1
+        async with backend.limiter:
+            backend.waiting -= 1
+            backend.inflight += 1
+            try:
+                with FLUSH_SECONDS.time():
+                    r = await post_upstream(backend, device, samples, first_ts, seq, stream)
+            finally:
+                backend.inflight -= 1
+        status = r.status_code
+        if status != 200:
+            UPSTREAM_ERRORS.labels(status).inc()
+            log_error(device, f"upstream error: {device} {status} {r.text[:200]}")
+    except Exception as e:
+        UPSTREAM_ERRORS.labels(type(e).__name__).inc()
+        log_error(device, f"exception posting upstream: {device} {e}")
+
+    # 4xx is about the batch, not the backend
+    router.record(backend, status is not None and status < 500)
+    now = time.monotonic()
+    if status == 200:
+        q.failures = 0
+        q.attempt = 0
+        stats["samples_sent"] += samples.size
+        stats["batches_sent"] += 1
+        backend.stats["samples_sent"] += samples.size
+        backend.stats["batches_sent"] += 1
+        if replay_pos is not None:
+            await spool_io(spool.pop, device, replay_pos)
+            stats["samples_replayed"] += samples.size
+            replayed.append((now, samples.size))
+    elif spool is not None:
+        stats["upstream_errors"] += 1
+        q.failures += 1
+        q.retry_at = now + backoff_delay(q.failures)
+        if rejected(status):
+            stats["samples_dropped_rejected"] += samples.size
+            if replay_pos is not None:
+                await spool_io(spool.pop, device, replay_pos)
+        elif replay_pos is None:
+            # no retry budget with a spool: keep it on disk until it goes through
+            stats["retries"] += 1
+            stats["samples_spooled"] += samples.size
+            stats["samples_dropped_spool"] += await spool_io(spool.prepend, device, samples,
+                                                             first_ts, seq, stream)
+            spill(device, q)
+        else:
+            stats["retries"] += 1
+    else:
+        stats["upstream_errors"] += 1
+        q.failures += 1
+        q.retry_at = now + backoff_delay(q.failures)
+        if rejected(status):
+            stats["samples_dropped_rejected"] += samples.size
+            q.attempt = 0
+        elif attempt + 1 >= MAX_ATTEMPTS:
+            # retry budget spent: give up on this batch, keep newer data flowing
+            stats["samples_dropped_retry"] += samples.size
+            q.attempt = 0
+        else:
+            stats["retries"] += 1
+            q.attempt = attempt + 1
+            stats["samples_dropped_overflow"] += q.requeue(samples, first_ts, now, seq)
+    if status != 200 and router.route(device) is not backend:
+        q.retry_at = now    # failed over: the next backend gets it right away
+    q.inflight = False
+
+
+async def replay_batch(device, q):
+    """Upload the oldest spooled rows of `device` (read on the spool thread)."""
+    batch = None
+    try:
+        batch = await spool_io(spool.peek, device, MAX_BATCH)
+    finally:
+        if batch is None:
+            q.inflight = False
+    if batch is None:
+        return
+    samples, first_ts, pos, seq, stream = batch
+    await send_batch(device, q, samples, first_ts, seq, stream, 0, pos)
 
 
 async def flush_loop():
-    client = httpx.AsyncClient(timeout=10.0)
+    deadline = FLUSH_MS / 1000.0
+
     while True:
-        await asyncio.sleep(FLUSH_MS / 1000.0)
-        async with buffers_lock:
-            to_send = {}
-            for device, arr in list(buffers.items()):
-                if not arr:
-                    continue
-                # criteria to flush:
-                if len(arr) >= MAX_BATCH or True:
-                    # take all current items to send
-                    to_send[device] = arr.copy()
-                    buffers[device] = []
-        # send outside lock
-        for device, arr in to_send.items():
-            # prepare upstream payload format expected by Flask
-            # We'll send {"device_id": device, "ecg": [v1, v2, ...], "timestamp": now}
-            try:
-                ecg_list = [entry["ecg"] for entry in arr]
-                payload = {"device_id": device, "ecg": ecg_list, "timestamp": time.time()}
-                # If your Flask expects a different format, adapt here
-                r = await client.post(UPSTREAM_URL, json=payload)
-                if r.status_code != 200:
-                    print("[proxy] upstream error:", r.status_code, r.text)
-                    # On failure: requeue items for next try
-                    async with buffers_lock:
-                        buffers.setdefault(device, [])
-                        # prepend failed items so we keep order
-                        buffers[device] = arr + buffers[device]
-                else:
-                    # success
-                    pass
-            except Exception as e:
-                print("[proxy] exception posting upstream:", e)
-                # requeue
-                async with buffers_lock:
-                    buffers.setdefault(device, [])
-                    buffers[device] = arr + buffers[device]
-
-    # never reach client.aclose() in normal loop
+        await asyncio.sleep(FLUSH_TICK_MS / 1000.0)
+        now = time.monotonic()
+
+        for device, q in list(queues.items()):
+            # at most one batch in flight per device, so order is kept
+            # (and none while its memory queue is being written to disk)
+            if q.inflight or q.spilling or now < q.retry_at:
+                continue
+            # criteria to flush: full batch, or oldest sample past deadline
+            # (a requeued batch goes out as soon as its backoff expires)
+            backlog = spool is not None and device in spool.depth
+            if backlog:
+                # spooled data is older than anything in memory: memory goes
+                # behind it on disk, and the spool is replayed first
+                if q.size and (q.size >= MAX_BATCH or now - q.oldest_at >= deadline):
+                    spill(device, q)
+                q.inflight = True
+                asyncio.create_task(replay_batch(device, q))
+                continue
+
+            if q.size == 0:
+                continue
+            if q.size < MAX_BATCH and now - q.oldest_at < deadline and not q.attempt:
+                continue
+
+            BATCH_AGE_SECONDS.observe(now - q.oldest_at)
+            samples, first_ts, seq = q.take(MAX_BATCH)
+            q.inflight = True
+            asyncio.create_task(
+                send_batch(device, q, samples, first_ts, seq, STREAM_ID, q.attempt)
+            )
 
 
 if __name__ == "__main__":
     uvicorn.run("proxy_app:app", host="0.0.0.0", port=8080, workers=1)
-
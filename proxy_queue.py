@@ -0,0 +1,102 @@
+from collections import deque
+
+import numpy as np
+
+
+class DeviceQueue:
+    """
+    Bounded FIFO of ECG samples for one device, waiting to go upstream.
+
+    Samples are kept as float32 arrays, one per received chunk, each with
+    the timestamp it arrived with and the sequence number of its first
+    sample (None if not numbered). When `max_samples` would be exceeded
+    the oldest samples are dropped (and counted): for respiration
+    analysis the newest 30 s matter far more than a stale backlog.
+    """
+
+    def __init__(self, max_samples):
+        self.max_samples = max_samples
+        self._chunks = deque()      # (samples: float32 ndarray, timestamp, seq)
+        self.size = 0
+        self.oldest_at = None       # monotonic arrival time of the oldest chunk
+
+        # ---- upload state, owned by the flush loop ----
+        self.inflight = False
+        self.failures = 0           # consecutive failed uploads
+        self.attempt = 0            # failed attempts of the batch at the front
+        self.retry_at = 0.0         # monotonic time before which we back off
+        self.spilling = 0           # spool writes submitted but not yet on disk
+
+    def push(self, samples, timestamp, now, seq=None):
+        """Append a chunk; returns the number of samples dropped to stay bounded."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.size == 0:
+            return 0
+        if not self._chunks:
+            self.oldest_at = now
+        self._chunks.append((samples, timestamp, seq))
+        self.size += samples.size
+        return self._trim_front()
+
+    def requeue(self, samples, timestamp, now, seq=None):
+        """Put a failed batch back at the front, keeping order."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.size == 0:
+            return 0
+        self._chunks.appendleft((samples, timestamp, seq))
+        self.size += samples.size
+        self.oldest_at = now if self.oldest_at is None else min(self.oldest_at, now)
+        return self._trim_front()
+
+    def take(self, max_samples):
+        """
+        Pop up to `max_samples` from the front as one contiguous array.
+        Returns (samples, timestamp, sequence number of the first sample).
+        Stops early where numbering jumps (samples dropped in between),
+        so a batch is always consecutive samples.
+        """
+        parts = []
+        n = 0
+        first_ts, first_seq = self._chunks[0][1:] if self._chunks else (None, None)
+
+        while self._chunks and n < max_samples:
+            samples, ts, seq = self._chunks[0]
+            if parts and seq != _after(first_seq, n):
+                break
+            self._chunks.popleft()
+            room = max_samples - n
+            if samples.size > room:
+                self._chunks.appendleft((samples[room:], ts, _after(seq, room)))
+                samples = samples[:room]
+            parts.append(samples)
+            n += samples.size
+
+        self.size -= n
+        if not self._chunks:
+            self.oldest_at = None
+
+        if not parts:
+            return np.empty(0, dtype=np.float32), first_ts, first_seq
+        if len(parts) == 1:
+            return parts[0], first_ts, first_seq
+        return np.concatenate(parts), first_ts, first_seq
+
+    def _trim_front(self):
+        dropped = 0
+        while self.size > self.max_samples:
+            samples, ts, seq = self._chunks.popleft()
+            excess = self.size - self.max_samples
+            if samples.size > excess:
+                self._chunks.appendleft((samples[excess:], ts, _after(seq, excess)))
+                self.size -= excess
+                dropped += excess
+            else:
+                self.size -= samples.size
+                dropped += samples.size
+        if not self._chunks:
+            self.oldest_at = None
+        return dropped
+
+
+def _after(seq, n):
+    return None if seq is None else seq + n
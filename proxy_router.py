@@ -0,0 +1,182 @@
+import asyncio
+import bisect
+import hashlib
+import time
+from urllib.parse import urljoin
+
+import httpx
+
+VNODES = 160    # ring points per backend: spreads devices to within a few %
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys (device ids) onto nodes. Every node owns
+    `vnodes` points on a 64-bit ring and a key belongs to the first point
+    clockwise from its hash. Adding or removing a node only moves the
+    keys that node gains or loses (about 1/N of them); skipping an
+    unusable node in lookup() moves only that node's keys.
+    """
+
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.vnodes = vnodes
+        self._nodes = []
+        self._points = []       # sorted point hashes
+        self._owners = []       # node of each point
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        self._rebuild()
+
+    def remove(self, node):
+        self._nodes.remove(node)
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self._nodes for i in range(self.vnodes)
+        )
+        self._points = [p for p, _ in points]
+        self._owners = [n for _, n in points]
+
+    def lookup(self, key, usable=None):
+        """
+        Node for `key`: the first one clockwise for which usable(node) is
+        true (any node if `usable` is None). None if no node is usable.
+        """
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key))
+        tried = set()
+        for k in range(len(self._points)):
+            node = self._owners[(i + k) % len(self._points)]
+            if usable is None or usable(node):
+                return node
+            tried.add(node)
+            if len(tried) == len(self._nodes):
+                break
+        return None
+
+
+class Backend:
+    """One analysis server: its own connection pool, upload limit and health."""
+
+    def __init__(self, url, max_concurrency):
+        self.url = url                              # POST target (.../data)
+        self.health_url = urljoin(url, "/")
+        self.limiter = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.client = None                          # httpx.AsyncClient, see Router.open()
+
+        self.healthy = True
+        self.fails = 0              # consecutive failed checks / uploads
+        self.oks = 0                # consecutive good health checks while down
+        self.changed_at = time.time()
+        self.waiting = 0            # uploads queued for the limiter
+        self.inflight = 0
+        self.stats = {"batches_sent": 0, "samples_sent": 0, "errors": 0, "marked_down": 0}
+
+    def describe(self):
+        return {
+            "healthy": self.healthy,
+            "since": self.changed_at,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            **self.stats,
+        }
+
+
+class Router:
+    """
+    Maps devices onto backends with a HashRing. A backend is marked down
+    after `fail_after` consecutive failed uploads or health checks and up
+    again after `recover_after` good health checks; while it is down its
+    devices go to the next backend on the ring, everyone else stays put.
+    """
+
+    def __init__(self, urls, max_concurrency, timeout, fail_after=3, recover_after=2):
+        self.backends = {url: Backend(url, max_concurrency) for url in urls}
+        self.ring = HashRing(self.backends)
+        self.timeout = timeout
+        self.fail_after = fail_after
+        self.recover_after = recover_after
+        self._routes = {}           # device -> Backend, until the healthy set changes
+
+    def open(self):
+        """Create the connection pools (inside the running event loop)."""
+        for b in self.backends.values():
+            limits = httpx.Limits(max_connections=b.max_concurrency,
+                                  max_keepalive_connections=b.max_concurrency)
+            b.client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+
+    async def close(self):
+        for b in self.backends.values():
+            if b.client is not None:
+                await b.client.aclose()
+
+    def route(self, device):
+        """Backend for `device`; its ring owner if every backend is down."""
+        backend = self._routes.get(device)
+        if backend is None:
+            url = (self.ring.lookup(device, lambda u: self.backends[u].healthy)
+                   or self.ring.lookup(device))
+            backend = self._routes[device] = self.backends[url]
+        return backend
+
+    def record(self, backend, ok):
+        """Passive health: the outcome of an upload."""
+        if ok:
+            backend.fails = 0
+        else:
+            backend.stats["errors"] += 1
+            self._fail(backend)
+
+    def _fail(self, backend):
+        backend.fails += 1
+        if backend.healthy and backend.fails >= self.fail_after:
+            self._set_healthy(backend, False)
+
+    def _set_healthy(self, backend, healthy):
+        backend.healthy = healthy
+        backend.changed_at = time.time()
+        backend.fails = backend.oks = 0
+        if not healthy:
+            backend.stats["marked_down"] += 1
+        self._routes.clear()
+        state = "up" if healthy else "DOWN"
+        print(f"[proxy] backend {backend.url} {state}")
+
+    async def check(self, backend, timeout):
+        try:
+            r = await backend.client.get(backend.health_url, timeout=timeout)
+            ok = r.status_code == 200
+        except Exception:
+            ok = False
+
+        if backend.healthy:
+            if ok:
+                backend.fails = 0
+            else:
+                self._fail(backend)
+        elif ok:
+            backend.oks += 1
+            if backend.oks >= self.recover_after:
+                self._set_healthy(backend, True)
+        else:
+            backend.oks = 0
+
+    async def health_loop(self, interval, timeout):
+        while True:
+            await asyncio.gather(*(self.check(b, timeout) for b in self.backends.values()))
+            await asyncio.sleep(interval)
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+
+import numpy as np
+
+
+class SampleSpool:
+    """
+    Append-only on-disk spool of ECG batches, per device, in SQLite (WAL).
+
+    Rows are kept in upload order per device by an integer `pos`: new
+    batches go to the tail, a batch that failed in flight goes back to
+    the head. Each row is one float32 batch, so replay reads whole rows
+    and deletes them only once the upstream has acked them. Total size
+    is capped at `max_samples`; past that the head of the largest
+    backlog is dropped. Rows keep the proxy's sample numbering (`seq` of
+    the first sample, `stream`), so replays after a restart are still
+    recognised upstream.
+    """
+
+    def __init__(self, path, max_samples):
+        self.path = path
+        self.max_samples = max_samples
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " device TEXT NOT NULL, pos INTEGER NOT NULL,"
+            " ts REAL, n INTEGER NOT NULL, samples BLOB NOT NULL,"
+            " PRIMARY KEY (device, pos)) WITHOUT ROWID"
+        )
+        # spools written before samples were numbered lack these
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(spool)")}
+        for column in ("seq", "stream"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE spool ADD COLUMN {column} INTEGER")
+
+        # ---- per-device bookkeeping, rebuilt from disk on restart ----
+        self.depth = {}     # device -> spooled samples
+        self._head = {}     # device -> lowest pos
+        self._tail = {}     # device -> highest pos
+        rows = self.conn.execute(
+            "SELECT device, SUM(n), MIN(pos), MAX(pos) FROM spool GROUP BY device"
+        )
+        for device, n, lo, hi in rows:
+            self.depth[device] = n
+            self._head[device] = lo
+            self._tail[device] = hi
+        self.size = sum(self.depth.values())
+
+    def append(self, device, samples, ts, seq=None, stream=None):
+        """Spool a batch after everything already spooled for `device`."""
+        pos = self._tail.get(device, -1) + 1
+        self._insert(device, pos, samples, ts, seq, stream)
+        self._tail[device] = pos
+        self._head.setdefault(device, pos)
+        return self._evict()
+
+    def prepend(self, device, samples, ts, seq=None, stream=None):
+        """Spool a batch before everything already spooled for `device`."""
+        pos = self._head.get(device, 1) - 1
+        self._insert(device, pos, samples, ts, seq, stream)
+        self._head[device] = pos
+        self._tail.setdefault(device, pos)
+        return self._evict()
+
+    def peek(self, device, max_samples):
+        """
+        Oldest rows for `device` totalling at most `max_samples` (always
+        at least one row), stopping where the numbering jumps. Returns
+        (samples, first ts, last pos, first seq, stream) or None.
+        """
+        rows = self.conn.execute(
+            "SELECT pos, ts, n, samples, seq, stream FROM spool WHERE device = ?"
+            " ORDER BY pos LIMIT 64", (device,)
+        )
+        parts, first_ts, last_pos, total = [], None, None, 0
+        first_seq = first_stream = None
+        for pos, ts, n, blob, seq, stream in rows:
+            if parts and total + n > max_samples:
+                break
+            expected = None if first_seq is None else first_seq + total
+            if parts and (stream != first_stream or seq != expected):
+                break
+            if not parts:
+                first_ts, first_seq, first_stream = ts, seq, stream
+            parts.append(np.frombuffer(blob, dtype="<f4"))
+            last_pos = pos
+            total += n
+        if not parts:
+            return None
+        samples = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return samples, first_ts, last_pos, first_seq, first_stream
+
+    def pop(self, device, upto_pos):
+        """Delete rows for `device` up to `upto_pos` once they are acked."""
+        (n,) = self.conn.execute(
+            "SELECT COALESCE(SUM(n), 0) FROM spool WHERE device = ? AND pos <= ?",
+            (device, upto_pos),
+        ).fetchone()
+        self.conn.execute(
+            "DELETE FROM spool WHERE device = ? AND pos <= ?", (device, upto_pos)
+        )
+        self._account(device, -n, upto_pos + 1)
+        return n
+
+    def disk_bytes(self):
+        total = 0
+        for suffix in ("", "-wal"):
+            try:
+                total += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return total
+
+    def close(self):
+        self.conn.close()
+
+    def _insert(self, device, pos, samples, ts, seq, stream):
+        samples = np.asarray(samples, dtype="<f4")
+        self.conn.execute(
+            "INSERT INTO spool (device, pos, ts, n, samples, seq, stream)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (device, pos, ts, samples.size, samples.tobytes(), seq, stream),
+        )
+        self.depth[device] = self.depth.get(device, 0) + samples.size
+        self.size += samples.size
+
+    def _account(self, device, delta, new_head):
+        self.size += delta
+        depth = self.depth.get(device, 0) + delta
+        if depth > 0:
+            self.depth[device] = depth
+            self._head[device] = new_head
+        else:
+            self.depth.pop(device, None)
+            self._head.pop(device, None)
+            self._tail.pop(device, None)
+
+    def _evict(self):
+        dropped = 0
+        while self.size > self.max_samples and self.depth:
+            device = max(self.depth, key=self.depth.get)
+            pos, n = self.conn.execute(
+                "SELECT pos, n FROM spool WHERE device = ? ORDER BY pos LIMIT 1",
+                (device,),
+            ).fetchone()
+            self.conn.execute(
+                "DELETE FROM spool WHERE device = ? AND pos = ?", (device, pos)
+            )
+            self._account(device, -n, pos + 1)
+            dropped += n
+        return dropped
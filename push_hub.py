@@ -0,0 +1,120 @@
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+
+class Subscriber:
+    """
+    One push client: a bounded queue of encoded events.
+
+    When the queue is full the client is behind, so it falls back to
+    latest-value delivery: a new event replaces the oldest queued event
+    with the same (device, topic); if there is none, the oldest event
+    overall is dropped. Either way `dropped` counts it.
+    """
+
+    def __init__(self, devices, topics, max_queue):
+        self.devices = devices      # set of device ids, or None for all
+        self.topics = topics        # set of topics, or None for all
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._events = deque()      # (key, encoded bytes)
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def wants(self, device, topic):
+        if self.topics is not None and topic not in self.topics:
+            return False
+        # server-wide events (device None) go to everyone on that topic
+        return device is None or self.devices is None or device in self.devices
+
+    def put(self, key, payload):
+        with self._cond:
+            if len(self._events) >= self.max_queue:
+                self.dropped += 1
+                for i, (k, _) in enumerate(self._events):
+                    if k == key:
+                        del self._events[i]
+                        break
+                else:
+                    self._events.popleft()
+            self._events.append((key, payload))
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Everything queued (oldest first); empty list on timeout or close."""
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            out = [p for _, p in self._events]
+            self._events.clear()
+            return out
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class PushHub:
+    """
+    Fan-out of live updates to server-sent-event clients.
+
+    Publishers (ingest, the analysis worker, log()) call publish(), which
+    encodes the event once and hands the same bytes to every matching
+    subscriber; it never blocks on a slow client.
+    """
+
+    def __init__(self, max_queue=64, max_subscribers=1000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._subs = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self, devices=None, topics=None):
+        """Returns a Subscriber, or None if the hub is full."""
+        sub = Subscriber(devices, topics, self.max_queue)
+        with self._lock:
+            if len(self._subs) >= self.max_subscribers:
+                return None
+            self._subs = self._subs + [sub]     # copy-on-write for publish()
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.close()
+        with self._lock:
+            self._subs = [s for s in self._subs if s is not sub]
+
+    def listening(self, topic):
+        """Cheap check so publishers can skip building payloads nobody reads."""
+        return any(s.topics is None or topic in s.topics for s in self._subs)
+
+    def publish(self, topic, data, device=None):
+        subs = self._subs
+        targets = [s for s in subs if s.wants(device, topic)]
+        self.published += 1
+        if not targets:
+            return 0
+
+        event = {"device_id": device, "t": time.time(), **data}
+        payload = (
+            f"id: {next(self._ids)}\nevent: {topic}\n"
+            f"data: {json.dumps(event, separators=(',', ':'))}\n\n"
+        ).encode()
+        key = (device, topic)
+        for s in targets:
+            s.put(key, payload)
+        return len(targets)
+
+    @property
+    def stats(self):
+        subs = self._subs
+        return {
+            "subscribers": len(subs),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subs),
+        }
@@ -0,0 +1,718 @@
+import numpy as np
+from functools import lru_cache
+
+from metrics import REGISTRY
+
+# neurokit2, pandas and scipy.signal take seconds to import, so they are
+# imported where they are first needed, not here: a web worker that never
+# analyses a window never loads them. preload() imports them up front.
+
+# per-stage analysis time, whichever engine runs it (per process: windows
+# analysed in the pool's children are timed there, not in the server)
+RESP_STAGE_SECONDS = REGISTRY.histogram(
+    "resp_stage_seconds", "Respiration analysis time per stage", ("stage",)
+)
+STAGE_ECG_RSP = RESP_STAGE_SECONDS.labels("ecg_rsp")
+STAGE_RSP_RATE = RESP_STAGE_SECONDS.labels("rsp_rate")
+STAGE_ROLLING_STD = RESP_STAGE_SECONDS.labels("rolling_std")
+STAGE_QUALITY_FAST = RESP_STAGE_SECONDS.labels("quality_fast")
+STAGE_QUALITY_NK = RESP_STAGE_SECONDS.labels("quality_nk")
+RESP_QUALITY = REGISTRY.counter(
+    "resp_quality_windows_total", "Quality gate result per window: pass or the reject reason",
+    ("result",),
+)
+
+def preload():
+    """Import the heavy analysis dependencies now (preloading master, pool workers)."""
+    import neurokit2, pandas, scipy.signal  # noqa: F401
+
+
+# ======================================================
+# ECG-DERIVED RESPIRATION (ONE WINDOW)
+# ======================================================
+# Shared by server.py, nk_worker.py and the analysis process pool, so
+# the algorithm lives in exactly one place. Everything here must stay
+# importable (and picklable) from a worker process.
+
+FLAT_STD = 1e-3
+MINUTE_RR_FLOOR = 5         # 1-min averages at or below this are reported as 0
+
+
+def minute_rr(hop_rr):
+    """
+    1-minute RR from that minute's hop values. Hops without a rate
+    (None / NaN: flat, invalid or failed windows) count as 0.
+    """
+    values = np.array([np.nan if v is None else v for v in hop_rr], dtype=float)
+    avg = float(np.mean(np.nan_to_num(values)))
+    return 0.0 if avg <= MINUTE_RR_FLOOR else avg
+
+
+def clean_segment(segment):
+    """
+    Negative samples are treated as dropouts and linearly interpolated
+    (constant before the first / after the last valid sample), i.e.
+    pd.Series(...).interpolate().bfill() without the pandas round trip.
+    """
+    segment = np.asarray(segment, dtype=float)
+    good = segment >= 0
+    if good.all() or not good.any():
+        return np.where(good, segment, np.nan)
+
+    idx = np.arange(segment.size)
+    return np.interp(idx, idx[good], segment[good])
+
+
+def window_rr(segment, fs, intensity_threshold, fallback=True):
+    """
+    Respiration rate for one ECG window.
+
+    Returns (rr_val, status) where status is one of
+    "ok", "fallback", "flat", "invalid" or "error: <message>".
+    rr_val is None unless status is "ok" or "fallback".
+    """
+    import neurokit2 as nk
+    import pandas as pd
+
+    segment = clean_segment(segment)
+
+    # ---- Flat signal guard ----
+    if np.std(segment) < FLAT_STD:
+        return None, "flat"
+
+    try:
+        # ---- ECG-derived respiration ----
+        with STAGE_ECG_RSP.time():
+            edr = nk.ecg_rsp(segment, sampling_rate=fs)
+
+        with STAGE_ROLLING_STD.time():
+            rsp_intensity = (
+                pd.Series(edr)
+                .rolling(int(3 * fs), center=True)
+                .std()
+                .fillna(0)
+            )
+
+        with STAGE_RSP_RATE.time():
+            rr = np.array(nk.rsp_rate(edr, sampling_rate=fs))
+
+        valid_rr = rr[rsp_intensity >= intensity_threshold]
+        valid_rr = valid_rr[valid_rr > 0]
+
+        if len(valid_rr) > 0:
+            return float(np.mean(valid_rr)), "ok"
+
+        if fallback and len(rr) > 0:
+            value = np.nanmean(rr)
+            if not np.isnan(value):
+                return float(value), "fallback"
+
+        return None, "invalid"
+
+    except Exception as e:
+        return None, f"error: {e}"
+
+
+# ======================================================
+# INCREMENTAL ENGINE (ONE STREAM, STATE CARRIED ACROSS HOPS)
+# ======================================================
+# nk.ecg_rsp (vangent2019) is a zero-phase order-2 Butterworth band-pass
+# (0.1-0.4 Hz) over the 30 s window; nk.rsp_rate finds breath troughs
+# (khodadad2018) and PCHIP-interpolates 60 / period. Two thirds of each
+# window were already seen on the previous hop, so the engine keeps:
+#
+#   * the cleaned window, re-cleaning only new samples plus a short
+#     revisable tail (negative runs that are still open at the end);
+#   * the causal (forward) filter state, so the forward pass only runs
+#     over new samples plus that tail.
+#
+# What is NOT carried over, on purpose:
+#
+#   * The backward pass. It depends on samples to the right, so it is
+#     re-run over the window (one sosfilt call over 1500 floats, tens of
+#     microseconds).
+#   * The window's cold start. The full-window path restarts the forward
+#     filter at the oldest sample, and at a 0.1 Hz low cut that transient
+#     is still visible 10 s in. The first `edge_sec` are re-filtered from
+#     sosfiltfilt's odd-extension state; past that the stream's forward
+#     output is used.
+#   * Troughs. khodadad's amplitude-outlier rule uses the median breath
+#     amplitude of the whole window, so reusing troughs from older hops
+#     would change results; detection is an O(n) vectorized scan anyway.
+#
+# Most of the saving comes from skipping NeuroKit's per-call wrappers
+# (signal sanitizing, DataFrame formatting in rsp_peaks) and pandas.
+# benchmarks/bench_incremental_rr.py measures roughly 3x less CPU per
+# hop than window_rr() at 50 Hz (about 2x at 500 Hz).
+#
+# Tolerance vs window_rr(): the first window is identical. Afterwards the
+# only differences are the forward transient beyond `edge_sec` and float
+# rounding. On simulated 50 Hz ECG with 8-30 breaths/min baseline
+# modulation and 1 % dropouts, with the default edge_sec=15, per-hop RR
+# agrees within 0.05 breaths/min on 99 % of hops and within 0.5
+# breaths/min on all of them. At 500 Hz the 99th percentile is ~1.3
+# breaths/min.
+
+EDR_LOWCUT = 0.1
+EDR_HIGHCUT = 0.4
+EDR_ORDER = 2
+INTENSITY_WINDOW_SEC = 3
+
+
+@lru_cache(maxsize=None)
+def edr_sos(fs):
+    """The band-pass nk.ecg_rsp(method="vangent2019") applies, as SOS."""
+    from scipy.signal import butter
+    return butter(
+        EDR_ORDER, [EDR_LOWCUT, EDR_HIGHCUT],
+        btype="bandpass", output="sos", fs=fs,
+    )
+
+
+def _sosfilt(sos, x, zi):
+    # scipy rejects empty input; an empty chunk leaves the state untouched
+    if x.size == 0:
+        return x.copy(), zi
+    from scipy.signal import sosfilt
+    return sosfilt(sos, x, zi=zi)
+
+
+def _clean_tail(segment, prev_good):
+    """clean_segment() for a chunk that continues a stream ending at `prev_good`."""
+    if np.all(segment >= 0):
+        return segment
+    if prev_good is None:
+        return clean_segment(segment)
+    return clean_segment(np.concatenate(([prev_good], segment)))[1:]
+
+
+def rolling_std_centered(x, window):
+    """
+    pandas' Series.rolling(window, center=True).std().fillna(0) over the
+    last axis, via cumulative sums (works on 1-D or 2-D input).
+    """
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    out = np.zeros_like(x)
+    if n < window:
+        return out
+
+    xc = x - x.mean(axis=-1, keepdims=True)
+    pad = [(0, 0)] * (x.ndim - 1) + [(1, 0)]
+    c1 = np.pad(np.cumsum(xc, axis=-1), pad)
+    c2 = np.pad(np.cumsum(xc * xc, axis=-1), pad)
+
+    s1 = c1[..., window:] - c1[..., :-window]
+    s2 = c2[..., window:] - c2[..., :-window]
+    var = (s2 - s1 * s1 / window) / (window - 1)
+    std = np.sqrt(np.maximum(var, 0.0))
+
+    # pandas labels a centred window by its (window // 2)-th sample
+    left = window // 2
+    out[..., left:left + std.shape[-1]] = std
+    return out
+
+
+def _pchip_edge(h0, h1, m0, m1):
+    # one-sided three-point end derivative, as scipy's PchipInterpolator
+    d = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+    if np.sign(d) != np.sign(m0):
+        return 0.0
+    if np.sign(m0) != np.sign(m1) and abs(d) > 3 * abs(m0):
+        return 3 * m0
+    return d
+
+
+def pchip(x, y, x_new):
+    """
+    scipy.interpolate.PchipInterpolator(x, y)(x_new) for x_new inside
+    [x[0], x[-1]], without the per-call object construction (which costs
+    more than the evaluation for the handful of breaths in a window).
+    """
+    h = np.diff(x).astype(float)
+    m = np.diff(y) / h
+
+    if x.size == 2:
+        d = np.array([m[0], m[0]])
+    else:
+        d = np.zeros(x.size)
+        w1 = 2 * h[1:] + h[:-1]
+        w2 = h[1:] + 2 * h[:-1]
+        flat = (np.sign(m[1:]) != np.sign(m[:-1])) | (m[1:] == 0) | (m[:-1] == 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            whmean = (w1 / m[:-1] + w2 / m[1:]) / (w1 + w2)
+        d[1:-1] = np.where(flat, 0.0, 1.0 / whmean)
+        d[0] = _pchip_edge(h[0], h[1], m[0], m[1])
+        d[-1] = _pchip_edge(h[-1], h[-2], m[-1], m[-2])
+
+    k = np.clip(np.searchsorted(x, x_new, side="right") - 1, 0, x.size - 2)
+    hk = h[k]
+    t = (x_new - x[k]) / hk
+    t2 = t * t
+    t3 = t2 * t
+    return (
+        (2 * t3 - 3 * t2 + 1) * y[k]
+        + (t3 - 2 * t2 + t) * hk * d[k]
+        + (-2 * t3 + 3 * t2) * y[k + 1]
+        + (t3 - t2) * hk * d[k + 1]
+    )
+
+
+def trough_rate(troughs, fs, n):
+    """nk.signal_rate(troughs, fs, desired_length=n) with monotone cubic interpolation."""
+    if troughs.size <= 3:
+        return np.full(n, np.nan)
+
+    period = np.ediff1d(troughs, to_begin=0) / fs
+    period[0] = np.mean(period[1:])
+
+    # PCHIP inside the trough span, constant outside (as NeuroKit does)
+    x = np.clip(np.arange(n), troughs[0], troughs[-1])
+    return 60 / pchip(troughs, period, x)
+
+
+def masked_rr(rr, intensity, intensity_threshold, fallback=True):
+    """The mask / mean / fallback tail of window_rr() on precomputed arrays."""
+    valid_rr = rr[intensity >= intensity_threshold]
+    valid_rr = valid_rr[valid_rr > 0]
+
+    if len(valid_rr) > 0:
+        return float(np.mean(valid_rr)), "ok"
+
+    if fallback and len(rr) > 0 and not np.all(np.isnan(rr)):
+        return float(np.nanmean(rr)), "fallback"
+
+    return None, "invalid"
+
+
+def edr_rr(edr, fs, intensity_threshold, fallback=True):
+    """window_rr() from an already-computed EDR, without the NeuroKit wrappers."""
+    import neurokit2 as nk
+    with STAGE_ROLLING_STD.time():
+        intensity = rolling_std_centered(edr, int(INTENSITY_WINDOW_SEC * fs))
+    with STAGE_RSP_RATE.time():
+        troughs = np.asarray(nk.rsp_findpeaks(edr, sampling_rate=fs)["RSP_Troughs"])
+        rr = trough_rate(troughs, fs, edr.size)
+    return masked_rr(rr, intensity, intensity_threshold, fallback)
+
+
+class IncrementalRespiration:
+    """
+    Streaming equivalent of calling window_rr() on the newest
+    `window_samples` of an ECG stream every hop.
+
+    Feed samples with update() (or consume() straight from an
+    EcgRingBuffer) and read the current window's value with rr().
+    """
+
+    def __init__(self, fs, window_samples, intensity_threshold,
+                 fallback=True, tail_sec=2, edge_sec=15):
+        self.fs = fs
+        self.window_samples = window_samples
+        self.intensity_threshold = intensity_threshold
+        self.fallback = fallback
+        self.tail = int(tail_sec * fs)
+        self.edge = min(int(edge_sec * fs), window_samples)
+
+        from scipy.signal import sosfilt_zi
+        self._sos = edr_sos(fs)
+        self._zi0 = sosfilt_zi(self._sos)
+        # same odd-extension length scipy.signal.sosfiltfilt uses
+        n_sections = self._sos.shape[0]
+        self._padlen = 3 * (2 * n_sections + 1 - min(
+            (self._sos[:, 2] == 0).sum(), (self._sos[:, 5] == 0).sum()
+        ))
+
+        self.reset()
+
+    def reset(self):
+        self._pending = []          # raw chunks until the first full window
+        self._pending_n = 0
+        self._raw_tail = None       # newest raw samples, still revisable
+        self._prev_good = None      # last valid sample before _raw_tail
+        self._zi = None             # forward state at the start of _raw_tail
+        self._zf = None             # forward state after the newest sample
+        self._clean = None          # cleaned ECG of the window
+        self._fwd = None            # stream forward-filter output for the window
+        self._seen = None           # ring.total already consumed
+
+    @property
+    def ready(self):
+        return self._clean is not None
+
+    @property
+    def cleaned(self):
+        """Cleaned ECG of the current window (read-only view)."""
+        view = self._clean.view()
+        view.flags.writeable = False
+        return view
+
+    # ---------- input ----------
+    def consume(self, ring, upto=None):
+        """
+        Pull whatever `ring` (EcgRingBuffer) received since the last call,
+        up to (not including) sequence number `upto` if given.
+        """
+        end = ring.total if upto is None else upto
+        if self._seen is None or self._seen < ring.first_seq:
+            # first call, or samples were overwritten before we saw them
+            self.reset()
+            start = ring.first_seq
+        else:
+            start = self._seen
+        if end > start:
+            self._seen = end
+            self.update(ring.window(end, end - start, dtype=float))
+
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=float)
+        if samples.size == 0:
+            return
+
+        if self._clean is None:
+            self._pending.append(samples)
+            self._pending_n += samples.size
+            if self._pending_n < self.window_samples:
+                return
+            samples = np.concatenate(self._pending)[-self.window_samples:]
+            self._pending = []
+            self._pending_n = 0
+            self._clean = np.zeros(self.window_samples)
+            self._fwd = np.zeros(self.window_samples)
+            self._raw_tail = samples[:0]
+            self._zi = self._head_state(clean_segment(samples))
+
+        raw = np.concatenate((self._raw_tail, samples))
+        seg = _clean_tail(raw, self._prev_good)
+
+        # samples leaving the revisable tail get their final forward pass
+        k = max(raw.size - self.tail, 0)
+        fwd_a, zi_next = _sosfilt(self._sos, seg[:k], self._zi)
+        fwd_b, self._zf = _sosfilt(self._sos, seg[k:], zi_next)
+
+        n_new = samples.size
+        self._clean = self._shift(self._clean, seg, n_new)
+        self._fwd = self._shift(self._fwd, np.concatenate((fwd_a, fwd_b)), n_new)
+
+        good = raw[:k][raw[:k] >= 0]
+        if good.size:
+            self._prev_good = float(good[-1])
+        self._zi = zi_next
+        self._raw_tail = raw[k:]
+
+    def _shift(self, window, revised, n_new):
+        n = self.window_samples
+        if revised.size >= n:
+            return revised[-n:].copy()
+        if n_new < n:
+            window[:n - n_new] = window[n_new:]
+        window[-revised.size:] = revised
+        return window
+
+    # ---------- filtering ----------
+    def _head_state(self, seg):
+        """Forward state after sosfiltfilt's left odd extension of `seg`."""
+        p = min(self._padlen, seg.size - 1)
+        head = 2 * seg[0] - seg[p:0:-1]
+        return _sosfilt(self._sos, head, self._zi0 * head[0])[1]
+
+    def edr(self):
+        """EDR of the current window, as nk.ecg_rsp() would return it."""
+        seg = self._clean
+
+        # cold start at the oldest sample, like a full-window filtfilt
+        fwd_left, zf = _sosfilt(self._sos, seg[:self.edge], self._head_state(seg))
+        if self.edge < seg.size:
+            fwd = np.concatenate((fwd_left, self._fwd[self.edge:]))
+            zf = self._zf
+        else:
+            fwd = fwd_left
+
+        # right odd extension, then the backward pass over the window
+        p = min(self._padlen, seg.size - 1)
+        if p > 0:
+            ext = 2 * seg[-1] - seg[-2:-p - 2:-1]
+            fwd = np.concatenate((fwd, _sosfilt(self._sos, ext, zf)[0]))
+        back = _sosfilt(self._sos, fwd[::-1], self._zi0 * fwd[-1])[0][::-1]
+        return back[:seg.size]
+
+    # ---------- output ----------
+    def rr(self):
+        """(rr_val, status) for the current window, as window_rr() returns."""
+        if self._clean is None:
+            return None, "invalid"
+
+        if np.std(self._clean) < FLAT_STD:
+            return None, "flat"
+
+        try:
+            with STAGE_ECG_RSP.time():
+                edr = self.edr()
+            return edr_rr(edr, self.fs, self.intensity_threshold, self.fallback)
+        except Exception as e:
+            return None, f"error: {e}"
+
+
+# ======================================================
+# BATCH MODE (MANY WINDOWS AT ONCE)
+# ======================================================
+# Same result as calling window_rr() on every row, but the cleaning,
+# flat guard, band-pass, intensity mask and averaging run as 2-D NumPy
+# operations across all rows. Only trough detection (NeuroKit) and the
+# per-row rate curve loop in Python.
+
+def clean_segments(windows):
+    """clean_segment() applied to every row of a 2-D array, vectorized."""
+    x = np.asarray(windows, dtype=float)
+    good = x >= 0
+    if good.all():
+        return x.copy()
+
+    m, n = x.shape
+    idx = np.arange(n)
+
+    # index of the previous / next valid sample for every position
+    prev = np.maximum.accumulate(np.where(good, idx, -1), axis=1)
+    nxt = np.minimum.accumulate(np.where(good, idx, n)[:, ::-1], axis=1)[:, ::-1]
+
+    # leading gaps take the next value (bfill), trailing gaps the previous
+    lo = np.where(prev >= 0, prev, nxt)
+    hi = np.where(nxt < n, nxt, prev)
+    empty = ~good.any(axis=1)
+    lo[empty] = 0
+    hi[empty] = 0
+
+    rows = np.arange(m)[:, None]
+    v_lo = x[rows, lo]
+    v_hi = x[rows, hi]
+    span = hi - lo
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.where(span > 0, (idx - lo) / span, 0.0)
+
+    out = v_lo + (v_hi - v_lo) * w
+    out[empty] = np.nan
+    return out
+
+
+def batch_rr(windows, fs, intensity_threshold, fallback=True):
+    """
+    Respiration rate for every row of `windows` (streams x samples).
+
+    Returns (rr, statuses): rr is a float array with NaN where window_rr()
+    would return None, statuses the matching list of status strings.
+    """
+    import neurokit2 as nk
+    from scipy.signal import sosfiltfilt
+
+    x = clean_segments(np.atleast_2d(windows))
+    m, n = x.shape
+
+    rr_out = np.full(m, np.nan)
+    statuses = ["invalid"] * m
+
+    # ---- Flat signal guard (all-dropout rows have NaN std, not flat) ----
+    flat = np.std(x, axis=1) < FLAT_STD
+    for i in np.flatnonzero(flat):
+        statuses[i] = "flat"
+    todo = np.flatnonzero(~flat)
+    if todo.size == 0:
+        return rr_out, statuses
+
+    # ---- ECG-derived respiration + intensity, all rows at once ----
+    try:
+        with STAGE_ECG_RSP.time():
+            edr = sosfiltfilt(edr_sos(fs), x[todo], axis=1)
+    except Exception as e:
+        for i in todo:
+            statuses[i] = f"error: {e}"
+        return rr_out, statuses
+
+    with STAGE_ROLLING_STD.time():
+        intensity = rolling_std_centered(edr, int(INTENSITY_WINDOW_SEC * fs))
+
+    # ---- troughs + rate curve: the only per-row NeuroKit work ----
+    rr = np.full(edr.shape, np.nan)
+    failed = np.zeros(todo.size, dtype=bool)
+    for j, i in enumerate(todo):
+        try:
+            if not np.isfinite(edr[j]).all():
+                raise ValueError("NaN in ECG window")
+            with STAGE_RSP_RATE.time():
+                troughs = np.asarray(
+                    nk.rsp_findpeaks(edr[j], sampling_rate=fs)["RSP_Troughs"]
+                )
+                rr[j] = trough_rate(troughs, fs, n)
+        except Exception as e:
+            statuses[i] = f"error: {e}"
+            failed[j] = True
+
+    # ---- masked mean / fallback, vectorized ----
+    mask = (intensity >= intensity_threshold) & (rr > 0)
+    count = mask.sum(axis=1)
+    total = np.where(mask, rr, 0.0).sum(axis=1)
+
+    with np.errstate(invalid="ignore"):
+        masked_mean = total / count
+    has_any = ~np.isnan(rr).all(axis=1)
+    fallback_mean = np.full(todo.size, np.nan)
+    if fallback and has_any.any():
+        fallback_mean[has_any] = np.nanmean(rr[has_any], axis=1)
+
+    for j, i in enumerate(todo):
+        if failed[j]:
+            continue
+        if count[j] > 0:
+            rr_out[i] = masked_mean[j]
+            statuses[i] = "ok"
+        elif fallback and has_any[j]:
+            rr_out[i] = fallback_mean[j]
+            statuses[i] = "fallback"
+
+    return rr_out, statuses
+
+
+# ======================================================
+# SIGNAL-QUALITY GATE (CHEAPEST CHECKS FIRST)
+# ======================================================
+# Windows that cannot give a rate (leads off, ADC railing, long dropouts,
+# motion) are rejected before the respiration engine runs:
+#
+#   1. flat, dropout fraction (samples clean_segment interpolates),
+#      clipping (samples on the window's min / max rail)
+#   2. rough R-peak rate, envelope peakiness and beat regularity from a
+#      QRS band-pass + threshold
+#   3. nk.ecg_quality (zhao2018, fuzzy), only for rows that stage 1 or 2
+#      left ambiguous
+#
+# Stages 1 and 2 are O(n) NumPy / sosfilt over all rows at once. At 50 Hz
+# NeuroKit's grade is coarse (white noise can pass as "Excellent"), so it
+# is the tie-breaker, not the first line.
+
+MAX_DROPOUT = 0.3           # dropout fraction above this -> "dropout"
+MAX_CLIPPED = 0.1           # fraction on the min / max rail above this -> "clipped"
+AMBIGUOUS = 0.5             # from this fraction of either limit on, ask NeuroKit
+BEAT_RATE = (30, 220)       # plausible R-peaks per minute, else "beat_rate"
+QRS_BAND = (5, 15)          # Hz
+MIN_PEAKINESS = 4           # QRS envelope 98th percentile / median; below: ambiguous
+MAX_BEAT_CV = 0.25          # beat interval variation; above: ambiguous
+NK_QUALITY_OK = ("Excellent",)
+QUALITY_REJECTS = ("flat", "dropout", "clipped", "beat_rate", "low_quality")
+
+
+@lru_cache(maxsize=None)
+def qrs_sos(fs):
+    from scipy.signal import butter
+    high = min(QRS_BAND[1], 0.45 * fs)
+    return butter(2, [QRS_BAND[0], high], btype="bandpass", output="sos", fs=fs)
+
+
+def _beats(env, threshold, refractory):
+    """Rising threshold crossings of one envelope, `refractory` samples apart."""
+    above = env > threshold
+    edges = np.flatnonzero(above[1:] & ~above[:-1])
+    if edges.size > 1:
+        edges = edges[np.r_[True, np.diff(edges) > refractory]]
+    return edges
+
+
+def quality_gate(windows, fs):
+    """
+    Staged quality check of raw ECG windows (rows, as the ring holds them).
+
+    Returns (reasons, info): reasons[i] is None for a usable window, else
+    one of QUALITY_REJECTS. info maps "dropout", "clipped", "beat_rate",
+    "peakiness", "beat_cv" (float arrays, NaN where not measured), "nk"
+    (NeuroKit grade or None) and "stage" (last stage run) to per-row values.
+    """
+    x = np.atleast_2d(np.asarray(windows, dtype=float))
+    m, n = x.shape
+    reasons = [None] * m
+    info = {
+        "dropout": np.zeros(m), "clipped": np.zeros(m),
+        "beat_rate": np.full(m, np.nan), "peakiness": np.full(m, np.nan),
+        "beat_cv": np.full(m, np.nan), "nk": [None] * m, "stage": np.ones(m, dtype=int),
+    }
+
+    with STAGE_QUALITY_FAST.time():
+        # ---- stage 1: flat / dropout / clipping ----
+        good = x >= 0
+        n_good = good.sum(axis=1)
+        info["dropout"] = dropout = 1 - n_good / n
+        hi = np.where(good, x, -np.inf).max(axis=1, keepdims=True)
+        lo = np.where(good, x, np.inf).min(axis=1, keepdims=True)
+        rails = good & ((x == hi) | (x == lo))
+        info["clipped"] = clipped = rails.sum(axis=1) / np.maximum(n_good, 1)
+
+        clean = clean_segments(x)
+        with np.errstate(invalid="ignore"):
+            flat = np.std(clean, axis=1) < FLAT_STD
+        for i in range(m):
+            if dropout[i] > MAX_DROPOUT:
+                reasons[i] = "dropout"
+            elif flat[i]:
+                reasons[i] = "flat"
+            elif clipped[i] > MAX_CLIPPED:
+                reasons[i] = "clipped"
+        ambiguous = ((dropout > AMBIGUOUS * MAX_DROPOUT)
+                     | (clipped > AMBIGUOUS * MAX_CLIPPED))
+
+        # ---- stage 2: rough R-peak rate from a QRS band-pass envelope ----
+        todo = np.array([i for i in range(m) if reasons[i] is None], dtype=int)
+        if todo.size:
+            from scipy.signal import sosfilt
+            rows = clean[todo]
+            band = np.abs(sosfilt(qrs_sos(fs), rows - rows.mean(axis=1, keepdims=True), axis=1))
+            k = max(1, int(0.1 * fs))
+            c = np.cumsum(band, axis=1)
+            env = (c[:, k:] - c[:, :-k]) / k
+            top = np.percentile(env, 98, axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                peakiness = top / np.median(env, axis=1)
+
+            refractory = int(0.25 * fs)
+            for j, i in enumerate(todo):
+                beats = _beats(env[j], 0.4 * top[j], refractory)
+                rate = beats.size * 60 * fs / n
+                intervals = np.diff(beats)
+                info["beat_rate"][i] = rate
+                info["peakiness"][i] = peakiness[j]
+                if intervals.size > 1:
+                    info["beat_cv"][i] = intervals.std() / intervals.mean()
+                info["stage"][i] = 2
+                if not BEAT_RATE[0] <= rate <= BEAT_RATE[1]:
+                    reasons[i] = "beat_rate"
+                elif not (peakiness[j] >= MIN_PEAKINESS and info["beat_cv"][i] <= MAX_BEAT_CV):
+                    ambiguous[i] = True
+
+    # ---- stage 3: NeuroKit's quality grade for the ambiguous rest ----
+    for i in range(m):
+        if reasons[i] is not None or not ambiguous[i]:
+            continue
+        import neurokit2 as nk
+        info["stage"][i] = 3
+        try:
+            with STAGE_QUALITY_NK.time():
+                grade = nk.ecg_quality(clean[i], sampling_rate=fs,
+                                       method="zhao2018", approach="fuzzy")
+        except Exception:
+            continue    # no grade: let the engine decide
+        info["nk"][i] = grade
+        if grade not in NK_QUALITY_OK:
+            reasons[i] = "low_quality"
+
+    for reason in reasons:
+        RESP_QUALITY.labels(reason or "pass").inc()
+    return reasons, info
+
+
+def quality_row(info, i):
+    """Row `i` of quality_gate()'s info as a JSON-friendly dict."""
+    out = {}
+    for key, values in info.items():
+        v = values[i]
+        if isinstance(v, (float, np.floating)):
+            v = None if np.isnan(v) else round(float(v), 4)
+        elif isinstance(v, np.integer):
+            v = int(v)
+        out[key] = v
+    return out
@@ -0,0 +1,147 @@
+import numpy as np
+
+
+class EcgRingBuffer:
+    """
+    Fixed-capacity ring buffer for one ECG stream.
+
+    Storage is a single preallocated float32 array, so memory per device
+    is constant no matter how long the stream runs. Writes are one
+    vectorized copy per batch and reads hand back views into the ring
+    (at most two slices when the window wraps) instead of boxed floats.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(self.capacity, dtype=self.dtype)
+        self._head = 0          # next write index
+        self._size = 0
+        self.total = 0          # samples ever written (monotonic, survives clear)
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        self.extend((value,))
+
+    def extend(self, values, dtype=None):
+        """
+        Append a batch of samples.
+
+        `values` may be a list, an ndarray or any object exposing the
+        buffer protocol (bytes, bytearray, memoryview). Raw buffers are
+        read with np.frombuffer as `dtype` (default: the ring dtype).
+        """
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            arr = np.frombuffer(values, dtype=dtype or self.dtype)
+        else:
+            arr = np.asarray(values, dtype=dtype or self.dtype).ravel()
+
+        n = arr.size
+        if n == 0:
+            return
+        self.total += n
+
+        # ---- batch larger than the ring: keep only the tail ----
+        if n >= self.capacity:
+            self._data[:] = arr[-self.capacity:]
+            self._head = 0
+            self._size = self.capacity
+            return
+
+        end = self._head + n
+        if end <= self.capacity:
+            self._data[self._head:end] = arr
+        else:
+            first = self.capacity - self._head
+            self._data[self._head:] = arr[:first]
+            self._data[:n - first] = arr[first:]
+
+        self._head = end % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def latest_slices(self, n=None):
+        """
+        Return the newest `n` samples (all if None) as a tuple of one or
+        two read-only views into the ring, oldest first. No data is copied.
+        """
+        if n is None or n > self._size:
+            n = self._size
+        if n <= 0:
+            return (self._data[:0],)
+
+        start = (self._head - n) % self.capacity
+        if start < self._head:
+            parts = (self._data[start:self._head],)
+        else:
+            parts = (self._data[start:], self._data[:self._head])
+
+        for p in parts:
+            p.flags.writeable = False
+        return parts
+
+    def latest_view(self, n=None):
+        """Newest `n` samples as a single view, or None if they wrap around."""
+        parts = self.latest_slices(n)
+        return parts[0] if len(parts) == 1 else None
+
+    def latest(self, n=None, dtype=None, out=None):
+        """
+        Return the newest `n` samples as one contiguous array, oldest first.
+
+        The slices are written straight into `out` (or a fresh array of
+        `dtype`), so the copy and any float32 -> float64 widening happen
+        in a single vectorized pass.
+        """
+        parts = self.latest_slices(n)
+        total = sum(p.size for p in parts)
+        if out is None:
+            out = np.empty(total, dtype=dtype or self.dtype)
+
+        pos = 0
+        for p in parts:
+            out[pos:pos + p.size] = p
+            pos += p.size
+        return out[:total]
+
+    @property
+    def first_seq(self):
+        """
+        Sequence number of the oldest retained sample. Sample k of the
+        stream (0-based, counted across clears) has sequence number k, so
+        the newest is `total - 1` and `total` is the next one to arrive.
+        """
+        return self.total - self._size
+
+    def since(self, seq, dtype=None):
+        """
+        Copy of the retained samples with sequence number >= `seq`.
+        Returns (first_seq, samples); first_seq > seq means the samples
+        in between have already been overwritten.
+        """
+        first = max(seq, self.first_seq)
+        n = max(self.total - first, 0)
+        return first, self.latest(n, dtype=dtype) if n else np.empty(0, dtype or self.dtype)
+
+    def window(self, end, n, dtype=None, out=None):
+        """
+        Samples with sequence numbers end - n ... end - 1 as one contiguous
+        array. They must still be retained (end - n >= first_seq).
+        """
+        start = end - n
+        if start < self.first_seq or end > self.total:
+            raise IndexError(f"samples {start}..{end} not in ring "
+                             f"({self.first_seq}..{self.total})")
+        if out is None:
+            out = np.empty(n, dtype=dtype or self.dtype)
+
+        i = (self._head - (self.total - start)) % self.capacity
+        first = min(n, self.capacity - i)
+        out[:first] = self._data[i:i + first]
+        out[first:n] = self._data[:n - first]
+        return out[:n]
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
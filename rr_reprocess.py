@@ -0,0 +1,330 @@
+"""
+Offline respiration-rate reprocessing of recorded ECG.
+
+Re-scores recordings with the live worker's logic: 30 s windows ending
+on 10 s hop boundaries of the sample count (HopClock), batch_rr() per
+window with the same intensity mask and fallback, failed hops counted
+as 0 and 1-minute averages from minute_rr(). Windows pass the same
+quality_gate() first; rejected ones are stored with their reason. Files
+are streamed chunk by chunk and never loaded whole; inputs (and segments
+of large binary files) are spread over a process pool.
+
+Inputs, by extension:
+    .jsonl            captures: {"device_id", "ecg": [...]} per line
+                      (benchmarks/bench_pipeline.py --record writes these)
+    .csv              an "ecg" column, optionally "device_id"
+    .f32 .f64 .i16    raw little-endian samples of one device
+
+Output is one pair of ColumnStores per device (sample_store.py format):
+    <out>/<input stem>/<device>/hops      seq, t, rr, status
+    <out>/<input stem>/<device>/minutes   seq, t, rr, hops
+`seq` is the sample that ends the window / minute, `t` the same in
+seconds from the start of the recording, `rr` is NaN for hops without
+a rate and `status` indexes STATUSES.
+
+    python rr_reprocess.py capture.jsonl night.f32 --out data/rr
+    python rr_reprocess.py session.csv --threshold 0.05 --no_fallback
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from hop_clock import HopClock
+from respiration import batch_rr, minute_rr, quality_gate
+from sample_store import ColumnStore
+
+# new statuses go at the end: stored files keep their meaning
+STATUSES = ["ok", "fallback", "flat", "invalid", "error",
+            "dropout", "clipped", "beat_rate", "low_quality"]
+RAW_DTYPES = {".f32": "<f4", ".f64": "<f8", ".i16": "<i2"}
+DEFAULT_DEVICE = "default"
+
+HOP_COLUMNS = ["seq", "t", "rr", "status"]
+MINUTE_COLUMNS = ["seq", "t", "rr", "hops"]
+
+
+@dataclass
+class RrConfig:
+    fs: int = 50
+    window_sec: int = 30
+    hop_sec: int = 10
+    intensity_threshold: float = 0.01
+    fallback: bool = True
+    quality_gate: bool = True
+
+    @property
+    def window_samples(self):
+        return self.fs * self.window_sec
+
+    @property
+    def hop_samples(self):
+        return self.fs * self.hop_sec
+
+
+# ======================================================
+# READERS: yield (device_id, samples) chunks in file order
+# ======================================================
+def read_jsonl(path, chunk_lines=1000):
+    # batch consecutive lines of one device into a single chunk
+    with open(path) as f:
+        device, parts, lines = None, [], 0
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if "ecg" not in rec:
+                continue
+            dev = str(rec.get("device_id") or DEFAULT_DEVICE)
+            if parts and (dev != device or lines >= chunk_lines):
+                yield device, np.concatenate(parts)
+                parts, lines = [], 0
+            device = dev
+            parts.append(np.asarray(rec["ecg"], dtype=float).ravel())
+            lines += 1
+        if parts:
+            yield device, np.concatenate(parts)
+
+
+def read_csv(path, chunksize=500_000):
+    import pandas as pd
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        if "ecg" not in chunk.columns:
+            raise ValueError(f"{path}: no 'ecg' column")
+        ecg = pd.to_numeric(chunk["ecg"], errors="coerce").to_numpy(float)
+        if "device_id" not in chunk.columns:
+            yield DEFAULT_DEVICE, ecg
+            continue
+        devices = chunk["device_id"].astype(str).to_numpy()
+        # runs of the same device, in order
+        cuts = np.flatnonzero(devices[1:] != devices[:-1]) + 1
+        for lo, hi in zip(np.r_[0, cuts], np.r_[cuts, devices.size]):
+            yield devices[lo], ecg[lo:hi]
+
+
+def read_raw(path, start=0, stop=None, chunk=1 << 20):
+    dtype = np.dtype(RAW_DTYPES[os.path.splitext(path)[1]])
+    n = os.path.getsize(path) // dtype.itemsize
+    stop = n if stop is None else min(stop, n)
+    if stop <= start:
+        return
+    data = np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+    for lo in range(start, stop, chunk):
+        yield DEFAULT_DEVICE, np.asarray(data[lo:min(lo + chunk, stop)], dtype=float)
+
+
+def raw_length(path):
+    return os.path.getsize(path) // np.dtype(RAW_DTYPES[os.path.splitext(path)[1]]).itemsize
+
+
+def read_chunks(path):
+    ext = os.path.splitext(path)[1]
+    if ext == ".jsonl":
+        return read_jsonl(path)
+    if ext == ".csv":
+        return read_csv(path)
+    if ext in RAW_DTYPES:
+        return read_raw(path)
+    raise ValueError(f"Unsupported input: {path}")
+
+
+# ======================================================
+# ONE STREAM
+# ======================================================
+class StreamRR:
+    """
+    Hop results for one device's sample stream, fed in chunks of any
+    size. Keeps only the last window of samples between chunks; due
+    windows are analysed `batch` at a time through batch_rr().
+    """
+
+    def __init__(self, config, first_seq=0, batch=256):
+        self.config = config
+        self.batch = batch
+        self.clock = HopClock(first_seq, config.window_samples, config.hop_samples,
+                              max_catchup=1 << 62)
+        self._buf = np.empty(0)
+        self._buf_seq = first_seq       # sequence number of _buf[0]
+        self.ends, self.rr, self.status = [], [], []
+
+    def feed(self, samples):
+        w = self.config.window_samples
+        buf = np.concatenate((self._buf, np.asarray(samples, dtype=float)))
+        total = self._buf_seq + buf.size
+        ends, _ = self.clock.due(total, self._buf_seq)
+
+        for i in range(0, len(ends), self.batch):
+            part = np.array(ends[i:i + self.batch]) - self._buf_seq
+            windows = buf[part[:, None] - w + np.arange(w)]
+            rr, statuses = self._analyse(windows)
+            self.rr.extend(rr)
+            self.status.extend(STATUSES.index(s.split(":")[0]) for s in statuses)
+        self.ends.extend(ends)
+
+        keep = min(buf.size, w)
+        self._buf = buf[buf.size - keep:].copy()
+        self._buf_seq = total - keep
+
+    def _analyse(self, windows):
+        c = self.config
+        if not c.quality_gate:
+            return batch_rr(windows, c.fs, c.intensity_threshold, c.fallback)
+
+        reasons, _ = quality_gate(windows, c.fs)
+        rr = np.full(len(reasons), np.nan)
+        statuses = list(reasons)
+        todo = [i for i, r in enumerate(reasons) if r is None]
+        if todo:
+            rr[todo], passed = batch_rr(windows[todo], c.fs, c.intensity_threshold, c.fallback)
+            for i, status in zip(todo, passed):
+                statuses[i] = status
+        return rr, statuses
+
+    def hops(self):
+        return {
+            "seq": np.asarray(self.ends, dtype=np.int64),
+            "rr": np.asarray(self.rr, dtype=float),
+            "status": np.asarray(self.status, dtype=float),
+        }
+
+
+def minutes(hops, config):
+    """Group hops by data minute of their window end, as the live worker does."""
+    seq = hops["seq"]
+    minute_samples = config.fs * 60
+    if seq.size == 0:
+        return {"seq": seq, "rr": np.empty(0), "hops": np.empty(0)}
+
+    minute = (seq - 1) // minute_samples
+    cuts = np.flatnonzero(np.diff(minute)) + 1
+    groups = np.split(hops["rr"], cuts)
+    starts = np.r_[0, cuts]
+    return {
+        "seq": (minute[starts] + 1) * minute_samples,
+        "rr": np.array([minute_rr(g) for g in groups]),
+        "hops": np.array([g.size for g in groups], dtype=float),
+    }
+
+
+# ======================================================
+# FILES
+# ======================================================
+def _run_stream(path, config):
+    """Every device in a JSONL / CSV file: {device: hops}."""
+    streams = {}
+    for device, samples in read_chunks(path):
+        stream = streams.get(device)
+        if stream is None:
+            stream = streams[device] = StreamRR(config)
+        stream.feed(samples)
+    return {device: s.hops() for device, s in streams.items()}
+
+
+def _run_segment(path, config, start, stop):
+    """
+    Window ends in (start, stop] of a raw file. Reads from one window
+    before `start`, so segments cut on hop boundaries add up to exactly
+    the serial result.
+    """
+    first = max(0, start + config.hop_samples - config.window_samples)
+    stream = StreamRR(config, first_seq=first)
+    for _, samples in read_raw(path, first, stop):
+        stream.feed(samples)
+    return stream.hops()
+
+
+def _concat(parts):
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def write_device(out_dir, hops, config):
+    mins = minutes(hops, config)
+    for name, columns, data in (("hops", HOP_COLUMNS, hops),
+                                ("minutes", MINUTE_COLUMNS, mins)):
+        path = os.path.join(out_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        store = ColumnStore(path, columns=columns)
+        store.extend({**data, "t": data["seq"] / config.fs})
+        store.close()
+    return len(hops["seq"]), len(mins["seq"])
+
+
+def reprocess(paths, out, config=None, workers=None, segment_sec=3600):
+    """
+    Reprocess every file in `paths` into `out`. Raw binary files are
+    split into `segment_sec` pieces so one long recording also uses
+    every worker. Returns a summary dict per input.
+    """
+    config = config or RrConfig()
+    seg = max(1, segment_sec // config.hop_sec) * config.hop_samples
+    summary = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {}
+        for path in paths:
+            t0 = time.perf_counter()
+            if os.path.splitext(path)[1] in RAW_DTYPES:
+                n = raw_length(path)
+                futures = [pool.submit(_run_segment, path, config, lo, min(lo + seg, n))
+                           for lo in range(0, max(n, 1), seg)]
+            else:
+                futures = [pool.submit(_run_stream, path, config)]
+            jobs[path] = (t0, futures)
+
+        for path, (t0, futures) in jobs.items():
+            results = [f.result() for f in futures]
+            if os.path.splitext(path)[1] in RAW_DTYPES:
+                per_device = {DEFAULT_DEVICE: _concat(results)}
+            else:
+                per_device = results[0]
+
+            stem = os.path.splitext(os.path.basename(path))[0]
+            info = {}
+            for device, hops in per_device.items():
+                n_hops, n_min = write_device(os.path.join(out, stem, device), hops, config)
+                info[device] = {"hops": n_hops, "minutes": n_min}
+            summary[path] = {"devices": info, "seconds": time.perf_counter() - t0}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RR reprocessing of recorded ECG")
+    parser.add_argument("inputs", nargs="+", help=".jsonl, .csv, .f32, .f64 or .i16 recordings")
+    parser.add_argument("--out", default="data/rr", help="output directory (default data/rr)")
+    parser.add_argument("--fs", type=int, default=50)
+    parser.add_argument("--window_sec", type=int, default=30)
+    parser.add_argument("--hop_sec", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.01,
+                        help="intensity threshold (server.py 0.01, nk_worker.py 0.05)")
+    parser.add_argument("--no_fallback", action="store_true",
+                        help="no unmasked fallback rate, as nk_worker.py")
+    parser.add_argument("--no_quality_gate", action="store_true",
+                        help="analyse every window, as before the quality gate")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--segment_sec", type=int, default=3600,
+                        help="raw files are split into segments of this length")
+    args = parser.parse_args()
+
+    config = RrConfig(
+        fs=args.fs, window_sec=args.window_sec, hop_sec=args.hop_sec,
+        intensity_threshold=args.threshold, fallback=not args.no_fallback,
+        quality_gate=not args.no_quality_gate,
+    )
+    summary = reprocess(args.inputs, args.out, config, args.workers, args.segment_sec)
+
+    for path, info in summary.items():
+        hops = sum(d["hops"] for d in info["devices"].values())
+        recorded = hops * config.hop_sec
+        speed = recorded / info["seconds"] if info["seconds"] else float("inf")
+        print(f"{path}: {len(info['devices'])} device(s), {hops} hops, "
+              f"{info['seconds']:.1f} s ({speed:.0f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Append-only columnar store of float64 samples.
+
+One raw little-endian float64 file per column in a directory, plus a
+small schema file. Appends write each column's slice in one call; reads
+memory-map the files, so loading N rows costs little more than paging
+in N * 8 bytes per column. A reader only trusts the shortest column,
+so a torn append (crash mid-batch) is never visible and is trimmed the
+next time the store is opened for writing.
+
+    python sample_store.py import data/training.csv data/samples
+    python sample_store.py export data/samples training.csv
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+SAMPLE_COLUMNS = ["ratio", "ac", "dc", "PI_feature", "slope", "glucose"]
+
+DTYPE = np.dtype("<f8")
+SCHEMA_FILE = "schema.json"
+
+
+class ColumnStore:
+    def __init__(self, path, columns=SAMPLE_COLUMNS, batch_rows=1):
+        """
+        `batch_rows` > 1 buffers appended rows in memory and writes them
+        out once that many are pending (or on flush / close).
+        """
+        self.path = path
+        self.columns = list(columns)
+        self.batch_rows = batch_rows
+        self._pending = []
+        self._files = None
+        os.makedirs(path, exist_ok=True)
+
+        schema_path = os.path.join(path, SCHEMA_FILE)
+        if os.path.isfile(schema_path):
+            with open(schema_path) as f:
+                schema = json.load(f)
+            if schema["columns"] != self.columns or schema["dtype"] != DTYPE.str:
+                raise ValueError(f"{path}: schema {schema} does not match {self.columns}")
+        else:
+            with open(schema_path, "w") as f:
+                json.dump({"columns": self.columns, "dtype": DTYPE.str}, f)
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".f64")
+
+    def __len__(self):
+        return self._stored_rows() + len(self._pending)
+
+    def _stored_rows(self):
+        sizes = []
+        for name in self.columns:
+            try:
+                sizes.append(os.path.getsize(self._column_path(name)))
+            except OSError:
+                sizes.append(0)
+        return min(sizes) // DTYPE.itemsize
+
+    # ---------------- writing ----------------
+
+    def _open_for_append(self):
+        # drop the tail of a torn append so every column has the same length
+        n = self._stored_rows()
+        self._files = []
+        for name in self.columns:
+            f = open(self._column_path(name), "ab")
+            if f.tell() != n * DTYPE.itemsize:
+                f.truncate(n * DTYPE.itemsize)
+                f.seek(0, os.SEEK_END)
+            self._files.append(f)
+
+    def append(self, row):
+        """Append one row: a mapping with the column names as keys (missing -> NaN)."""
+        self._pending.append([_to_float(row.get(name)) for name in self.columns])
+        if len(self._pending) >= self.batch_rows:
+            self.flush()
+
+    def extend(self, columns):
+        """Append a batch given as {column: array-like}, all of one length."""
+        self.flush()
+        arrays = [np.asarray(columns[name], dtype=DTYPE) for name in self.columns]
+        self._write(arrays)
+
+    def flush(self):
+        if not self._pending:
+            return
+        block = np.array(self._pending, dtype=DTYPE)
+        self._pending.clear()
+        self._write(list(block.T))
+
+    def _write(self, arrays):
+        if self._files is None:
+            self._open_for_append()
+        for f, arr in zip(self._files, arrays):
+            f.write(np.ascontiguousarray(arr, dtype=DTYPE).tobytes())
+        for f in self._files:
+            f.flush()
+
+    def close(self):
+        self.flush()
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+
+    # ---------------- reading ----------------
+
+    def read(self):
+        """{column: read-only float64 array} memory-mapped over the stored rows."""
+        self.flush()
+        n = self._stored_rows()
+        if n == 0:
+            return {name: np.empty(0, dtype=DTYPE) for name in self.columns}
+        return {
+            name: np.memmap(self._column_path(name), dtype=DTYPE, mode="r", shape=(n,))
+            for name in self.columns
+        }
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.read(), columns=self.columns)
+
+    # ---------------- CSV ----------------
+
+    def import_csv(self, csv_path, chunksize=100_000):
+        """Append every row of a CSV (columns by name, extras ignored)."""
+        import pandas as pd
+        n = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            missing = set(self.columns) - set(chunk.columns)
+            if missing:
+                raise ValueError(f"Missing columns in {csv_path}: {missing}")
+            self.extend({
+                name: pd.to_numeric(chunk[name], errors="coerce").to_numpy(DTYPE)
+                for name in self.columns
+            })
+            n += len(chunk)
+        return n
+
+    def export_csv(self, csv_path, chunksize=100_000):
+        import pandas as pd
+        data = self.read()
+        n = len(data[self.columns[0]])
+        for start in range(0, max(n, 1), chunksize):
+            chunk = pd.DataFrame(
+                {name: data[name][start:start + chunksize] for name in self.columns}
+            )
+            chunk.to_csv(csv_path, mode="w" if start == 0 else "a",
+                         header=start == 0, index=False)
+        return n
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar sample store import / export")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = ColumnStore(args.dst)
+        n = store.import_csv(args.src)
+        store.close()
+        print(f"Imported {n} rows into {args.dst} ({len(store)} total)")
+    else:
+        n = ColumnStore(args.src).export_csv(args.dst)
+        print(f"Exported {n} rows to {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
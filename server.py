@@ -1,11 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import atexit
+import os
 import threading
 import time
 import numpy as np
-import pandas as pd
-import neurokit2 as nk
 from collections import deque
 
+import ecg_wire
+from ecg_plot import EcgPlotRenderer, minmax_decimate
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, Throttle
+from push_hub import PushHub
+from analysis_pool import RespirationScheduler
+from hop_clock import HopClock
+from respiration import (
+    MINUTE_RR_FLOOR, IncrementalRespiration, batch_rr, minute_rr, preload,
+    QUALITY_REJECTS, quality_gate, quality_row,
+)
+from sessions import SessionRegistry
+from shm_ring import AnalysisOwner, SharedRings
+from timeseries import load_snapshot, save_snapshot
+
 app = Flask(__name__)
 
 # ======================================================
@@ -14,11 +28,31 @@ app = Flask(__name__)
 LOG_BUFFER_SIZE = 500
 server_logs = deque(maxlen=LOG_BUFFER_SIZE)
 
+# per-sample lines (every ECG batch, every glucose reading) are logged at
+# most once per LOG_THROTTLE_SEC per device; the rest are only counted
+LOG_THROTTLE_SEC = float(os.environ.get("LOG_THROTTLE_SEC", "10"))
+log_throttle = Throttle(LOG_THROTTLE_SEC)
+
+# live updates for /events (server-sent events); see the PUSH section
+hub = PushHub(max_queue=64, max_subscribers=1000)
+
+LOG_LINES = REGISTRY.counter("log_lines_total", "Lines written by log()")
+LOG_SUPPRESSED = REGISTRY.counter("log_lines_suppressed_total", "Per-sample lines skipped by the log throttle")
+
 def log(msg):
     ts = time.strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {msg}"
     print(line, flush=True)
     server_logs.append(line)
+    LOG_LINES.inc()
+    hub.publish("log", {"line": line})
+
+def log_sampled(key, msg):
+    skipped = log_throttle.allow(key)
+    if skipped is None:
+        LOG_SUPPRESSED.inc()
+        return
+    log(f"{msg} (+{skipped} similar)" if skipped else msg)
 
 # ======================================================
 # PARAMETERS
@@ -29,187 +63,834 @@ MAX_ECG_BUFFER = 4000
 WINDOW_SEC = 30
 WINDOW_SAMPLES = FS * WINDOW_SEC
 HOP_SEC = 10
+HOP_SAMPLES = FS * HOP_SEC
+MINUTE_SAMPLES = FS * 60
+MAX_CATCHUP = 3             # missed hops replayed after a stall; older ones coalesce
+MAX_GAP_FILL = WINDOW_SAMPLES   # dropout markers written for a sequence gap, at most
+# "local": buffers live in this process (run a single gunicorn worker)
+# "shm":   ECG rings in shared memory (shm_ring.py): any number of workers
+#          ingest, one elected worker analyses and the others serve its
+#          results. /events only carries the owner's rr / glucose events.
+ECG_BACKEND = os.environ.get("ECG_BACKEND", "local")
+SHM_NAME = os.environ.get("SHM_NAME", "ecg_rings")
+OWNER_POLL_SEC = 2          # shm: owner election retry / history follow interval
+# worker wake-up fallback; hops are triggered by data (other workers'
+# data is only seen by polling)
+HOP_TICK_SEC = 0.25 if ECG_BACKEND == "shm" else 1.0
 INTENSITY_THRESHOLD = 0.01
 
+DEFAULT_DEVICE = "default"
+MAX_DEVICES = 256           # LRU-evict the quietest device beyond this
+HISTORY_SIZE = 1440         # raw history points per device and series;
+                            # older data is kept as minute / hour buckets
+HISTORY_SNAPSHOT = os.environ.get("HISTORY_SNAPSHOT", "data/history_snapshot.npz")
+SNAPSHOT_SEC = 10 if ECG_BACKEND == "shm" else 300    # shm: how stale followers may be
+ECG_TIMEOUT_SEC = 300
+# "incremental": per-device IncrementalRespiration on the worker thread
+# "batch":       one batch_rr() call per hop over every device's window
+# "pool":        full 30 s windows through the NeuroKit process pool
+RESP_ENGINE = os.environ.get("RESP_ENGINE", "incremental")
+NK_WORKERS = int(os.environ.get("NK_WORKERS", "2"))    # pool only; 0 = in-thread
+# staged signal-quality check (respiration.quality_gate) before any engine;
+# rejected windows count as 0 without running NeuroKit
+QUALITY_GATE = os.environ.get("RESP_QUALITY_GATE", "1") != "0"
+PLOT_SAMPLES = FS * 10      # /ecg_plot strip length (last 10 s)
+
 # ======================================================
-# GLOBAL STATE (SINGLE PROCESS)
+# PER-DEVICE STATE
 # ======================================================
-ecg_buffer = deque(maxlen=MAX_ECG_BUFFER)
-latest_ecg_numbers = deque(maxlen=MAX_ECG_BUFFER)
+def _on_evict(session):
+    plot_renderer.forget(session.device_id)
+    log(f"[REGISTRY] Device evicted (LRU): {session.device_id}")
+
+# drawn only when /ecg_plot is requested, cached per device until new data
+plot_renderer = EcgPlotRenderer()
+
+rings = owner = None
+if ECG_BACKEND == "shm":
+    rings = SharedRings(SHM_NAME, MAX_DEVICES, MAX_ECG_BUFFER)
+    owner = AnalysisOwner(SHM_NAME)
 
-latest_rr_1min = None
-resp_rate_history = []
-latest_glucose = None
-glucose_history = []
+registry = SessionRegistry(
+    max_devices=MAX_DEVICES,
+    ecg_capacity=MAX_ECG_BUFFER,
+    history_size=HISTORY_SIZE,
+    on_evict=_on_evict,
+    ring_factory=rings.ring if rings is not None else None,
+    seq_factory=rings.stream_seq if rings is not None else None,
+)
 
-last_ecg_time = time.time()
+# set by ingestion when a device's next window end has arrived
+hop_wakeup = threading.Event()
+
+def find_session(device):
+    """
+    Session for a read endpoint. With shared rings this includes devices
+    that only ever posted to another worker.
+    """
+    session = registry.get(device)
+    if rings is None:
+        return session
+    if session is None and rings.find(device) is not None:
+        session = registry.get_or_create(device)
+    if session is not None:
+        session.last_ecg_time = session.ecg.last_write
+    return session
+
+
+def request_device_id():
+    return request.args.get("device_id") or DEFAULT_DEVICE
+
+# ======================================================
+# METRICS
+# ======================================================
+DATA_REQUESTS = REGISTRY.counter("data_requests_total", "POST /data requests", ("format",))
+DATA_PARSE_SECONDS = REGISTRY.histogram("data_parse_seconds", "POST /data body parse time", ("format",))
+DATA_APPEND_SECONDS = REGISTRY.histogram("data_append_seconds", "ECG ring append time, lock included")
+ECG_SAMPLES = REGISTRY.counter("ecg_samples_total", "ECG samples ingested")
+HOP_SECONDS = REGISTRY.histogram("resp_hop_seconds", "Worker time per hop, all devices")
+HOP_OVERRUNS = REGISTRY.counter("resp_hop_overruns_total", "Hops whose work took longer than HOP_SEC")
+WINDOWS = REGISTRY.counter(
+    "resp_windows_total", "Scheduled windows: analysed on_time or caught_up (replayed after "
+    "a stall), skipped (coalesced), rejected (quality gate) or dropped (pool busy)",
+    ("outcome",),
+)
+WINDOW_LAG_SECONDS = REGISTRY.histogram(
+    "resp_window_lag_seconds", "Window end sample arrival to worker pickup"
+)
+
+REGISTRY.gauge("devices", "Devices with a session", fn=lambda: len(registry))
+REGISTRY.gauge(
+    "ecg_buffer_fill_ratio", "ECG ring fill (0-1) per device", ("device_id",),
+    fn=lambda: {s.device_id: len(s.ecg) / MAX_ECG_BUFFER for s in registry.sessions()},
+)
+REGISTRY.counter(
+    "resp_pool_windows_total", "Analysis pool windows by outcome", ("outcome",),
+    fn=lambda: dict(scheduler.stats),
+)
+for _field in ("duplicate_samples", "late_samples", "gaps", "gap_samples"):
+    REGISTRY.counter(
+        f"ingest_{_field}_total", f"Sequenced ingest: {_field.replace('_', ' ')} per device",
+        ("device_id",),
+        fn=lambda f=_field: {s.device_id: s.stream_seq.stats()[f] for s in registry.sessions()},
+    )
+REGISTRY.gauge("push_subscribers", "Connected /events clients", fn=lambda: hub.stats["subscribers"])
+REGISTRY.counter("push_published_total", "Events published to the push hub", fn=lambda: hub.published)
 
 # ======================================================
 # NEUROKIT BACKGROUND WORKER
 # ======================================================
-def neurokit_worker():
-    global latest_rr_1min
+def record_rr(session, rr_val, status, end):
+    """
+    Publish the RR of the window ending at sample `end` (worker thread
+    or pool callback). Hops are grouped into minutes by sample count, so
+    a minute closes when the first hop of the next data minute arrives.
+    """
+    dev = session.device_id
+    minute = (end - 1) // MINUTE_SAMPLES
 
-    rr_window = []          # holds 10-sec RR values (or 0)
-    minute_start = time.time()
+    # ---- IMPORTANT CHANGE ----
+    # every hop counts: flat / invalid / failed windows count as 0
+    with session.lock:
+        closed = None
+        if session.rr_minute is not None and minute != session.rr_minute:
+            closed = (list(session.rr_window), (session.rr_minute + 1) * MINUTE_SAMPLES)
+            session.rr_window.clear()
+        session.rr_minute = minute
+        session.rr_window.append(rr_val if rr_val is not None else 0.0)
+    hub.publish("rr_hop", {"rr": rr_val, "status": status, "seq": end}, dev)
 
-    log("[NK] Background worker started")
+    if rr_val is not None:
+        log(f"[NK][{dev}] RR (10 s hop): {rr_val:.2f}")
+    elif status == "flat":
+        log(f"[NK][{dev}] ECG too flat → RR counted as 0")
+    elif status == "invalid":
+        log(f"[NK][{dev}] RR invalid → counted as 0")
+    elif status in QUALITY_REJECTS:
+        log(f"[NK][{dev}] Rejected by quality gate ({status}) → RR counted as 0")
+    else:
+        log(f"[NK][{dev}] Error → RR counted as 0 | {status}")
 
-    while True:
-        time.sleep(HOP_SEC)
+    if closed is not None:
+        aggregate_minute(session, *closed)
 
-        buf_len = len(ecg_buffer)
-        log(f"[NK] ECG buffer size: {buf_len}")
 
-        if buf_len < WINDOW_SAMPLES:
-            continue
+scheduler = RespirationScheduler(
+    window_samples=WINDOW_SAMPLES,
+    fs=FS,
+    intensity_threshold=INTENSITY_THRESHOLD,
+    on_result=record_rr,
+    workers=NK_WORKERS,
+    log=log,
+)
 
-        # ---- 30-second ECG window ----
-        segment = np.array(list(ecg_buffer)[-WINDOW_SAMPLES:], dtype=float)
-        segment = np.where(segment >= 0, segment, np.nan)
-        segment = pd.Series(segment).interpolate().bfill().to_numpy()
 
-        # ---- Flat signal guard ----
-        if np.std(segment) < 1e-3:
-            rr_window.append(0.0)
-            log("[NK] ECG too flat → RR counted as 0")
-            continue
+def aggregate_minute(session, rr_window, end):
+    """Average one data minute of hops; `end` is the sample that closes it."""
+    dev = session.device_id
+    avg_rr = minute_rr(rr_window)
 
-        try:
-            # ---- ECG-derived respiration ----
-            edr = nk.ecg_rsp(segment, sampling_rate=FS)
-
-            rsp_intensity = (
-                pd.Series(edr)
-                .rolling(int(3 * FS), center=True)
-                .std()
-                .fillna(0)
+    # ---- CLAMP LOW RR (minute_rr) ----
+    if avg_rr == 0.0:
+        log(f"[NK][{dev}] 1-min RR ≤ {MINUTE_RR_FLOOR} → set to 0")
+
+    # stamp the minute with the wall time its last sample arrived
+    with session.lock:
+        ts = session.last_ecg_time - (session.ecg.total - end) / FS
+
+    session.latest_rr_1min = avg_rr
+    session.resp_rate_history.append(ts, avg_rr)
+    if rings is not None:
+        rings.set_rr_1min(dev, avg_rr)
+    hub.publish("resp_rate", {"resp_rate": avg_rr, "hops": len(rr_window)}, dev)
+    log(f"[NK][{dev}] 1-min RR: {avg_rr:.2f} ({len(rr_window)} hops)")
+
+
+def window_due(session):
+    """
+    After an append (session.lock held): wake the worker once the ring
+    has received the sample that ends the session's next window.
+    """
+    clock = session.hop_clock
+    if clock is None:
+        if len(session.ecg) < WINDOW_SAMPLES:
+            return
+        clock = session.hop_clock = HopClock(
+            session.ecg.first_seq, WINDOW_SAMPLES, HOP_SAMPLES, MAX_CATCHUP
+        )
+    if clock.pending(session.ecg.total):
+        if session.due_since is None:
+            session.due_since = time.monotonic()
+        hop_wakeup.set()
+
+
+def incremental_rr(session, end):
+    """Feed the samples up to `end` into the session's engine, return its RR."""
+    with session.lock:
+        engine = session.resp_engine
+        if engine is None:
+            engine = session.resp_engine = IncrementalRespiration(
+                FS, WINDOW_SAMPLES, INTENSITY_THRESHOLD
             )
+        engine.consume(session.ecg, upto=end)
+    return engine.rr()
 
-            rr = np.array(nk.rsp_rate(edr, sampling_rate=FS))
 
-            valid_rr = rr[rsp_intensity >= INTENSITY_THRESHOLD]
-            valid_rr = valid_rr[valid_rr > 0]
+def batch_hop(jobs, rejected=None):
+    """
+    All due (session, end) windows through one batch_rr() call, except
+    those the quality gate `rejected`; every window is recorded in order.
+    Returns the (session, end) windows that were analysed.
+    """
+    rejected = rejected or {}
+    windows = np.empty((len(jobs), WINDOW_SAMPLES))
+    filled = {}
+    for session, end in jobs:
+        if (session, end) in rejected:
+            continue
+        with session.lock:
+            # a /clear_all may have landed since the window became due
+            if end - WINDOW_SAMPLES >= session.ecg.first_seq:
+                session.ecg.window(end, WINDOW_SAMPLES, out=windows[len(filled)])
+                filled[(session, end)] = len(filled)
 
-            rr_val = None
+    rr, statuses = batch_rr(windows[:len(filled)], FS, INTENSITY_THRESHOLD)
+    for session, end in jobs:
+        reason = rejected.get((session, end))
+        if reason is not None:
+            record_rr(session, None, reason, end)
+        elif (session, end) in filled:
+            i = filled[(session, end)]
+            record_rr(session, None if np.isnan(rr[i]) else float(rr[i]), statuses[i], end)
+    return filled
 
-            if len(valid_rr) > 0:
-                rr_val = float(np.mean(valid_rr))
-            elif len(rr) > 0:
-                fallback = np.nanmean(rr)
-                if not np.isnan(fallback):
-                    rr_val = float(fallback)
 
-            # ---- IMPORTANT CHANGE ----
-            if rr_val is not None:
-                rr_window.append(rr_val)
-                log(f"[NK] RR (10 s hop): {rr_val:.2f}")
-            else:
-                rr_window.append(0.0)
-                log("[NK] RR invalid → counted as 0")
+def gate_windows(jobs):
+    """
+    Quality gate over every due window, in one quality_gate() call.
+    Returns {(session, end): reason} for the rejected windows; the caller
+    records them together with the analysed ones, in window order, since
+    record_rr() closes a minute on the first hop of the next one. (The
+    incremental engine catches up on the samples of rejected windows at
+    its next consume().)
+    """
+    flat_jobs = [(session, end) for session, ends in jobs for end in ends]
+    windows = np.empty((len(flat_jobs), WINDOW_SAMPLES))
+    filled = []
+    for session, end in flat_jobs:
+        with session.lock:
+            if end - WINDOW_SAMPLES >= session.ecg.first_seq:
+                session.ecg.window(end, WINDOW_SAMPLES, out=windows[len(filled)])
+                filled.append((session, end))
 
-        except Exception as e:
-            rr_window.append(0.0)
-            log(f"[NK] Error → RR counted as 0 | {e}")
-
-        # ---- 1-MINUTE AVERAGE ----
-        if time.time() - minute_start >= 60:
-            if len(rr_window) > 0:
-                avg_rr = float(np.mean(rr_window))
-
-                # ---- CLAMP LOW RR ----
-                if avg_rr <= 5:
-                    avg_rr = 0.0
-                    log("[NK] 1-min RR ≤ 5 → set to 0")
-
-                latest_rr_1min = avg_rr
-                resp_rate_history.append(avg_rr)
-                log(f"[NK] 1-min RR: {avg_rr:.2f}")
+    reasons, info = quality_gate(windows[:len(filled)], FS)
+    rejected = {}
+    for i, ((session, end), reason) in enumerate(zip(filled, reasons)):
+        with session.lock:
+            session.quality.append({"seq": end, "result": reason or "pass", **quality_row(info, i)})
+        if reason is not None:
+            rejected[(session, end)] = reason
+    return rejected
+
+
+def due_windows():
+    """(session, [window ends]) for every session with work, oldest end first."""
+    now = time.monotonic()
+    jobs = []
+    for session in registry.sessions():
+        with session.lock:
+            if session.hop_clock is None:
+                # shm: the ring may have filled through another worker
+                window_due(session)
+            clock = session.hop_clock
+            if clock is None:
+                continue
+            ends, skipped = clock.due(session.ecg.total, session.ecg.first_seq)
+            due_since, session.due_since = session.due_since, None
+        if skipped:
+            WINDOWS.labels("skipped").inc(skipped)
+            log_sampled((session.device_id, "skipped"),
+                        f"[NK][{session.device_id}] Worker behind → {skipped} hop(s) coalesced")
+        if ends:
+            if due_since is not None:
+                WINDOW_LAG_SECONDS.observe(now - due_since)
+            jobs.append((session, ends))
+    return jobs
+
+
+shared_seen = {}    # device -> (clears, glucose_n) already applied
+
+
+def sync_shared():
+    """
+    Analysis owner: adopt devices, glucose readings and /clear_all
+    requests that reached other workers through the shared rings.
+    """
+    for device in rings.devices():
+        session = registry.get_or_create(device)
+        ring = session.ecg
+        session.last_ecg_time = ring.last_write
+
+        clears, glucose_seen = shared_seen.get(device, (ring.clears, 0))
+        if ring.clears != clears:
+            clears = ring.clears
+            with session.lock:
+                session.latest_rr_1min = None
+                session.rr_window.clear()
+                session.rr_minute = None
+                session.resp_rate_history.clear()
+            rings.set_rr_1min(device, None)
+
+        glucose = rings.glucose_of(device)
+        if glucose is not None and glucose[0] != glucose_seen:
+            glucose_seen, value, t, ts = glucose
+            session.latest_glucose = {"glucose": value, "timestamp": ts}
+            session.glucose_history.append(t, value)
+            hub.publish("glucose", {"glucose": value, "timestamp": ts}, device)
+        shared_seen[device] = (clears, glucose_seen)
+
+
+def run_hop(jobs):
+    """
+    Gate and analyse the due windows of one hop. Each device's windows
+    reach record_rr() in `ends` order, rejected or not.
+    """
+    rejected = gate_windows(jobs) if QUALITY_GATE else {}
+
+    def analysed(ends, end):
+        WINDOWS.labels("on_time" if end == ends[-1] else "caught_up").inc()
+
+    if RESP_ENGINE == "batch":
+        done = batch_hop([(session, end) for session, ends in jobs for end in ends], rejected)
+        for session, ends in jobs:
+            for end in ends:
+                if (session, end) in rejected:
+                    WINDOWS.labels("rejected").inc()
+                elif (session, end) in done:
+                    analysed(ends, end)
+    elif RESP_ENGINE == "pool":
+        for session, ends in jobs:
+            reason = rejected.get((session, ends[-1]))
+            if reason is None:
+                submitted = scheduler.submit(session, ends[-1])
+            elif scheduler.busy(session.device_id):
+                # its previous window is still in the pool: recording this
+                # one now would overtake it
+                submitted = False
             else:
-                log("[NK] No RR samples this minute")
+                WINDOWS.labels("rejected").inc()
+                record_rr(session, None, reason, ends[-1])
+                continue
+            if submitted:
+                analysed(ends, ends[-1])
+            else:
+                WINDOWS.labels("dropped").inc()
+                log_sampled((session.device_id, "pool"),
+                            f"[NK][{session.device_id}] Pool busy → window dropped")
+    else:
+        for session, ends in jobs:
+            for end in ends:
+                reason = rejected.get((session, end))
+                if reason is None:
+                    rr_val, status = incremental_rr(session, end)
+                    analysed(ends, end)
+                else:
+                    WINDOWS.labels("rejected").inc()
+                    rr_val, status = None, reason
+                record_rr(session, rr_val, status, end)
+
+
+def neurokit_worker():
+    """
+    Runs a hop whenever a device's ring crosses its next window end (see
+    HopClock), so hop timing follows the data instead of drifting with
+    the work. HOP_TICK_SEC is only a safety net for missed wake-ups.
+    """
+    log(f"[NK] Background worker started (engine={RESP_ENGINE})")
+    preload()   # heavy analysis imports, off the request path
+    if RESP_ENGINE == "pool":
+        scheduler.start()
+        atexit.register(scheduler.shutdown)
+
+    while True:
+        hop_wakeup.wait(HOP_TICK_SEC)
+        hop_wakeup.clear()
+        if rings is not None:
+            sync_shared()
+
+        hop_start = time.perf_counter()
+        jobs = due_windows()
+        if not jobs:
+            continue
+
+        if RESP_ENGINE == "pool":
+            # one window per device in flight: only the newest is worth sending
+            for session, ends in jobs:
+                WINDOWS.labels("skipped").inc(len(ends) - 1)
+                del ends[:-1]
+        run_hop(jobs)
 
-            rr_window.clear()
-            minute_start = time.time()
+        elapsed = time.perf_counter() - hop_start
+        HOP_SECONDS.observe(elapsed)
+        if elapsed > HOP_SEC:
+            HOP_OVERRUNS.inc()
 
 # ======================================================
 # AUTO-CLEAR IF ESP STOPS
 # ======================================================
 def ecg_auto_clear_loop():
-    global latest_rr_1min
     while True:
         time.sleep(30)
-        if time.time() - last_ecg_time > 300:
-            ecg_buffer.clear()
-            latest_ecg_numbers.clear()
-            latest_rr_1min = None
-            log("[AUTO CLEAR] ECG buffers cleared (timeout)")
+        now = time.time()
+        for session in registry.sessions():
+            if len(session.ecg) and now - session.last_ecg_time > ECG_TIMEOUT_SEC:
+                session.clear_ecg()
+                log(f"[AUTO CLEAR][{session.device_id}] ECG buffers cleared (timeout)")
+
+# ======================================================
+# HISTORY SNAPSHOT
+# ======================================================
+def snapshot_history():
+    series = {}
+    for session in registry.sessions():
+        series[(session.device_id, "resp_rate")] = session.resp_rate_history
+        series[(session.device_id, "glucose")] = session.glucose_history
+    os.makedirs(os.path.dirname(HISTORY_SNAPSHOT) or ".", exist_ok=True)
+    save_snapshot(HISTORY_SNAPSHOT, series)
+
+def restore_history(announce=True):
+    try:
+        state = load_snapshot(HISTORY_SNAPSHOT)
+    except Exception as e:
+        log(f"[HISTORY] Could not read {HISTORY_SNAPSHOT}: {e}")
+        return
+    for (device, name), tiers in state.items():
+        session = registry.get_or_create(device)
+        if name == "resp_rate":
+            session.resp_rate_history.load_state(tiers)
+        else:
+            session.glucose_history.load_state(tiers)
+    if state and announce:
+        log(f"[HISTORY] Restored {len(state)} series from {HISTORY_SNAPSHOT}")
+
+def history_snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_SEC)
+        try:
+            snapshot_history()
+        except Exception as e:
+            log(f"[HISTORY] Snapshot failed: {e}")
 
 # ======================================================
 # DATA INGESTION
 # ======================================================
+def ingest_samples(values):
+    """
+    ECG payload as a flat float32 array. Non-finite samples (JSON null,
+    NaN / Inf in a frame) become dropout markers (-1), so they are
+    interpolated like ESP dropouts and never reach /ecgnumbers as NaN.
+    """
+    samples = np.asarray(values, dtype=np.float32).ravel()
+    bad = ~np.isfinite(samples)
+    if bad.any():
+        samples = samples.copy()
+        samples[bad] = -1.0
+    return samples
+
+
+def sequenced_extend(session, samples, stream, seq):
+    """
+    Append a batch the proxy numbered (session.lock held). Samples
+    already received are dropped; a gap before the batch is filled with
+    dropout markers (-1, interpolated like ESP dropouts) so windows keep
+    their timing. A gap longer than MAX_GAP_FILL only needs that many:
+    every window inside it is all dropouts either way.
+    Returns (appended samples, skipped, gap, next expected seq).
+    """
+    samples = np.asarray(samples, dtype=np.float32).ravel()
+    with session.stream_seq.locked() as index:
+        skip, gap = index.admit(stream, seq, samples.size)
+        if gap:
+            session.ecg.extend(np.full(min(gap, MAX_GAP_FILL), -1.0, dtype=np.float32))
+        fresh = samples[skip:]
+        session.ecg.extend(fresh)
+        next_seq = index.next_seq
+
+    device = session.device_id
+    if gap:
+        log_sampled((device, "gap"), f"[{device}] Ingest gap: {gap} samples lost before seq {seq}")
+    if skip:
+        log_sampled((device, "dup"), f"[{device}] Re-sent samples dropped: {skip} (seq {seq})")
+    return fresh, skip, gap, next_seq
+
+
+def receive_frame():
+    """Binary ECG frame (see ecg_wire.py): samples go straight into the ring."""
+    DATA_REQUESTS.labels("binary").inc()
+    try:
+        with DATA_PARSE_SECONDS.labels("binary").time():
+            frame = ecg_wire.decode_frame(request.get_data(cache=False))
+    except ecg_wire.FrameError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    device = frame["device_id"] or DEFAULT_DEVICE
+    samples = ingest_samples(frame["samples"])
+    if frame["sample_rate"] != FS:
+        log_sampled((device, "fs"), f"[{device}] Frame sample rate {frame['sample_rate']} Hz != {FS} Hz")
+
+    session = registry.get_or_create(device)
+    reply = {"status": "ok", "seq": frame["seq"]}
+    with DATA_APPEND_SECONDS.time():
+        with session.lock:
+            if frame["stream"] is None:
+                session.ecg.extend(samples)
+            else:
+                samples, skip, gap, reply["next_seq"] = sequenced_extend(
+                    session, samples, frame["stream"], frame["seq"]
+                )
+                reply.update(skipped=skip, gap=gap)
+            buf_len = len(session.ecg)
+            next_seq = session.ecg.total
+            window_due(session)
+    ECG_SAMPLES.inc(samples.size)
+    session.last_ecg_time = time.time()
+    if samples.size:
+        publish_ecg(device, samples, next_seq)
+
+    log_sampled((device, "ecg"),
+                f"[{device}] ECG frame received: {samples.size} | seq={frame['seq']} | buffer={buf_len}")
+    return jsonify(reply)
+
+
+def publish_ecg(device, samples, next_seq):
+    if not hub.listening("ecg"):
+        return
+    numbers = np.asarray(samples, dtype=float).ravel().tolist()
+    hub.publish("ecg", {
+        "first_seq": next_seq - len(numbers),
+        "next_seq": next_seq,
+        "numbers": numbers,
+    }, device)
+
+
 @app.route("/data", methods=["POST"])
 def receive_data():
-    global last_ecg_time, latest_glucose
+    if request.mimetype == ecg_wire.CONTENT_TYPE:
+        return receive_frame()
 
-    data = request.get_json(silent=True)
-    if not data:
+    DATA_REQUESTS.labels("json").inc()
+    with DATA_PARSE_SECONDS.labels("json").time():
+        data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
         return jsonify({"status": "error"}), 400
 
-    # ---------- ECG ----------
+    device = str(data.get("device_id") or DEFAULT_DEVICE)
+
+    # ---------- validate before touching the session ----------
+    # (a malformed request must not create one: it could evict a live device)
+    samples = glucose = None
     if "ecg" in data:
         ecg = data["ecg"]
+        try:
+            samples = ingest_samples(ecg)
+            stream = data.get("stream")
+            if stream is not None:
+                stream, seq = int(stream), int(data["seq"])
+        except (TypeError, ValueError, KeyError):
+            return jsonify({"status": "error", "error": "bad ecg data"}), 400
+    if "glucose" in data:
+        try:
+            glucose = float(data["glucose"])
+        except (TypeError, ValueError) as e:
+            log(f"[{device}] Bad glucose data: {e}")
+        if glucose is not None and not 40 <= glucose <= 400:
+            glucose = None
+
+    reply = {"status": "ok"}
+    if samples is None and glucose is None:
+        return jsonify(reply)
+    session = registry.get_or_create(device)
+
+    # ---------- ECG ----------
+    # "seq" / "stream" (set by the proxy) number the samples: re-sent
+    # ones are dropped and lost ones counted (see stream_seq.py)
+    if samples is not None:
+        with DATA_APPEND_SECONDS.time():
+            with session.lock:
+                n_before = session.ecg.total
+                fresh = None
+                if stream is None:
+                    session.ecg.extend(samples)
+                else:
+                    fresh, skip, gap, reply["next_seq"] = sequenced_extend(
+                        session, samples, stream, seq
+                    )
+                    reply.update(skipped=skip, gap=gap)
+                buf_len = len(session.ecg)
+                next_seq = session.ecg.total
+                window_due(session)
+        n_new = next_seq - n_before if fresh is None else fresh.size
+        if n_new:
+            ECG_SAMPLES.inc(n_new)
+            publish_ecg(device, samples if fresh is None else fresh, next_seq)
 
         if isinstance(ecg, list):
-            for v in ecg:
-                ecg_buffer.append(v)
-                latest_ecg_numbers.append(v)
-            log(f"ECG batch received: {len(ecg)} | buffer={len(ecg_buffer)}")
-        else:
-            ecg_buffer.append(ecg)
-            latest_ecg_numbers.append(ecg)
+            log_sampled((device, "ecg"), f"[{device}] ECG batch received: {len(ecg)} | buffer={buf_len}")
 
-        last_ecg_time = time.time()
+        session.last_ecg_time = time.time()
 
     # ---------- GLUCOSE ----------
-    if "glucose" in data:
+    if glucose is not None:
       try:
-          glucose = float(data["glucose"])
           ts = data.get("timestamp")
 
-          if 40 <= glucose <= 400:
-              latest_glucose = {
+          if rings is not None:
+              # history and push are the analysis owner's (sync_shared)
+              rings.set_glucose(device, glucose, ts)
+          else:
+              session.latest_glucose = {
                   "glucose": glucose,
                   "timestamp": ts
               }
-              glucose_history.append(glucose)
-              log(f"Glucose received: {glucose:.1f}")
+              session.glucose_history.append(time.time(), glucose)
+              hub.publish("glucose", {"glucose": glucose, "timestamp": ts}, device)
+          log_sampled((device, "glucose"), f"[{device}] Glucose received: {glucose:.1f}")
       except Exception as e:
-          log(f"Bad glucose data: {e}")
+          log(f"[{device}] Bad glucose data: {e}")
 
-    return jsonify({"status": "ok"})
+    return jsonify(reply)
 
 # ======================================================
 # API ENDPOINTS
 # ======================================================
+# All read endpoints take ?device_id=<id> (defaults to "default").
+
+@app.route("/devices")
+def get_devices():
+    if rings is not None:
+        return jsonify({"devices": rings.devices()})
+    return jsonify({"devices": registry.device_ids()})
+
 @app.route("/resp_rate")
 def get_resp_rate():
-    return jsonify({"resp_rate": latest_rr_1min})
+    device = request_device_id()
+    if rings is not None:
+        return jsonify({"resp_rate": rings.rr_1min_of(device)})
+    session = registry.get(device)
+    return jsonify({"resp_rate": session.latest_rr_1min if session else None})
+
+def history_response(series, key):
+    """
+    ?start=&end= (epoch s) or ?last=<seconds> select a range;
+    ?resolution=raw|minute|hour|auto (default auto: the finest tier that
+    still covers the range). `key` holds the values (bucket means for
+    minute / hour), next to "t" and, for buckets, min / max / count.
+    """
+    args = request.args
+    start = args.get("start", type=float)
+    end = args.get("end", type=float)
+    last = args.get("last", type=float)
+    if last is not None:
+        start = time.time() - last
+    resolution = args.get("resolution", "auto")
+    # no parameters: the raw points, as before (now with timestamps)
+    if start is None and end is None and "resolution" not in args:
+        resolution = "raw"
+
+    if series is None:
+        return jsonify({key: [], "t": [], "resolution": resolution})
+    try:
+        result = series.query(start, end, resolution)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    result[key] = result.pop("value") if "value" in result else result["mean"]
+    return jsonify(result)
 
 @app.route("/resp_history")
 def get_resp_history():
-    return jsonify({"resp_history": resp_rate_history})
+    session = find_session(request_device_id())
+    return history_response(session.resp_rate_history if session else None, "resp_history")
     
 @app.route("/glucose")
 def get_glucose():
-    return jsonify(latest_glucose)
+    device = request_device_id()
+    if rings is not None:
+        glucose = rings.glucose_of(device)
+        return jsonify(glucose and {"glucose": glucose[1], "timestamp": glucose[3]})
+    session = registry.get(device)
+    return jsonify(session.latest_glucose if session else None)
 
 @app.route("/glucose_history")
 def get_glucose_history():
-    return jsonify({"glucose_history": glucose_history})
+    session = find_session(request_device_id())
+    return history_response(session.glucose_history if session else None, "glucose_history")
 
 @app.route("/ecgnumbers")
 def get_ecg_numbers():
-    return jsonify({"numbers": list(latest_ecg_numbers)})
+    """
+    Buffered ECG samples. Every sample has a sequence number (its index
+    in the device's stream), so dashboards can poll incrementally:
+
+      ?since=<seq>        only samples with seq >= since; pass back next_seq
+      ?max_points=<n>     min/max-decimated view (keeps the envelope)
+      ?format=binary      ecg_wire frame (float32) instead of JSON, with the
+                          cursor in X-First-Seq / X-Next-Seq headers
+
+    A cursor newer than the stream (e.g. after a restart) returns the
+    whole buffer with "reset": true.
+    """
+    device = request_device_id()
+    since = request.args.get("since", type=int)
+    if since is not None:
+        since = max(since, 0)
+    max_points = request.args.get("max_points", type=int)
+    binary = (request.args.get("format") == "binary"
+              or request.accept_mimetypes.best == ecg_wire.CONTENT_TYPE)
+
+    session = find_session(device)
+    reset = False
+    if session is None:
+        numbers, first_seq, next_seq, ts = np.empty(0, np.float32), 0, 0, time.time()
+    else:
+        with session.lock:
+            ring = session.ecg
+            if since is not None and since > ring.total:
+                reset, since = True, None
+            first_seq, numbers = ring.since(since or 0)
+            # a shared ring may have grown since ring.total was read
+            next_seq = first_seq + numbers.size
+            # the frame carries the time of its first sample; the newest
+            # one arrived at last_ecg_time
+            ts = session.last_ecg_time - (next_seq - first_seq) / FS
+
+    count = int(numbers.size)
+    # samples between the cursor and the oldest retained one were overwritten
+    dropped = first_seq - since if since is not None else 0
+    decimated = max_points is not None and 0 < max_points < count
+    if decimated:
+        numbers = minmax_decimate(numbers, max_points)
+
+    if binary:
+        frame = ecg_wire.encode_frame(device, numbers, FS, ts, first_seq)
+        return Response(frame, mimetype=ecg_wire.CONTENT_TYPE, headers={
+            "X-First-Seq": str(first_seq),
+            "X-Next-Seq": str(next_seq),
+            "X-Samples": str(count),
+            "X-Dropped": str(dropped),
+            "X-Decimated": "1" if decimated else "0",
+            "X-Reset": "1" if reset else "0",
+        })
+
+    return jsonify({
+        "numbers": numbers.tolist(),
+        "first_seq": first_seq,
+        "next_seq": next_seq,
+        "samples": count,
+        "dropped": dropped,
+        "decimated": decimated,
+        "reset": reset,
+    })
+
+@app.route("/ecg_plot")
+def get_ecg_plot():
+    """
+    Last 10 s of ECG, rendered on request: ?format=png (default) returns
+    image/png, ?format=json a min/max-downsampled series (?max_points=200).
+    """
+    device = request_device_id()
+    session = find_session(device)
+    if session is None:
+        return jsonify({"error": "unknown device"}), 404
+    with session.lock:
+        strip = session.ecg.latest(PLOT_SAMPLES)
+        version = session.ecg.total
+    if strip.size == 0:
+        return jsonify({"error": "no ECG data"}), 404
+
+    if request.args.get("format") == "json":
+        max_points = request.args.get("max_points", 200, type=int)
+        return jsonify({
+            "fs": FS,
+            "samples": int(strip.size),
+            "series": minmax_decimate(strip, max_points).tolist(),
+        })
+
+    png = plot_renderer.png(device, version, strip)
+    return Response(png, mimetype="image/png")
+
+@app.route("/ingest_stats")
+def get_ingest_stats():
+    """Sequenced ingest of the device: high-water mark, duplicates, gaps."""
+    device = request_device_id()
+    session = find_session(device)
+    if session is None:
+        return jsonify({"device_id": device, "ingest": None})
+    return jsonify({"device_id": device, "ingest": session.stream_seq.stats()})
+
+@app.route("/resp_quality")
+def get_resp_quality():
+    """
+    Quality-gate result of the device's newest windows (?last=, default
+    all kept): "result" is "pass" or the reject reason. shm: answered by
+    the analysis owner only, like /events.
+    """
+    session = registry.get(request_device_id())
+    if session is None:
+        return jsonify({"windows": []})
+    with session.lock:
+        windows = list(session.quality)
+    last = request.args.get("last", type=int)
+    if last is not None:
+        windows = windows[-last:] if last > 0 else []
+    return jsonify({"windows": windows})
+
+@app.route("/nk_stats")
+def get_nk_stats():
+    return jsonify(scheduler.stats)
+
+@app.route("/metrics")
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route("/logs")
 def get_logs():
@@ -217,12 +898,21 @@ def get_logs():
 
 @app.route("/clear_all", methods=["POST"])
 def clear_all():
-    ecg_buffer.clear()
-    latest_ecg_numbers.clear()
-    resp_rate_history.clear()
-    global latest_rr_1min
-    latest_rr_1min = None
-    log("[API] All buffers cleared")
+    device = request.args.get("device_id")
+    if device:
+        sessions = [s for s in [find_session(device)] if s is not None]
+    else:
+        if rings is not None:
+            for dev in rings.devices():
+                find_session(dev)
+        sessions = registry.sessions()
+
+    for session in sessions:
+        session.clear_all()
+        if rings is not None:
+            # the analysis owner drops its history on the next sync
+            session.ecg.clear(history=True)
+    log(f"[API][{device}] Buffers cleared" if device else "[API] All buffers cleared")
     return jsonify({"status": "cleared"})
 
 @app.route("/")
@@ -230,20 +920,111 @@ def health():
     return "Server running"
 
 # ======================================================
-# START BACKGROUND THREADS
+# PUSH (SERVER-SENT EVENTS)
 # ======================================================
-threading.Thread(target=neurokit_worker, daemon=True).start()
-threading.Thread(target=ecg_auto_clear_loop, daemon=True).start()
+# One streaming response per client holds a worker thread, so run
+# gunicorn with threads (e.g. -k gthread --threads 64) or gevent.
+PUSH_TOPICS = {"rr_hop", "resp_rate", "glucose", "ecg", "log"}
+PUSH_KEEPALIVE_SEC = 15
 
-# ======================================================
-# LOCAL DEV ONLY
-# ======================================================
-if __name__ == "__main__":
-    print("Run with gunicorn in production")
+@app.route("/events")
+def events():
+    """
+    Live updates as text/event-stream instead of polling.
 
+      ?device_id=a,b      only these devices (default: all)
+      ?topics=rr_hop,...  subset of rr_hop, resp_rate, glucose, ecg, log
 
+    Each event's data is JSON with device_id and server time "t". Slow
+    clients get the latest value per device/topic rather than a backlog;
+    ECG events carry first_seq/next_seq, so a gap can be filled from
+    /ecgnumbers?since=.
+    """
+    devices = request.args.get("device_id")
+    devices = set(devices.split(",")) if devices else None
+    topics = request.args.get("topics")
+    topics = set(topics.split(",")) if topics else None
+    if topics is not None and not topics <= PUSH_TOPICS:
+        return jsonify({"error": f"unknown topics: {sorted(topics - PUSH_TOPICS)}"}), 400
 
+    sub = hub.subscribe(devices, topics)
+    if sub is None:
+        return jsonify({"error": "too many subscribers"}), 503
 
+    def stream():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                batch = sub.get(timeout=PUSH_KEEPALIVE_SEC)
+                if sub.closed:
+                    return
+                yield b"".join(batch) if batch else b": keepalive\n\n"
+        finally:
+            hub.unsubscribe(sub)
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route("/push_stats")
+def push_stats():
+    return jsonify(hub.stats)
+
+# ======================================================
+# START BACKGROUND THREADS
+# ======================================================
+# Nothing starts at import, so the app can be imported once in a
+# preloading gunicorn master and forked: threads do not survive fork.
+# gunicorn.conf.py's post_fork hook calls start_background() in each
+# worker; other servers get it from the first request.
+_started_pid = None
+_start_lock = threading.Lock()
 
+def start_analysis():
+    threading.Thread(target=neurokit_worker, daemon=True).start()
+    threading.Thread(target=ecg_auto_clear_loop, daemon=True).start()
+    restore_history()
+    threading.Thread(target=history_snapshot_loop, daemon=True).start()
+    atexit.register(snapshot_history)
 
+def analysis_election_loop():
+    """
+    shm backend: the worker that takes the owner lock runs the analysis.
+    Until then this worker serves history from the owner's snapshots.
+    """
+    snapshot_mtime = None
+    while not owner.try_acquire():
+        try:
+            mtime = os.path.getmtime(HISTORY_SNAPSHOT)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != snapshot_mtime:
+            snapshot_mtime = mtime
+            restore_history(announce=False)
+        time.sleep(OWNER_POLL_SEC)
+    log(f"[SHM] Worker {os.getpid()} is the analysis owner")
+    start_analysis()
 
+def start_background():
+    """Start this process's background threads (once per process)."""
+    global _started_pid
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    if owner is None:
+        start_analysis()
+    else:
+        threading.Thread(target=analysis_election_loop, daemon=True).start()
+
+@app.before_request
+def _ensure_background():
+    if _started_pid != os.getpid():
+        start_background()
+
+# ======================================================
+# LOCAL DEV ONLY
+# ======================================================
+if __name__ == "__main__":
+    print("Run with gunicorn in production")
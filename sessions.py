@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from ring_buffer import EcgRingBuffer
+from stream_seq import StreamSeq
+from timeseries import TieredSeries
+
+
+class DeviceSession:
+    """All per-device state: ECG ring, RR / glucose history and worker state."""
+
+    def __init__(self, device_id, ecg_capacity, history_size, ecg=None, stream_seq=None,
+                 quality_size=60):
+        self.device_id = device_id
+        self.lock = threading.Lock()
+
+        # `ecg` lets the server pass a ring shared between processes
+        self.ecg = ecg if ecg is not None else EcgRingBuffer(ecg_capacity)
+        # ingest high-water mark / gap index; survives clears, so a retried
+        # batch is still recognised after /clear_all
+        self.stream_seq = stream_seq if stream_seq is not None else StreamSeq()
+        self.last_ecg_time = time.time()
+
+        self.latest_rr_1min = None
+        self.resp_rate_history = TieredSeries(raw_capacity=history_size)
+
+        self.latest_glucose = None
+        self.glucose_history = TieredSeries(raw_capacity=history_size)
+
+        # ---- respiration worker state ----
+        self.resp_engine = None     # IncrementalRespiration, built lazily
+        self.hop_clock = None       # HopClock, built on the first full window
+        self.due_since = None       # monotonic time the pending window became due
+        self.rr_window = []         # holds 10-sec RR values (or 0)
+        self.rr_minute = None       # data minute (by sample count) rr_window is for
+        self.quality = deque(maxlen=quality_size)  # newest quality-gate results, per window
+
+    def clear_ecg(self):
+        with self.lock:
+            self.ecg.clear()
+            self.resp_engine = None
+            self.hop_clock = None
+            self.due_since = None
+            self.latest_rr_1min = None
+            self.rr_window.clear()
+            self.rr_minute = None
+            self.quality.clear()
+
+    def clear_all(self):
+        with self.lock:
+            self.ecg.clear()
+            self.resp_engine = None
+            self.hop_clock = None
+            self.due_since = None
+            self.latest_rr_1min = None
+            self.rr_window.clear()
+            self.rr_minute = None
+            self.quality.clear()
+            self.resp_rate_history.clear()
+
+
+class SessionRegistry:
+    """
+    device_id -> DeviceSession, capped at `max_devices`.
+
+    Sessions are kept in least-recently-used order; when the registry is
+    full the device that has been silent the longest is evicted, so memory
+    stays bounded however many sensors have ever connected.
+    """
+
+    def __init__(self, max_devices, ecg_capacity, history_size, on_evict=None,
+                 ring_factory=None, seq_factory=None):
+        self.max_devices = max_devices
+        self.ecg_capacity = ecg_capacity
+        self.history_size = history_size
+        self.on_evict = on_evict
+        self.ring_factory = ring_factory    # device_id -> ECG ring, default private
+        self.seq_factory = seq_factory      # device_id -> StreamSeq, default private
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, device_id):
+        return self._sessions.get(device_id)
+
+    def get_or_create(self, device_id):
+        evicted = None
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is None:
+                if len(self._sessions) >= self.max_devices:
+                    _, evicted = self._sessions.popitem(last=False)
+                session = DeviceSession(
+                    device_id, self.ecg_capacity, self.history_size,
+                    self.ring_factory(device_id) if self.ring_factory else None,
+                    self.seq_factory(device_id) if self.seq_factory else None,
+                )
+                self._sessions[device_id] = session
+            else:
+                self._sessions.move_to_end(device_id)
+
+        if evicted is not None and self.on_evict is not None:
+            self.on_evict(evicted)
+        return session
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def device_ids(self):
+        with self._lock:
+            return list(self._sessions.keys())
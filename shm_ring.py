@@ -0,0 +1,485 @@
+"""
+Shared-memory ECG rings, so several gunicorn workers can ingest into one
+consistent stream per device (server.py with ECG_BACKEND=shm).
+
+One POSIX shared-memory segment holds a fixed table of device slots.
+Each slot has a float32 ring plus a small header (device id, samples
+written, clear mark, last write time, latest published RR and glucose)
+and the device's ingest sequence state (stream_seq.py).
+Sample k of a device lives at index k % capacity, so the sequence
+numbers are the same as EcgRingBuffer's.
+
+Writes to a slot are serialized across processes with an fcntl
+byte-range lock per slot (and a thread lock inside each process) and
+bracketed by a seqlock: the slot's counter is odd while a write is in
+progress. Readers take no lock; they copy, then retry if the counter
+moved. NumPy stores are not fenced, which is sound on x86-64 (stores
+become visible in program order).
+
+An AnalysisOwner flock elects the single worker that runs the
+respiration analysis; if it dies the kernel drops the lock and another
+worker takes over.
+"""
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from stream_seq import FIELDS as SEQ_FIELDS, MAX_GAPS, StreamSeq
+
+NAME_BYTES = 64
+DIRECTORY = -1              # lock index of the slot table itself
+SEQLOCK_RETRIES = 10000
+
+
+def _untrack(shm):
+    # every worker attaches; none of them may unlink the segment when it
+    # exits (Python < 3.13 resource_tracker would)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class SlotLocks:
+    """Exclusive per-slot locks, across processes and threads."""
+
+    def __init__(self, path, n_slots):
+        self.path = path
+        self.n_slots = n_slots
+        self._pid = None
+
+    def _ensure_open(self):
+        # fcntl locks belong to the process: reopen after a fork
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._threads = [threading.Lock() for _ in range(self.n_slots + 1)]
+            self._pid = os.getpid()
+
+    @contextmanager
+    def hold(self, slot):
+        self._ensure_open()
+        byte = slot + 1     # DIRECTORY -> byte 0
+        with self._threads[byte]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, byte)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, byte)
+
+
+class SharedRings:
+    """
+    `max_devices` rings of `capacity` float32 samples in the shared-memory
+    segment `name`, created by whichever process gets there first.
+    Devices beyond `max_devices` take over the least recently written slot.
+    """
+
+    def __init__(self, name, max_devices, capacity, lock_dir=None):
+        self.name = name
+        self.max_devices = max_devices
+        self.capacity = capacity
+
+        n = max_devices
+        fields = [
+            ("names", f"S{NAME_BYTES}", (n,)),
+            ("seq", "<u8", (n,)),           # seqlock counter
+            ("total", "<i8", (n,)),         # samples ever written
+            ("cleared", "<i8", (n,)),       # total at the last clear
+            ("clears", "<i8", (n,)),        # /clear_all requests (history too)
+            ("last_write", "<f8", (n,)),
+            ("rr_1min", "<f8", (n,)),       # published by the analysis owner
+            ("glucose", "<f8", (n, 3)),     # value, server time, device timestamp
+            ("glucose_n", "<i8", (n,)),
+            ("seq_state", "<i8", (n, len(SEQ_FIELDS))),
+            ("seq_gaps", "<i8", (n, MAX_GAPS, 2)),
+            ("data", "<f4", (n, capacity)),
+        ]
+        size = sum(np.dtype(dt).itemsize * int(np.prod(shape)) for _, dt, shape in fields)
+
+        self.shm = self._open(name, size)
+        offset = 0
+        for field, dt, shape in fields:
+            arr = np.ndarray(shape, dtype=dt, buffer=self.shm.buf, offset=offset)
+            setattr(self, field, arr)
+            offset += arr.nbytes
+
+        lock_dir = lock_dir or tempfile.gettempdir()
+        self.locks = SlotLocks(os.path.join(lock_dir, f"{name}.lock"), n)
+        # held across admit + append of a sequenced batch (see SharedStreamSeq)
+        self.ingest_locks = SlotLocks(os.path.join(lock_dir, f"{name}.ingest.lock"), n)
+        self._slots = {}            # device -> slot, per-process cache
+
+    @staticmethod
+    def _open(name, size):
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # another worker is creating it: wait until it is sized
+            for _ in range(100):
+                try:
+                    shm = shared_memory.SharedMemory(name)
+                    if shm.size >= size:
+                        break
+                    shm.close()
+                except ValueError:
+                    pass
+                time.sleep(0.05)
+            else:
+                raise ValueError(f"shared memory {name!r} exists with a different layout")
+        _untrack(shm)
+        return shm
+
+    @classmethod
+    def unlink(cls, name):
+        """Remove the segment (e.g. from gunicorn's master on start / exit)."""
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()    # also drops the resource_tracker entry
+
+    def reset(self):
+        """Forget every device (a preloading gunicorn master, before forking)."""
+        with self.locks.hold(DIRECTORY):
+            self.names[:] = b""
+            self.total[:] = 0
+            self.cleared[:] = 0
+            self.glucose_n[:] = 0
+            self.seq_state[:] = 0
+        self._slots.clear()
+
+    # ---------------- slot table ----------------
+
+    def devices(self):
+        return [n.decode() for n in self.names if n]
+
+    def find(self, device):
+        """Slot of `device`, or None."""
+        key = device.encode()[:NAME_BYTES]
+        slot = self._slots.get(device)
+        if slot is not None and self.names[slot] == key:
+            return slot
+        hits = np.flatnonzero(self.names == key)
+        if hits.size == 0:
+            return None
+        self._slots[device] = slot = int(hits[0])
+        return slot
+
+    def slot(self, device):
+        """Slot of `device`, allocated (or taken from the LRU device) if needed."""
+        slot = self.find(device)
+        if slot is not None:
+            return slot
+        key = device.encode()[:NAME_BYTES]
+        with self.locks.hold(DIRECTORY):
+            hits = np.flatnonzero(self.names == key)
+            if hits.size:
+                slot = int(hits[0])
+            else:
+                free = np.flatnonzero(self.names == b"")
+                slot = int(free[0]) if free.size else int(np.argmin(self.last_write))
+                with self.write(slot):
+                    self.names[slot] = key
+                    self.total[slot] = 0
+                    self.cleared[slot] = 0
+                    self.clears[slot] = 0
+                    self.last_write[slot] = time.time()
+                    self.rr_1min[slot] = np.nan
+                    self.glucose[slot] = np.nan
+                    self.glucose_n[slot] = 0
+                    self.seq_state[slot] = 0
+        self._slots[device] = slot
+        return slot
+
+    # ---------------- seqlock ----------------
+
+    @contextmanager
+    def write(self, slot):
+        with self.locks.hold(slot):
+            self.seq[slot] += 1         # odd: write in progress
+            try:
+                yield
+            finally:
+                self.seq[slot] += 1
+
+    def read(self, slot, fn):
+        """fn(slot) retried until no write overlapped it."""
+        for _ in range(SEQLOCK_RETRIES):
+            before = int(self.seq[slot])
+            if before & 1:
+                time.sleep(0)
+                continue
+            result = fn(slot)
+            if int(self.seq[slot]) == before:
+                return result
+        raise RuntimeError(f"seqlock: slot {slot} kept changing")
+
+    # ---------------- published values ----------------
+
+    def ring(self, device):
+        return SharedEcgRing(self, device)
+
+    def stream_seq(self, device):
+        return SharedStreamSeq(self, device)
+
+    def set_rr_1min(self, device, value):
+        slot = self.find(device)
+        if slot is None:
+            return
+        with self.write(slot):
+            self.rr_1min[slot] = np.nan if value is None else value
+
+    def rr_1min_of(self, device):
+        slot = self.find(device)
+        if slot is None:
+            return None
+        value = float(self.rr_1min[slot])
+        return None if np.isnan(value) else value
+
+    def set_glucose(self, device, glucose, timestamp):
+        try:
+            ts = float(timestamp)
+        except (TypeError, ValueError):
+            ts = np.nan
+        slot = self.slot(device)
+        with self.write(slot):
+            self.glucose[slot] = (glucose, time.time(), ts)
+            self.glucose_n[slot] += 1
+
+    def glucose_of(self, device):
+        """(count, value, server time, device timestamp) or None."""
+        slot = self.find(device)
+        if slot is None:
+            return None
+        n, (value, t, ts) = self.read(
+            slot, lambda s: (int(self.glucose_n[s]), self.glucose[s].copy())
+        )
+        if n == 0:
+            return None
+        return n, float(value), float(t), None if np.isnan(ts) else float(ts)
+
+    def close(self):
+        for field in ("names", "seq", "total", "cleared", "clears", "last_write",
+                      "rr_1min", "glucose", "glucose_n", "seq_state", "seq_gaps", "data"):
+            setattr(self, field, None)
+        self.shm.close()
+
+
+class SharedEcgRing:
+    """
+    EcgRingBuffer's interface over one device's shared slot. Reads return
+    copies (never views into shared memory, which a writer may change).
+    Only extend() claims a slot; reading a device that has none (never
+    written, or taken over by another device) sees an empty ring, so
+    /metrics or a snapshot restore cannot evict live devices.
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, rings, device):
+        self.rings = rings
+        self.device = device
+        self.capacity = rings.capacity
+
+    def _slot(self):
+        """Slot of the device, None if it has none (reads as empty)."""
+        return self.rings.find(self.device)
+
+    # ---------------- state ----------------
+
+    @property
+    def total(self):
+        slot = self._slot()
+        return 0 if slot is None else int(self.rings.total[slot])
+
+    @property
+    def first_seq(self):
+        slot = self._slot()
+        if slot is None:
+            return 0
+        return self.rings.read(slot, lambda s: self._first(s, int(self.rings.total[s])))
+
+    def _first(self, slot, total):
+        return max(total - self.capacity, int(self.rings.cleared[slot]))
+
+    def __len__(self):
+        slot = self._slot()
+        if slot is None:
+            return 0
+        return self.rings.read(slot, lambda s: self._size(s))
+
+    def _size(self, slot):
+        total = int(self.rings.total[slot])
+        return total - self._first(slot, total)
+
+    @property
+    def last_write(self):
+        slot = self._slot()
+        return 0.0 if slot is None else float(self.rings.last_write[slot])
+
+    @property
+    def clears(self):
+        slot = self._slot()
+        return 0 if slot is None else int(self.rings.clears[slot])
+
+    # ---------------- writing ----------------
+
+    def append(self, value):
+        self.extend((value,))
+
+    def extend(self, values, dtype=None):
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            arr = np.frombuffer(values, dtype=dtype or self.dtype)
+        else:
+            arr = np.asarray(values, dtype=dtype or self.dtype).ravel()
+        if arr.size == 0:
+            return
+        # a batch larger than the ring: only its tail is kept
+        skipped = max(arr.size - self.capacity, 0)
+        arr = arr[skipped:]
+
+        rings = self.rings
+        slot = rings.slot(self.device)
+        data = rings.data[slot]
+        with rings.write(slot):
+            total = int(rings.total[slot]) + skipped
+            start = total % self.capacity
+            first = min(arr.size, self.capacity - start)
+            data[start:start + first] = arr[:first]
+            data[:arr.size - first] = arr[first:]
+            rings.total[slot] = total + arr.size
+            rings.last_write[slot] = time.time()
+
+    def clear(self, history=False):
+        rings = self.rings
+        slot = self._slot()
+        if slot is None:
+            return
+        with rings.write(slot):
+            rings.cleared[slot] = rings.total[slot]
+            if history:
+                rings.clears[slot] += 1
+
+    # ---------------- reading ----------------
+
+    def _copy(self, slot, start, end, out):
+        data = self.rings.data[slot]
+        i = start % self.capacity
+        n = end - start
+        first = min(n, self.capacity - i)
+        out[:first] = data[i:i + first]
+        out[first:n] = data[:n - first]
+        return out[:n]
+
+    def latest(self, n=None, dtype=None, out=None):
+        def read(slot):
+            total = int(self.rings.total[slot])
+            size = total - self._first(slot, total)
+            k = size if n is None or n > size else max(n, 0)
+            dst = out if out is not None else np.empty(k, dtype=dtype or self.dtype)
+            return self._copy(slot, total - k, total, dst)
+        slot = self._slot()
+        if slot is None:
+            return out[:0] if out is not None else np.empty(0, dtype=dtype or self.dtype)
+        return self.rings.read(slot, read)
+
+    def latest_slices(self, n=None):
+        return (self.latest(n),)
+
+    def latest_view(self, n=None):
+        return self.latest(n)
+
+    def window(self, end, n, dtype=None, out=None):
+        def read(slot):
+            total = int(self.rings.total[slot])
+            start = end - n
+            if start < self._first(slot, total) or end > total:
+                raise IndexError(f"samples {start}..{end} not in ring")
+            dst = out if out is not None else np.empty(n, dtype=dtype or self.dtype)
+            return self._copy(slot, start, end, dst)
+        slot = self._slot()
+        if slot is None:
+            raise IndexError(f"samples {end - n}..{end} not in ring")
+        return self.rings.read(slot, read)
+
+    def since(self, seq, dtype=None):
+        def read(slot):
+            total = int(self.rings.total[slot])
+            first = max(seq, self._first(slot, total))
+            n = max(total - first, 0)
+            return first, self._copy(slot, first, first + n, np.empty(n, dtype or self.dtype))
+        slot = self._slot()
+        if slot is None:
+            return max(seq, 0), np.empty(0, dtype or self.dtype)
+        return self.rings.read(slot, read)
+
+
+class SharedStreamSeq:
+    """
+    StreamSeq over one device's shared slot. admit() is only called
+    inside locked(), which holds the slot's ingest lock so the batch's
+    admission and append are atomic across workers. Like the ring, only
+    ingest (locked()) claims a slot; reads of a device without one see a
+    fresh state.
+    """
+
+    def __init__(self, rings, device):
+        self.rings = rings
+        self.device = device
+
+    def _view(self, claim=False):
+        slot = self.rings.slot(self.device) if claim else self.rings.find(self.device)
+        if slot is None:
+            return None, StreamSeq()
+        return slot, StreamSeq(self.rings.seq_state[slot], self.rings.seq_gaps[slot])
+
+    @property
+    def next_seq(self):
+        return self._view()[1].next_seq
+
+    @contextmanager
+    def locked(self):
+        slot, view = self._view(claim=True)
+        with self.rings.ingest_locks.hold(slot):
+            yield view
+
+    def stats(self):
+        return self._view()[1].stats()
+
+
+class AnalysisOwner:
+    """
+    Non-blocking exclusive flock on `<lock_dir>/<name>.owner`: the worker
+    holding it runs the analysis. Released by the kernel when the holder
+    exits, however it exits.
+    """
+
+    def __init__(self, name, lock_dir=None):
+        lock_dir = lock_dir or tempfile.gettempdir()
+        self.path = os.path.join(lock_dir, f"{name}.owner")
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
@@ -0,0 +1,114 @@
+"""
+Per-device high-water mark and gap index for sequenced ECG ingest.
+
+The proxy numbers every sample it receives per device (`seq` of a batch
+is the number of its first sample) and tags the numbering with a
+`stream` id that changes when the proxy restarts without its spool.
+Given those, the server can place each batch in O(1):
+
+    end <= next_seq          already received: drop (duplicate, or late
+                             if it falls in a recorded gap)
+    seq < next_seq < end     retry overlapping what we have: drop the head
+    seq == next_seq          in order
+    seq > next_seq           samples seq - next_seq .. seq were lost:
+                             recorded in the gap index
+
+A new stream id restarts the numbering. Stream 0 is reserved for "none
+yet", so zero-filled memory is a valid empty state.
+
+The state is a small int64 vector plus a ring of the last MAX_GAPS gaps,
+so it can live in ordinary arrays (one process) or in a shared-memory
+slot (shm_ring.py, several workers). Callers serialize admit() with the
+append that follows it.
+"""
+from contextlib import nullcontext
+
+import numpy as np
+
+FIELDS = (
+    "stream", "next_seq", "batches", "samples",
+    "duplicate_batches", "duplicate_samples", "late_samples",
+    "gaps", "gap_samples", "restarts",
+)
+MAX_GAPS = 32
+
+_F = {name: i for i, name in enumerate(FIELDS)}
+
+
+def empty_state(max_gaps=MAX_GAPS):
+    return np.zeros(len(FIELDS), dtype=np.int64), np.zeros((max_gaps, 2), dtype=np.int64)
+
+
+class StreamSeq:
+    """Sequence state of one device over `counters` / `gaps` arrays (fresh if omitted)."""
+
+    def __init__(self, counters=None, gaps=None):
+        if counters is None:
+            counters, gaps = empty_state()
+        self.counters = counters
+        self.gaps = gaps            # (start seq, samples), ring indexed by gap count
+
+    @property
+    def next_seq(self):
+        return int(self.counters[_F["next_seq"]])
+
+    def locked(self):
+        """Context in which admit() + the append are atomic (the session lock suffices here)."""
+        return nullcontext(self)
+
+    def admit(self, stream, seq, n):
+        """
+        Place a batch of `n` samples numbered from `seq`. Returns
+        (skip, gap): drop the first `skip` samples (skip == n: the whole
+        batch was already received), and `gap` samples are missing
+        right before the batch.
+        """
+        c = self.counters
+        end = seq + n
+        c[_F["batches"]] += 1
+
+        if stream != c[_F["stream"]]:
+            if c[_F["stream"]] != 0:
+                c[_F["restarts"]] += 1
+            c[_F["stream"]] = stream
+            c[_F["next_seq"]] = end
+            c[_F["samples"]] += n
+            return 0, 0
+
+        hwm = int(c[_F["next_seq"]])
+        if end <= hwm:
+            if self._in_gap(seq, end):
+                c[_F["late_samples"]] += n
+            else:
+                c[_F["duplicate_batches"]] += 1
+                c[_F["duplicate_samples"]] += n
+            return n, 0
+
+        skip = max(hwm - seq, 0)
+        gap = max(seq - hwm, 0)
+        if skip:
+            c[_F["duplicate_samples"]] += skip
+        if gap:
+            self.gaps[int(c[_F["gaps"]]) % len(self.gaps)] = (hwm, gap)
+            c[_F["gaps"]] += 1
+            c[_F["gap_samples"]] += gap
+        c[_F["next_seq"]] = end
+        c[_F["samples"]] += n - skip
+        return skip, gap
+
+    def _in_gap(self, start, end):
+        k = min(int(self.counters[_F["gaps"]]), len(self.gaps))
+        g = self.gaps[:k]
+        return bool(np.any((g[:, 0] < end) & (start < g[:, 0] + g[:, 1])))
+
+    def stats(self):
+        """Counters plus the recorded gaps, oldest first."""
+        counters = self.counters.copy()
+        gaps = self.gaps.copy()
+        out = {name: int(counters[i]) for i, name in enumerate(FIELDS)}
+        n = out["gaps"]
+        k = min(n, len(gaps))
+        order = np.arange(n - k, n) % len(gaps)
+        out["recent_gaps"] = [{"seq": int(s), "samples": int(g)} for s, g in gaps[order]]
+        return out
+
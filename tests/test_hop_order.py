@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("HISTORY_SNAPSHOT", os.path.join(tempfile.mkdtemp(), "history.npz"))
+
+import server
+
+
+@pytest.fixture
+def session():
+    s = server.registry.get_or_create(f"hop-order-{time.monotonic_ns()}")
+    s.ecg.extend(np.full(4000, 0.5, dtype=np.float32))
+    s.last_ecg_time = time.time()
+    return s
+
+
+@pytest.mark.parametrize("engine", ["incremental", "batch"])
+def test_rejected_window_recorded_in_order(monkeypatch, session, engine):
+    # a catch-up hop: windows ending at 3000 (minute 0), 3500 and 4000
+    # (minute 1), the middle one rejected by the quality gate
+    ends = [3000, 3500, 4000]
+    monkeypatch.setattr(server, "RESP_ENGINE", engine)
+    monkeypatch.setattr(server, "QUALITY_GATE", True)
+    monkeypatch.setattr(server, "gate_windows", lambda jobs: {(session, 3500): "dropout"})
+    monkeypatch.setattr(server, "incremental_rr", lambda s, end: (9.3, "ok"))
+    monkeypatch.setattr(
+        server, "batch_rr",
+        lambda windows, fs, threshold: (np.full(len(windows), 9.3), ["ok"] * len(windows)),
+    )
+
+    recorded = []
+    record_rr = server.record_rr
+    def spy(s, rr_val, status, end):
+        recorded.append((end, status))
+        record_rr(s, rr_val, status, end)
+    monkeypatch.setattr(server, "record_rr", spy)
+
+    server.run_hop([(session, list(ends))])
+
+    assert recorded == [(3000, "ok"), (3500, "dropout"), (4000, "ok")]
+    # minute 0 closed exactly once, by the first hop of minute 1
+    assert len(session.resp_rate_history) == 1
+    assert session.latest_rr_1min == server.minute_rr([9.3])
+    assert session.rr_minute == 1
+    assert list(session.rr_window) == [0.0, 9.3]
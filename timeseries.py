@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+MINUTE = 60.0
+HOUR = 3600.0
+
+RAW_COLUMNS = ("t", "value")
+BUCKET_COLUMNS = ("t", "count", "sum", "min", "max")
+
+
+class ColumnRing:
+    """
+    Fixed-capacity ring of float64 rows stored column-wise.
+
+    Storage starts small and doubles up to `capacity`, so a device that
+    only ever sent a handful of points does not pay for a year of buckets.
+    """
+
+    def __init__(self, columns, capacity, initial=64):
+        self.columns = columns
+        self.capacity = int(capacity)
+        self._data = np.empty((len(columns), min(initial, self.capacity)))
+        self._head = 0          # next write index once full
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, row):
+        if self._size < self.capacity:
+            if self._size == self._data.shape[1]:
+                grown = np.empty((len(self.columns), min(self._size * 2, self.capacity)))
+                grown[:, :self._size] = self._data[:, :self._size]
+                self._data = grown
+            self._data[:, self._size] = row
+            self._size += 1
+        else:
+            self._data[:, self._head] = row
+            self._head = (self._head + 1) % self.capacity
+
+    def last(self):
+        """View of the newest row (writable, for in-place bucket updates)."""
+        if self._size < self.capacity:
+            return self._data[:, self._size - 1]
+        return self._data[:, self._head - 1]
+
+    def ordered(self):
+        """All rows oldest first, shape (n_columns, n)."""
+        if self._size < self.capacity or self._head == 0:
+            return self._data[:, :self._size]
+        return np.concatenate((self._data[:, self._head:], self._data[:, :self._head]), axis=1)
+
+    def load(self, block):
+        block = np.asarray(block, dtype=float)[:, -self.capacity:]
+        self._data = np.empty((len(self.columns), max(block.shape[1], 1)))
+        self._data[:, :block.shape[1]] = block
+        self._size = block.shape[1]
+        self._head = 0
+
+    def clear(self):
+        self._size = 0
+        self._head = 0
+
+
+class TieredSeries:
+    """
+    Time series with retention tiers: raw points for `raw_retention`
+    seconds, then per-minute and per-hour buckets (count/sum/min/max) for
+    `minute_retention` / `hour_retention`.
+
+    Every append updates all three tiers in O(1), so "rolling up" is just
+    the finer tier ageing out; queries read whichever tier covers the
+    requested range.
+    """
+
+    TIERS = ("raw", "minute", "hour")
+
+    def __init__(self, raw_capacity=4096, raw_retention=24 * HOUR,
+                 minute_retention=7 * 24 * HOUR, hour_retention=365 * 24 * HOUR):
+        self.retention = {
+            "raw": raw_retention,
+            "minute": minute_retention,
+            "hour": hour_retention,
+        }
+        self.raw = ColumnRing(RAW_COLUMNS, raw_capacity)
+        self.minute = ColumnRing(BUCKET_COLUMNS, int(minute_retention // MINUTE) + 1)
+        self.hour = ColumnRing(BUCKET_COLUMNS, int(hour_retention // HOUR) + 1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.raw)
+
+    def append(self, t, value):
+        with self._lock:
+            self.raw.append((t, value))
+            self._bucket(self.minute, MINUTE, t, value)
+            self._bucket(self.hour, HOUR, t, value)
+
+    @staticmethod
+    def _bucket(ring, width, t, value):
+        start = t - t % width
+        if len(ring):
+            row = ring.last()
+            if row[0] == start:
+                row[1] += 1
+                row[2] += value
+                row[3] = min(row[3], value)
+                row[4] = max(row[4], value)
+                return
+        ring.append((start, 1, value, value, value))
+
+    def values(self):
+        """Raw values only, oldest first (the old list-style history)."""
+        with self._lock:
+            return self.raw.ordered()[1].tolist()
+
+    def query(self, start=None, end=None, resolution="auto"):
+        """
+        Points in [start, end] (epoch seconds; None = open). `resolution`
+        is raw / minute / hour, or auto for the finest tier whose
+        retention reaches back to `start`.
+        """
+        with self._lock:
+            latest = self._latest()
+            if resolution == "auto":
+                age = 0.0 if start is None or latest is None else latest - start
+                resolution = "hour"
+                for tier in self.TIERS:
+                    if age <= self.retention[tier]:
+                        resolution = tier
+                        break
+            if resolution not in self.TIERS:
+                raise ValueError(f"unknown resolution: {resolution}")
+
+            block = getattr(self, resolution).ordered()
+            t = block[0]
+            lo = 0
+            if latest is not None:
+                lo = np.searchsorted(t, latest - self.retention[resolution], "left")
+            if start is not None:
+                lo = max(lo, np.searchsorted(t, start, "left"))
+            hi = len(t) if end is None else np.searchsorted(t, end, "right")
+            block = block[:, lo:hi]
+
+        if resolution == "raw":
+            return {"resolution": "raw", "t": block[0].tolist(), "value": block[1].tolist()}
+        count = block[1]
+        return {
+            "resolution": resolution,
+            "t": block[0].tolist(),
+            "mean": (block[2] / count).tolist(),
+            "min": block[3].tolist(),
+            "max": block[4].tolist(),
+            "count": count.astype(int).tolist(),
+        }
+
+    def _latest(self):
+        return float(self.raw.last()[0]) if len(self.raw) else None
+
+    def clear(self):
+        with self._lock:
+            self.raw.clear()
+            self.minute.clear()
+            self.hour.clear()
+
+    def state(self):
+        with self._lock:
+            return {tier: getattr(self, tier).ordered().copy() for tier in self.TIERS}
+
+    def load_state(self, state):
+        with self._lock:
+            for tier in self.TIERS:
+                if tier in state:
+                    getattr(self, tier).load(state[tier])
+
+
+def save_snapshot(path, series):
+    """
+    Write {(device_id, name): TieredSeries} to one .npz, atomically.
+    Keys are arbitrary strings, so they go in a JSON manifest and the
+    arrays are stored by index.
+    """
+    arrays, manifest = {}, []
+    for i, ((device, name), s) in enumerate(series.items()):
+        manifest.append([device, name])
+        for tier, block in s.state().items():
+            arrays[f"s{i}_{tier}"] = block
+    arrays["manifest"] = np.array(json.dumps(manifest))
+
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path):
+    """{(device_id, name): {tier: array}} from save_snapshot, {} if missing."""
+    if not os.path.isfile(path):
+        return {}
+    out = {}
+    with np.load(path) as data:
+        manifest = json.loads(str(data["manifest"]))
+        for i, (device, name) in enumerate(manifest):
+            out[(device, name)] = {
+                tier: data[f"s{i}_{tier}"]
+                for tier in TieredSeries.TIERS if f"s{i}_{tier}" in data
+            }
+    return out